@@ -1,14 +1,35 @@
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import ChatRequest, ChatResponse, Message
-from app.services.agent import agent_service
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, WebSocket, status
+from fastapi.responses import StreamingResponse
+from app.models.schemas import ChatRequest, ChatResponse, BatchChatRequest, Message, HistoryPage, FactDeletionReport
+from app.core.config import settings
+from app.core.runtime import runtime, ServiceNotReadyError
+from app.services import history_cursor
+from app.services.tool_executor import tool_executor
+from datetime import timezone
+from typing import Optional
+import hashlib
+import json
 
 router = APIRouter()
 
 
+async def get_agent_service():
+    """Dependency: the agent service, once the background startup has finished.
+
+    Modules that import langchain / langgraph / motor are imported inside the
+    handlers that need them; by then the runtime has already loaded them.
+    """
+    try:
+        return await runtime.wait_ready(settings.startup_wait_timeout)
+    except ServiceNotReadyError as e:
+        raise HTTPException(status_code=503, detail=f"服务正在启动，请稍后重试（{e}）", headers={"Retry-After": "5"})
+
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, agent_service=Depends(get_agent_service)):
     """Chat with the agent."""
+    from app.services.llm_gateway import LLMOverloadedError
+
     try:
         response, conversation_id = await agent_service.chat(
             message=request.message,
@@ -19,39 +40,209 @@ async def chat(request: ChatRequest):
             message=response,
             conversation_id=conversation_id
         )
+    except LLMOverloadedError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="模型服务繁忙，请稍后重试",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/conversations/{conversation_id}/history")
-async def get_history(conversation_id: str):
-    """Get conversation history."""
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, agent_service=Depends(get_agent_service)):
+    """Chat with the agent, streaming tokens and tool calls as Server-Sent Events."""
+    from app.services.llm_gateway import LLMOverloadedError
+
+    async def event_source():
+        try:
+            async for event in agent_service.chat_stream(
+                message=request.message,
+                conversation_id=request.conversation_id
+            ):
+                yield f"data: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        except LLMOverloadedError as e:
+            error = {"type": "error", "detail": "模型服务繁忙，请稍后重试", "retry_after": e.retry_after}
+            yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            error = {"type": "error", "detail": str(e)}
+            yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket, conversation_id: Optional[str] = None):
+    """Persistent chat session: concurrent turns, cancellation and streamed tokens over one socket."""
     try:
-        messages = await agent_service.get_conversation_history(conversation_id)
-
-        # Convert to simpler format
-        history = []
-        for msg in messages:
-            if isinstance(msg, str):
-                role = "assistant"
-                content = msg
-            elif hasattr(msg, 'type') and msg.type == 'human':
-                role = "user"
-                content = msg.content if hasattr(msg, 'content') else str(msg)
-            elif hasattr(msg, 'type') and msg.type == 'ai':
-                role = "assistant"
-                content = msg.content if hasattr(msg, 'content') else str(msg)
-            else:
-                # Fallback for other message types
-                role = "assistant"
-                content = str(msg)
-
-            history.append({
-                "role": role,
-                "content": content,
-                "timestamp": datetime.now().timestamp()
-            })
-
-        return {"conversation_id": conversation_id, "messages": history}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        agent_service = await runtime.wait_ready(settings.startup_wait_timeout)
+    except ServiceNotReadyError:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="service starting")
+        return
+
+    from app.services.chat_session import ChatSession
+
+    await ChatSession(
+        websocket,
+        agent_service,
+        conversation_id=conversation_id,
+        heartbeat_interval=settings.ws_heartbeat_interval,
+        max_concurrent_turns=settings.ws_max_concurrent_turns,
+        send_queue_size=settings.ws_send_queue_size
+    ).run()
+
+
+@router.post("/chat/batch")
+async def chat_batch(request: BatchChatRequest, agent_service=Depends(get_agent_service)):
+    """Run many chat turns, streaming one NDJSON result line per item as it completes."""
+    if len(request.items) > settings.batch_chat_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"批量请求最多 {settings.batch_chat_max_items} 条，收到 {len(request.items)} 条"
+        )
+
+    concurrency = min(request.concurrency or settings.batch_chat_default_concurrency, settings.batch_chat_max_concurrency)
+    timeout = request.timeout or settings.batch_chat_item_timeout
+    items = [item.model_dump() for item in request.items]
+
+    async def result_lines():
+        counts = {"ok": 0, "error": 0, "timeout": 0}
+        async for result in agent_service.chat_batch(items, concurrency=concurrency, item_timeout=timeout):
+            counts[result["status"]] += 1
+            yield json.dumps({"type": "result", **result}, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "summary", "total": len(items), **counts}) + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/conversations/{conversation_id}/history", response_model=HistoryPage)
+async def get_history(
+    conversation_id: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    since: Optional[str] = None,
+    agent_service=Depends(get_agent_service)
+):
+    """Get a page of conversation history (newest turns first page, `before` for older, `since` for new)."""
+    if before and since:
+        raise HTTPException(status_code=400, detail="before 和 since 不能同时使用")
+    try:
+        before_key = history_cursor.decode_cursor(before) if before else None
+        since_key = history_cursor.decode_cursor(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的游标")
+
+    memory = agent_service.mongo_memory
+    latest_key = await memory.get_latest_turn_key(conversation_id)
+    latest_cursor = history_cursor.encode_cursor(latest_key) if latest_key else None
+
+    # Turns are append-only, so the newest turn plus the query identifies the page
+    etag_source = f"{conversation_id}|{latest_cursor}|{limit}|{before}|{since}"
+    etag = f'W/"{hashlib.sha1(etag_source.encode()).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    page = await memory.get_conversation_page(conversation_id, limit=limit, before=before_key, since=since_key)
+    turns = page["turns"]
+
+    messages = []
+    for turn in turns:
+        timestamp = turn["timestamp"].replace(tzinfo=timezone.utc).timestamp() * 1000
+        messages.append(Message(role="user", content=turn["user_message"], timestamp=timestamp))
+        messages.append(Message(role="assistant", content=turn["assistant_response"], timestamp=timestamp))
+
+    next_cursor = None
+    if page["has_more"] and turns:
+        edge = turns[-1] if since_key else turns[0]
+        next_cursor = history_cursor.encode_cursor(history_cursor.turn_key(edge))
+
+    response.headers.update(headers)
+    return HistoryPage(
+        conversation_id=conversation_id,
+        messages=messages,
+        has_more=page["has_more"],
+        next_cursor=next_cursor,
+        latest_cursor=latest_cursor or since
+    )
+
+
+@router.delete("/conversations/{conversation_id}/facts", response_model=FactDeletionReport)
+async def delete_facts(conversation_id: str, query: str, dry_run: bool = False, agent_service=Depends(get_agent_service)):
+    """Delete long-term facts containing `query`; use dry_run=true to preview."""
+    return await agent_service.mongo_memory.delete_facts(conversation_id, query, dry_run=dry_run)
+
+
+@router.get("/facts/rules")
+async def get_fact_rules(agent_service=Depends(get_agent_service)):
+    """Get the active fact extraction rules and match counters."""
+    return agent_service.fact_rules.get_stats()
+
+
+@router.post("/facts/rules/reload")
+async def reload_fact_rules(agent_service=Depends(get_agent_service)):
+    """Re-read the fact rules file now instead of waiting for the change check."""
+    if not agent_service.fact_rules.path:
+        raise HTTPException(status_code=400, detail="未配置 FACT_RULES_PATH，正在使用内置规则")
+    if not agent_service.fact_rules.reload():
+        raise HTTPException(status_code=422, detail=f"规则文件加载失败：{agent_service.fact_rules.last_error}")
+    return agent_service.fact_rules.get_stats()
+
+
+@router.get("/facts/compaction")
+async def get_fact_compaction(agent_service=Depends(get_agent_service)):
+    """Get fact compaction counters and the last run's report."""
+    return agent_service.fact_compaction.get_stats()
+
+
+@router.post("/facts/compact")
+async def compact_facts(dry_run: bool = False, agent_service=Depends(get_agent_service)):
+    """Run fact compaction now (merge near-duplicates, decay, expire); use dry_run=true to preview."""
+    if not dry_run and not settings.fact_compaction_enabled:
+        raise HTTPException(status_code=400, detail="未启用长期记忆整理（FACT_COMPACTION_ENABLED=false），只能使用 dry_run=true 预览")
+    return await agent_service.fact_compaction.run_once(dry_run=dry_run, use_lease=False)
+
+
+@router.get("/intent/stats")
+async def get_intent_stats(agent_service=Depends(get_agent_service)):
+    """Get intent recognition counters (fast-path hit rate)."""
+    return agent_service.intent_recognizer.get_stats()
+
+
+@router.get("/db/stats", dependencies=[Depends(get_agent_service)])
+async def get_db_stats():
+    """Get MongoDB connection pool health and checkout wait times."""
+    from app.core.database import mongo_pool
+
+    return mongo_pool.get_stats()
+
+
+@router.get("/threads/stats")
+async def get_thread_stats(agent_service=Depends(get_agent_service)):
+    """Get per-thread counters (lock contention, coalesced messages, context compaction)."""
+    return {
+        "locks": agent_service.thread_locks.get_stats(),
+        "coalescer": agent_service.turn_coalescer.get_stats() if agent_service.turn_coalescer else None,
+        "compaction": agent_service.context_compactor.get_stats() if agent_service.context_compactor else None,
+    }
+
+
+@router.get("/tools/stats")
+async def get_tool_stats():
+    """Get tool executor counters (calls in flight, timeouts, CPU-limited calls)."""
+    return tool_executor.get_stats()
+
+
+@router.get("/llm/stats", dependencies=[Depends(get_agent_service)])
+async def get_llm_stats():
+    """Get LLM gateway admission counters (active, waiting, rate limited, retries)."""
+    from app.services.llm_gateway import llm_gateway
+
+    return llm_gateway.get_stats()
@@ -22,9 +22,125 @@ class Settings(BaseSettings):
     # Memory
     memory_db_path: str = "./data/memory.db"
 
+    # LLM gateway (shared admission control for every model call)
+    llm_max_concurrency: int = 32
+    llm_per_model_concurrency: int = 16
+    llm_queue_max_wait: float = 30
+    llm_max_retries: int = 3
+    llm_retry_base_delay: float = 1.0
+    llm_request_timeout: float = 60
+    # Prompt caching of static system prompts: "auto" (fall back if the endpoint rejects it), "on" or "off"
+    prompt_cache_mode: str = "auto"
+
+    # Intent recognition
+    intent_fast_path_enabled: bool = True
+    intent_fast_path_threshold: float = 0.9
+    intent_cache_enabled: bool = True
+    intent_cache_max_size: int = 1024
+    intent_cache_ttl_seconds: float = 3600
+
+    # Agent mode: "two_call" (intent LLM call + react agent) or "single_call"
+    # (memory commands are tools of the react agent, one model call per message)
+    agent_mode: str = "two_call"
+
+    # Chat pipeline
+    chat_pipeline_enabled: bool = True  # Run intent recognition and fact retrieval concurrently
+    chat_speculative_graph: bool = False  # Also start the react graph before the intent is known
+    chat_coalesce_enabled: bool = False  # Merge messages sent while a turn is running into the next turn
+
+    # Startup: build the agent service in the background after the server is up
+    # (requests wait up to startup_wait_timeout for it), or before serving at all
+    startup_in_background: bool = True
+    startup_wait_timeout: float = 30
+
+    # Agent tools run off the event loop: "thread" pool, or "process" pool (also enforces
+    # a per-call CPU limit and kills runaway calls on timeout)
+    tool_executor_mode: str = "thread"
+    tool_max_workers: int = 4
+    tool_timeout_seconds: float = 10
+    tool_cpu_seconds: float = 5
+    calculate_timeout_seconds: float = 2
+
+    # Context compaction: once a thread's unsummarized history passes the token budget,
+    # older turns are folded into a rolling summary and only the recent turns are sent verbatim
+    context_compaction_enabled: bool = True
+    context_token_budget: int = 4000
+    context_recent_turns: int = 4
+    context_summary_max_chars: int = 800
+
+    # WebSocket chat sessions
+    ws_heartbeat_interval: float = 20  # Server pings this often; silent clients are closed after 2 intervals
+    ws_max_concurrent_turns: int = 4
+    ws_send_queue_size: int = 256
+
+    # Batch chat endpoint (offline replays / evaluation sets)
+    batch_chat_max_items: int = 5000
+    batch_chat_max_concurrency: int = 16
+    batch_chat_default_concurrency: int = 4
+    batch_chat_item_timeout: float = 120
+
+    # Write-behind persistence (facts and conversations are flushed in batches)
+    write_behind_enabled: bool = True
+    write_behind_max_queue: int = 1000
+    write_behind_batch_size: int = 100
+    write_behind_flush_interval: float = 0.5
+
     # MongoDB
     mongodb_connection_string: str = "mongodb://localhost:27017"
     mongodb_database_name: str = "agent_memory"
+    mongodb_max_pool_size: int = 100
+    mongodb_min_pool_size: int = 0
+    mongodb_max_idle_time_ms: int = 0  # 0 = keep idle connections
+    mongodb_wait_queue_timeout_ms: int = 0  # 0 = wait for a free connection indefinitely
+    mongodb_connect_timeout_ms: int = 5000
+    mongodb_server_selection_timeout_ms: int = 5000
+    mongodb_read_preference: str = "primary"
+
+    # Per-thread fact cache ("mongo" invalidation keeps multiple workers in sync)
+    fact_cache_enabled: bool = True
+    fact_cache_top_n: int = 10
+    fact_cache_max_threads: int = 1000
+    fact_cache_max_bytes: int = 8 * 1024 * 1024
+    fact_cache_ttl_seconds: float = 300
+    fact_cache_invalidation: str = "none"
+
+    # Fact retrieval: "importance" (top facts by importance) or "relevance"
+    # (local embedding index queried with the current message, bounded by a token budget;
+    # indexes are rebuilt after FACT_CACHE_TTL_SECONDS like cached facts)
+    fact_retrieval_mode: str = "importance"
+    fact_context_token_budget: int = 400
+    fact_index_dim: int = 4096
+    fact_index_max_threads: int = 200
+
+    # Fact extraction rules: JSON file (see fact_rules.example.json); "" = built-in rules.
+    # The file is re-read when it changes, checked at most every reload interval
+    fact_rules_path: str = ""
+    fact_rules_reload_interval: float = 5
+
+    # Fact compaction: every interval, merge near-duplicate facts of a thread (MinHash
+    # similarity at or above the threshold), decay importance with the given half-life
+    # (except exempt fact types) and expire facts that fall below expire_importance.
+    # Off by default: it deletes facts
+    fact_compaction_enabled: bool = False
+    fact_compaction_interval: float = 3600
+    fact_compaction_similarity: float = 0.6
+    fact_compaction_num_perm: int = 64
+    fact_decay_half_life_days: float = 30  # 0 = no decay
+    fact_decay_exempt_types: str = "name,important_fact"
+    fact_expire_importance: float = 0.1
+    fact_expire_grace_days: float = 7
+
+    # Conversation storage: "documents" (one document per turn) or "buckets" (turns appended
+    # into one document per thread and time window; migrate existing data with
+    # scripts/migrate_conversation_buckets.py). Buckets idle past the archive horizon are
+    # moved to a compressed archive collection by the same script
+    conversation_storage: str = "documents"
+    conversation_bucket_hours: float = 24
+    conversation_bucket_max_turns: int = 200
+    conversation_archive_after_days: float = 30
+
+    # Short-term memory: "memory" (per-process MemorySaver) or "mongo" (shared across workers)
+    checkpointer_backend: str = "memory"
 
     model_config = {"protected_namespaces": ()}
 
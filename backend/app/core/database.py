@@ -0,0 +1,179 @@
+"""
+Shared MongoDB connection pool
+One Motor client per process, configured from settings and warmed up in the app lifespan
+"""
+import threading
+import time
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from app.core.config import settings
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool counters and checkout wait times from driver events.
+
+    Driver events fire on background threads, so counters are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0,
+        }
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _incr(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _record_wait(self, event):
+        # ``duration`` (seconds from checkout start) is reported by pymongo >= 4.7
+        duration = getattr(event, "duration", None)
+        if duration is None:
+            return
+        with self._lock:
+            self._wait_total += duration
+            self._wait_max = max(self._wait_max, duration)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._incr("pool_clears")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._incr("checkout_failures")
+        self._record_wait(event)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.stats["checkouts"] += 1
+            self.stats["checked_out"] += 1
+        self._record_wait(event)
+
+    def connection_checked_in(self, event):
+        self._incr("checked_out", -1)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            waits = stats["checkouts"] + stats["checkout_failures"]
+            stats["connections_open"] = stats["connections_created"] - stats["connections_closed"]
+            stats["checkout_wait_avg_ms"] = self._wait_total / waits * 1000 if waits else 0.0
+            stats["checkout_wait_max_ms"] = self._wait_max * 1000
+        return stats
+
+
+class MongoPoolManager:
+    """Owns the process-wide Motor client shared by every Mongo-backed service."""
+
+    def __init__(
+        self,
+        connection_string: Optional[str] = None,
+        max_pool_size: Optional[int] = None,
+        min_pool_size: Optional[int] = None,
+        max_idle_time_ms: Optional[int] = None,
+        wait_queue_timeout_ms: Optional[int] = None,
+        connect_timeout_ms: Optional[int] = None,
+        server_selection_timeout_ms: Optional[int] = None,
+        read_preference: Optional[str] = None,
+    ):
+        self.connection_string = connection_string or settings.mongodb_connection_string
+        self.options = {
+            "maxPoolSize": max_pool_size if max_pool_size is not None else settings.mongodb_max_pool_size,
+            "minPoolSize": min_pool_size if min_pool_size is not None else settings.mongodb_min_pool_size,
+            "maxIdleTimeMS": max_idle_time_ms if max_idle_time_ms is not None else settings.mongodb_max_idle_time_ms,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms if wait_queue_timeout_ms is not None else settings.mongodb_wait_queue_timeout_ms,
+            "connectTimeoutMS": connect_timeout_ms if connect_timeout_ms is not None else settings.mongodb_connect_timeout_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms if server_selection_timeout_ms is not None else settings.mongodb_server_selection_timeout_ms,
+            "readPreference": read_preference or settings.mongodb_read_preference,
+        }
+        # 0 means "no limit" in settings; the driver expects None for that
+        for key in ("maxIdleTimeMS", "waitQueueTimeoutMS"):
+            if not self.options[key]:
+                self.options[key] = None
+
+        self.listener = PoolStatsListener()
+        self._client: Optional[AsyncIOMotorClient] = None
+        self.ready = False
+        self.last_ping_ms: Optional[float] = None
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        # Client construction is synchronous, so concurrent first callers can't race here
+        if self._client is None:
+            self._client = AsyncIOMotorClient(
+                self.connection_string,
+                event_listeners=[self.listener],
+                **self.options
+            )
+        return self._client
+
+    def get_database(self, name: Optional[str] = None):
+        return self.client[name or settings.mongodb_database_name]
+
+    async def ping(self) -> bool:
+        start = time.perf_counter()
+        try:
+            await self.client.admin.command("ping")
+        except Exception as e:
+            print(f"Error pinging MongoDB: {e}")
+            self.ready = False
+            return False
+        self.last_ping_ms = (time.perf_counter() - start) * 1000
+        self.ready = True
+        return True
+
+    async def warmup(self) -> bool:
+        """Open the pool before the first request (the driver keeps minPoolSize connections open)."""
+        ok = await self.ping()
+        if ok:
+            print(f"✅ MongoDB connected ({self.last_ping_ms:.1f} ms)")
+        return ok
+
+    def get_stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "last_ping_ms": self.last_ping_ms,
+            "max_pool_size": self.options["maxPoolSize"],
+            "min_pool_size": self.options["minPoolSize"],
+            "read_preference": self.options["readPreference"],
+            **self.listener.get_stats(),
+        }
+
+    async def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            self.ready = False
+
+
+# Global pool shared by the app and scripts
+mongo_pool = MongoPoolManager()
@@ -0,0 +1,157 @@
+"""
+Application runtime: lazy, lifespan-driven construction of the agent service
+Heavy modules (langchain, langgraph, motor) are imported after the server is up,
+and every startup phase is timed for the /health report
+"""
+import asyncio
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Imported one at a time so the profile shows what each package costs
+HEAVY_IMPORTS = (
+    "langchain_core.messages",
+    "langgraph.prebuilt",
+    "langchain_anthropic",
+    "motor.motor_asyncio",
+    "app.services.agent",
+)
+
+
+class ServiceNotReadyError(RuntimeError):
+    """The agent service is still starting (or failed to start)."""
+
+
+class AppRuntime:
+    """Owns the agent service: builds it in the background and reports readiness.
+
+    ``start`` returns immediately; imports and construction run in worker
+    threads so the event loop keeps answering /health while the worker warms
+    up. Request handlers call ``wait_ready`` to get the service.
+    """
+
+    def __init__(self):
+        self.state = "starting"  # starting → ready | failed, then stopped
+        self.error: Optional[str] = None
+        self.profile: dict[str, float] = {}
+        self.import_profile: dict[str, float] = {}
+        self.modules_loaded = 0
+        self.created_at = time.perf_counter()
+        self._agent_service = None
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.profile[name] = time.perf_counter() - start
+
+    def _ready_event(self) -> asyncio.Event:
+        if self._ready is None:
+            self._ready = asyncio.Event()
+        return self._ready
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def install(self, agent_service):
+        """Use an already-built (and started) service, e.g. benchmarks with fake models."""
+        self._agent_service = agent_service
+        self.state = "ready"
+        self.error = None
+        self._ready_event().set()
+
+    def start(self) -> asyncio.Task:
+        """Begin importing and starting the agent service in the background."""
+        if self._task is None:
+            self.state = "starting"
+            self.error = None
+            self._ready_event()
+            self._task = asyncio.create_task(self._start())
+        return self._task
+
+    async def _start(self):
+        try:
+            modules_before = len(sys.modules)
+            with self.phase("imports"):
+                for module in HEAVY_IMPORTS:
+                    start = time.perf_counter()
+                    await asyncio.to_thread(importlib.import_module, module)
+                    self.import_profile[module] = time.perf_counter() - start
+            self.modules_loaded = len(sys.modules) - modules_before
+
+            from app.core.database import mongo_pool
+            from app.services.agent import AgentService
+
+            if self._agent_service is None:
+                with self.phase("construct"):
+                    self._agent_service = await asyncio.to_thread(AgentService)
+            with self.phase("mongo_warmup"):
+                await mongo_pool.warmup()
+            with self.phase("agent_start"):
+                await self._agent_service.start()
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"Error starting agent service: {e}")
+        else:
+            self.state = "ready"
+            self.profile["ready_after"] = time.perf_counter() - self.created_at
+            print(f"✅ Agent ready in {self.profile['ready_after']:.2f}s "
+                  f"(imports {self.profile['imports']:.2f}s, construct {self.profile.get('construct', 0):.2f}s)")
+        finally:
+            self._ready_event().set()
+
+    async def wait_ready(self, timeout: float):
+        """The agent service, waiting up to ``timeout`` seconds for startup to finish."""
+        if not self.ready:
+            try:
+                await asyncio.wait_for(self._ready_event().wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if not self.ready:
+            raise ServiceNotReadyError(self.error or f"agent service is {self.state}")
+        return self._agent_service
+
+    async def stop(self):
+        """Close the agent service and shared clients (cancelling a startup still in progress)."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._agent_service is not None:
+            await self._agent_service.close()
+            self._agent_service = None
+        # Only modules that were actually imported have anything to close
+        if "app.services.tool_executor" in sys.modules:
+            sys.modules["app.services.tool_executor"].tool_executor.close()
+        if "app.core.database" in sys.modules:
+            await sys.modules["app.core.database"].mongo_pool.close()
+        self.state = "stopped"
+        self._task = None
+        self._ready = None
+
+    def get_status(self) -> dict:
+        return {
+            "status": {"ready": "healthy"}.get(self.state, self.state),
+            "ready": self.ready,
+            "error": self.error,
+            "startup": {
+                "phases_s": {name: round(seconds, 4) for name, seconds in self.profile.items()},
+                "imports_s": {name: round(seconds, 4) for name, seconds in self.import_profile.items()},
+                "modules_loaded": self.modules_loaded,
+            },
+        }
+
+
+# Global runtime (started and stopped by the app lifespan)
+runtime = AppRuntime()
@@ -3,22 +3,30 @@ from dotenv import load_dotenv
 # Load environment variables from .env file BEFORE importing anything else
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.core.config import settings
+from app.core.metrics import REGISTRY, HTTP_REQUESTS_IN_FLIGHT, HTTP_REQUEST_SECONDS
+from app.core.runtime import runtime
 from app.api.routes import router
-from app.services.agent import agent_service
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager."""
-    # Startup
+    # Startup: the agent service (and langchain / langgraph / motor) loads in the
+    # background, so the worker starts serving /health right away
     print("🚀 Starting Personal Agent...")
+    startup = runtime.start()
+    if not settings.startup_in_background:
+        await startup
     yield
     # Shutdown
     print("👋 Shutting down Personal Agent...")
+    await runtime.stop()
 
 
 # Create FastAPI app
@@ -38,6 +46,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        # Label by route template, not raw path, so conversation ids don't explode cardinality
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status
+        )
+
+
 # Include routes
 app.include_router(router, prefix="/api/v1")
 
@@ -54,5 +84,12 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Health check endpoint."""
-    return {"status": "healthy"}
+    """Readiness check: 503 until the agent service has started, with a startup profile."""
+    status = runtime.get_status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics (text exposition format)."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -13,13 +13,46 @@ class ChatRequest(BaseModel):
     conversation_id: Optional[str] = None
 
 
+class BatchChatItem(BaseModel):
+    message: str
+    conversation_id: Optional[str] = None
+    skip_intent: bool = False  # Known plain chat: skip intent recognition
+
+
+class BatchChatRequest(BaseModel):
+    items: list[BatchChatItem]
+    concurrency: Optional[int] = None
+    timeout: Optional[float] = None  # Per-item timeout in seconds
+
+
 class ChatResponse(BaseModel):
     message: str
     conversation_id: str
 
 
+class HistoryPage(BaseModel):
+    conversation_id: str
+    messages: list[Message]  # Chronological; timestamps in epoch milliseconds
+    has_more: bool
+    next_cursor: Optional[str] = None  # Continue with before= (or since= when paging forward)
+    latest_cursor: Optional[str] = None  # Poll with since= to fetch only new turns
+
+
 class ConversationSummary(BaseModel):
     conversation_id: str
     title: str
     message_count: int
     last_updated: float
+
+
+class FactMatch(BaseModel):
+    fact_type: str
+    content: str
+
+
+class FactDeletionReport(BaseModel):
+    query: str
+    dry_run: bool
+    examined: int  # Documents fetched through the token index
+    deleted: int
+    matched: list[FactMatch]
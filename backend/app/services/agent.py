@@ -2,77 +2,224 @@
 Personal Agent with LLM-based Intent Recognition
 Hybrid Memory Architecture + Smart Intent Understanding
 """
-from typing import Sequence, Optional
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
+from typing import AsyncIterator, Sequence, Optional
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, RemoveMessage
 from langchain_core.tools import tool
-from langchain_anthropic import ChatAnthropic
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
-from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langchain_core.language_models.chat_models import BaseChatModel
+from datetime import datetime, timedelta
+from pymongo import DeleteOne, UpdateOne
+import asyncio
 import json
+import time
+import uuid
+from contextlib import aclosing
 from app.core.config import settings
+from app.core.database import MongoPoolManager, mongo_pool
+from app.core.metrics import (
+    timed, confidence_bucket, CHAT_STAGE_SECONDS, CHAT_TURNS_IN_FLIGHT, INTENT_RESULTS, MONGO_OPERATION_SECONDS
+)
+from app.services.intent_cache import IntentCache
+from app.services.llm_gateway import llm_gateway, cached_system_message, llm_priority, use_priority, PRIORITY_BULK, PRIORITY_MEMORY
+from app.services.write_behind import WriteBehindQueue
+from app.services.fact_rules import FactRuleEngine
+from app.services.fact_compaction import FactCompactor, FactCompactionJob
+from app.services.context_compactor import CompactedAgentState, ContextCompactor
+from app.services.safe_eval import evaluate
+from app.services.tool_executor import tool_executor
+from app.services.thread_locks import ThreadLockTable, TurnCoalescer
+from app.services.mongo_checkpointer import MongoCheckpointSaver
+from app.services import history_cursor
+from app.services.conversation_buckets import ConversationBucketStore
+from app.services.fact_search import TOKENS_VERSION, fact_tokens, query_tokens, fact_matches
+from app.services.fact_index import FactIndex, FactIndexStore, estimate_tokens
+from app.services.fact_cache import FactCache, CachedFacts, MongoInvalidationChannel, render_fact_prelude
+from app.services.fast_intent import FastIntentClassifier, DELETE_KEYWORDS, VIEW_KEYWORDS, CLEAR_KEYWORDS
 
 
 # ============ Tools ============
+# Tool bodies run in the tool executor, never on the event loop
+def _current_time_text() -> str:
+    return datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
+
+
 @tool
-def get_current_time() -> str:
+async def get_current_time() -> str:
     """获取当前时间"""
-    now = datetime.now()
-    return now.strftime("%Y年%m月%d日 %H:%M:%S")
+    return await tool_executor.run("get_current_time", _current_time_text)
 
 
 @tool
-def calculate(expression: str) -> str:
-    """计算数学表达式，例如: 2 + 2, 10 * 5"""
+async def calculate(expression: str) -> str:
+    """计算数学表达式，例如: 2 + 2, 10 * 5, sqrt(2), 2 ** 10"""
     try:
-        result = eval(expression)
+        result = await tool_executor.run("calculate", evaluate, expression, timeout=settings.calculate_timeout_seconds)
         return f"计算结果: {result}"
     except Exception as e:
         return f"计算错误: {str(e)}"
 
 
+def _content_text(content) -> str:
+    """Flatten message content (str or Anthropic content blocks) to plain text."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+            if not isinstance(block, dict) or block.get("type") == "text"
+        )
+    return "" if content is None else str(content)
+
+
 # ============ Memory Service ============
 class MongoMemoryService:
     """MongoDB-based memory service"""
 
-    def __init__(self, connection_string: str = "mongodb://localhost:27017"):
-        self.client: Optional[AsyncIOMotorClient] = None
-        self.connection_string = connection_string
+    def __init__(self, pool: Optional[MongoPoolManager] = None):
+        self.pool = pool or mongo_pool
         self._db = None
         self._conversations = None
         self._long_term = None
+        # Set in ensure_indexes when CONVERSATION_STORAGE=buckets
+        self.conversation_buckets: Optional[ConversationBucketStore] = None
+        self._indexes_ready = False
+        self._index_lock = asyncio.Lock()
+        self._backfill_task: Optional[asyncio.Task] = None
+        # True once every stored fact has tokens of the current TOKENS_VERSION
+        self._fact_tokens_current = False
+
+        # L1 cache of each thread's top facts, invalidated on every fact write
+        self.fact_cache = FactCache(
+            max_threads=settings.fact_cache_max_threads,
+            max_bytes=settings.fact_cache_max_bytes,
+            ttl_seconds=settings.fact_cache_ttl_seconds
+        ) if settings.fact_cache_enabled else None
+        # Per-thread relevance index, updated in place by fact writes
+        self.fact_index = FactIndexStore(
+            dim=settings.fact_index_dim,
+            max_threads=settings.fact_index_max_threads,
+            ttl_seconds=settings.fact_cache_ttl_seconds
+        ) if settings.fact_retrieval_mode == "relevance" else None
+        self.invalidation_channel = (
+            MongoInvalidationChannel(self.get_database, self._on_remote_invalidate)
+            if (self.fact_cache or self.fact_index) and settings.fact_cache_invalidation == "mongo" else None
+        )
+
+    FACT_TOKENS_MIGRATION = "fact_tokens"
+
+    async def ensure_indexes(self, backfill: bool = True):
+        """Create indexes once; called from the app lifespan so no request pays for it.
+
+        With ``backfill``, facts with outdated tokens are re-tokenized in the
+        background unless the ``migrations`` marker says that already finished.
+        """
+        if self._indexes_ready:
+            return
+        async with self._index_lock:
+            if self._indexes_ready:
+                return
+            db = self.pool.get_database()
+            conversations, long_term = db["conversations"], db["long_term_memory"]
+
+            await conversations.create_index([("thread_id", 1)])
+            await conversations.create_index([("timestamp", -1)])
+            await conversations.create_index([("thread_id", 1), ("timestamp", 1), ("_id", 1)])
+            await long_term.create_index([("thread_id", 1)])
+            await long_term.create_index([("importance", -1)])
+            await long_term.create_index([("thread_id", 1), ("tokens", 1)])
+            if settings.fact_compaction_enabled:
+                # Fact compaction sets expires_at on low-value facts; facts without it never expire
+                await long_term.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+            if settings.conversation_storage == "buckets":
+                store = ConversationBucketStore(
+                    db["conversation_buckets"],
+                    db["conversation_archive"],
+                    window=timedelta(hours=settings.conversation_bucket_hours),
+                    max_turns=settings.conversation_bucket_max_turns
+                )
+                await store.ensure_indexes()
+                self.conversation_buckets = store
+
+            self._db = db
+            self._conversations = conversations
+            self._long_term = long_term
+            self._indexes_ready = True
+
+            marker = await db["migrations"].find_one({"_id": self.FACT_TOKENS_MIGRATION})
+            if marker is not None and marker.get("version") == TOKENS_VERSION:
+                self._fact_tokens_current = True
+            elif backfill:
+                self._backfill_task = asyncio.create_task(self._backfill_fact_tokens_in_background())
 
     async def _get_collections(self):
-        if self._conversations is None:
-            self.client = AsyncIOMotorClient(self.connection_string)
-            self._db = self.client["agent_memory"]
-            self._conversations = self._db["conversations"]
-            self._long_term = self._db["long_term_memory"]
+        if not self._indexes_ready:
+            await self.ensure_indexes()
+        return self._conversations, self._long_term
 
-            await self._conversations.create_index([("thread_id", 1)])
-            await self._conversations.create_index([("timestamp", -1)])
-            await self._long_term.create_index([("thread_id", 1)])
-            await self._long_term.create_index([("importance", -1)])
+    async def get_database(self):
+        """Shared agent_memory database (used by the Mongo checkpointer)."""
+        await self._get_collections()
+        return self._db
 
-        return self._conversations, self._long_term
+    @staticmethod
+    def conversation_doc(thread_id: str, user_message: str, assistant_response: str) -> dict:
+        return {
+            "thread_id": thread_id,
+            "user_message": user_message,
+            "assistant_response": assistant_response,
+            "timestamp": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def fact_doc(thread_id: str, fact_type: str, content: str, importance: float = 0.5) -> dict:
+        return {
+            "thread_id": thread_id,
+            "fact_type": fact_type,
+            "content": content,
+            "tokens": fact_tokens(content),
+            "tokens_version": TOKENS_VERSION,
+            "importance": importance,
+            "timestamp": datetime.utcnow(),
+        }
 
+    @timed(MONGO_OPERATION_SECONDS, operation="save_conversation")
     async def save_conversation(self, thread_id: str, user_message: str, assistant_response: str):
         try:
             conversations, _ = await self._get_collections()
-            doc = {
-                "thread_id": thread_id,
-                "user_message": user_message,
-                "assistant_response": assistant_response,
-                "timestamp": datetime.utcnow(),
-            }
-            await conversations.insert_one(doc)
+            doc = self.conversation_doc(thread_id, user_message, assistant_response)
+            if self.conversation_buckets:
+                await self.conversation_buckets.append([doc])
+            else:
+                await conversations.insert_one(doc)
         except Exception as e:
             print(f"Error saving conversation: {e}")
 
+    @timed(MONGO_OPERATION_SECONDS, operation="save_conversations_bulk")
+    async def save_conversations_bulk(self, docs: list[dict]) -> int:
+        """Insert many conversation docs (see conversation_doc) in one round trip."""
+        if not docs:
+            return 0
+        try:
+            conversations, _ = await self._get_collections()
+            if self.conversation_buckets:
+                return await self.conversation_buckets.append(docs)
+            result = await conversations.insert_many(docs, ordered=False)
+            return len(result.inserted_ids)
+        except Exception as e:
+            print(f"Error saving conversations: {e}")
+            return 0
+
+    @timed(MONGO_OPERATION_SECONDS, operation="get_conversation_history")
     async def get_conversation_history(self, thread_id: str, limit: int = 20) -> list[dict]:
         try:
             conversations, _ = await self._get_collections()
+            if self.conversation_buckets:
+                return await self.conversation_buckets.history(thread_id, limit)
             cursor = conversations.find({"thread_id": thread_id}).sort("timestamp", -1).limit(limit)
             docs = await cursor.to_list(length=limit)
             return list(reversed(docs))
@@ -80,50 +227,342 @@ class MongoMemoryService:
             print(f"Error getting conversation history: {e}")
             return []
 
+    @timed(MONGO_OPERATION_SECONDS, operation="get_latest_turn_key")
+    async def get_latest_turn_key(self, thread_id: str):
+        """(timestamp, _id) of the thread's newest turn, or None; a single index lookup."""
+        try:
+            conversations, _ = await self._get_collections()
+            if self.conversation_buckets:
+                return await self.conversation_buckets.latest_turn_key(thread_id)
+            doc = await conversations.find_one(
+                {"thread_id": thread_id},
+                {"timestamp": 1},
+                sort=[("timestamp", -1), ("_id", -1)]
+            )
+            return history_cursor.turn_key(doc) if doc else None
+        except Exception as e:
+            print(f"Error getting latest turn: {e}")
+            return None
+
+    @timed(MONGO_OPERATION_SECONDS, operation="get_conversation_page")
+    async def get_conversation_page(self, thread_id: str, limit: int = 50, before=None, since=None) -> dict:
+        """One page of turns in chronological order.
+
+        Without ``since`` this is the newest ``limit`` turns (older than
+        ``before`` if given); with ``since`` it is the oldest ``limit`` turns
+        newer than that key. ``has_more`` says whether the page was cut off.
+        """
+        query = {"thread_id": thread_id}
+        if since is not None:
+            query.update(history_cursor.after(since))
+            direction = 1
+        else:
+            if before is not None:
+                query.update(history_cursor.before(before))
+            direction = -1
+
+        try:
+            conversations, _ = await self._get_collections()
+            if self.conversation_buckets:
+                return await self.conversation_buckets.page(thread_id, limit, before=before, since=since)
+            cursor = conversations.find(
+                query,
+                {"user_message": 1, "assistant_response": 1, "timestamp": 1}
+            ).sort([("timestamp", direction), ("_id", direction)]).limit(limit + 1)
+            docs = await cursor.to_list(length=limit + 1)
+        except Exception as e:
+            print(f"Error getting conversation page: {e}")
+            docs = []
+
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        if direction == -1:
+            docs.reverse()
+        return {"turns": docs, "has_more": has_more}
+
+    @staticmethod
+    def _fact_upsert(doc: dict) -> dict:
+        """Update for saving a fact: a repeated mention refreshes it and cancels any pending expiry."""
+        return {"$set": doc, "$inc": {"mentions": 1}, "$unset": {"expires_at": "", "decayed_at": ""}}
+
+    @timed(MONGO_OPERATION_SECONDS, operation="save_fact")
     async def save_fact(self, thread_id: str, fact_type: str, content: str, importance: float = 0.5):
         try:
             _, long_term = await self._get_collections()
-            doc = {
-                "thread_id": thread_id,
-                "fact_type": fact_type,
-                "content": content,
-                "importance": importance,
-                "timestamp": datetime.utcnow(),
-            }
+            doc = self.fact_doc(thread_id, fact_type, content, importance)
             await long_term.update_one(
                 {"thread_id": thread_id, "fact_type": fact_type, "content": content},
-                {"$set": doc},
+                self._fact_upsert(doc),
                 upsert=True
             )
+            if self.fact_index:
+                self.fact_index.add(thread_id, fact_type, content, importance)
+            await self._invalidate_facts([thread_id])
         except Exception as e:
             print(f"Error saving fact: {e}")
 
-    async def get_facts(self, thread_id: str, limit: int = 10) -> list[str]:
+    @timed(MONGO_OPERATION_SECONDS, operation="save_facts_bulk")
+    async def save_facts_bulk(self, docs: list[dict]) -> int:
+        """Upsert many fact docs (see fact_doc) with a single bulk_write."""
+        if not docs:
+            return 0
         try:
             _, long_term = await self._get_collections()
-            cursor = long_term.find({"thread_id": thread_id}).sort("importance", -1).limit(limit)
-            docs = await cursor.to_list(length=limit)
-            return [doc["content"] for doc in docs]
+            operations = [
+                UpdateOne(
+                    {"thread_id": doc["thread_id"], "fact_type": doc["fact_type"], "content": doc["content"]},
+                    self._fact_upsert(doc),
+                    upsert=True
+                )
+                for doc in docs
+            ]
+            result = await long_term.bulk_write(operations, ordered=False)
+            if self.fact_index:
+                for doc in docs:
+                    self.fact_index.add(doc["thread_id"], doc["fact_type"], doc["content"], doc["importance"])
+            await self._invalidate_facts({doc["thread_id"] for doc in docs})
+            return result.upserted_count + result.modified_count
+        except Exception as e:
+            print(f"Error saving facts: {e}")
+            return 0
+
+    async def get_facts(self, thread_id: str, limit: int = 10) -> list[str]:
+        if self.fact_cache and limit <= settings.fact_cache_top_n:
+            cached = await self._get_cached_facts(thread_id)
+            return cached.facts[:limit]
+        return await self._query_facts(thread_id, limit)
+
+    async def get_fact_context(self, thread_id: str) -> str:
+        """Rendered [用户背景信息] prelude for a thread ("" if it has no facts)."""
+        if self.fact_cache:
+            cached = await self._get_cached_facts(thread_id)
+            return cached.prelude
+        return render_fact_prelude(await self._query_facts(thread_id, settings.fact_cache_top_n))
+
+    async def get_relevant_fact_context(self, thread_id: str, query: str, token_budget: int) -> str:
+        """Prelude of the facts most relevant to ``query`` that fit in ``token_budget``."""
+        index = await self._get_fact_index(thread_id)
+        selected, used = [], estimate_tokens("[用户背景信息]")
+        for content, _ in index.query(query):
+            cost = estimate_tokens(f"- {content}\n")
+            if used + cost > token_budget:
+                continue
+            selected.append(content)
+            used += cost
+        return render_fact_prelude(selected)
+
+    async def _get_fact_index(self, thread_id: str):
+        index = self.fact_index.get(thread_id)
+        if index is None:
+            generation = self.fact_index.generation(thread_id)
+            try:
+                facts = await self._fetch_all_facts(thread_id)
+            except Exception as e:
+                # Not cached, so the next turn retries instead of keeping an empty index
+                print(f"Error listing facts: {e}")
+                return FactIndex(self.fact_index.vectorizer)
+            index = self.fact_index.build(thread_id, facts, generation)
+        return index
+
+    async def warm_facts(self, thread_id: str):
+        """Load a thread's facts into whichever of the fact cache / relevance index is enabled."""
+        if self.fact_index:
+            await self._get_fact_index(thread_id)
+        if self.fact_cache:
+            await self._get_cached_facts(thread_id)
+
+    async def _get_cached_facts(self, thread_id: str) -> CachedFacts:
+        cached = self.fact_cache.get(thread_id)
+        if cached is None:
+            generation = self.fact_cache.generation(thread_id)
+            try:
+                facts = await self._fetch_top_facts(thread_id, settings.fact_cache_top_n)
+            except Exception as e:
+                print(f"Error getting facts: {e}")
+                # Bumping the generation makes put() return the entry without caching it
+                self.fact_cache.invalidate([thread_id])
+                facts = []
+            cached = self.fact_cache.put(thread_id, facts, generation)
+        return cached
+
+    async def _query_facts(self, thread_id: str, limit: int) -> list[str]:
+        try:
+            return await self._fetch_top_facts(thread_id, limit)
         except Exception as e:
             print(f"Error getting facts: {e}")
             return []
 
+    @timed(MONGO_OPERATION_SECONDS, operation="query_facts")
+    async def _fetch_top_facts(self, thread_id: str, limit: int) -> list[str]:
+        _, long_term = await self._get_collections()
+        cursor = long_term.find({"thread_id": thread_id}).sort("importance", -1).limit(limit)
+        docs = await cursor.to_list(length=limit)
+        return [doc["content"] for doc in docs]
+
+    async def _invalidate_facts(self, thread_ids):
+        """Drop cached facts locally (synchronously) and tell the other workers."""
+        thread_ids = list(thread_ids)
+        if self.fact_cache:
+            self.fact_cache.invalidate(thread_ids)
+        if self.invalidation_channel:
+            await self.invalidation_channel.publish(thread_ids)
+
+    def _on_remote_invalidate(self, thread_ids: list[str]):
+        if self.fact_cache:
+            self.fact_cache.invalidate(thread_ids)
+        if self.fact_index:
+            for thread_id in thread_ids:
+                self.fact_index.drop(thread_id)
+
     async def delete_fact(self, thread_id: str, content: str) -> bool:
+        report = await self.delete_facts(thread_id, content)
+        return report["deleted"] > 0
+
+    @timed(MONGO_OPERATION_SECONDS, operation="delete_facts")
+    async def delete_facts(self, thread_id: str, query: str, dry_run: bool = False) -> dict:
+        """Delete facts containing ``query`` (literal, case-insensitive).
+
+        Candidates come from the (thread_id, tokens) index, plus the thread's
+        facts not yet re-tokenized while the backfill is pending, and are
+        verified in Python. With ``dry_run`` nothing is deleted and the report
+        previews what would be.
+        """
+        report = {"query": query, "dry_run": dry_run, "examined": 0, "deleted": 0, "matched": []}
+        tokens = query_tokens(query)
+        if not tokens:
+            return report
+
         try:
             _, long_term = await self._get_collections()
-            result = await long_term.delete_many({
-                "thread_id": thread_id,
-                "content": {"$regex": content, "$options": "i"}
-            })
-            return result.deleted_count > 0
+            cursor = long_term.find(
+                {"thread_id": thread_id, "tokens": {"$all": tokens}},
+                {"content": 1, "fact_type": 1}
+            )
+            candidates = await cursor.to_list(length=None)
+            matched = [doc for doc in candidates if fact_matches(query, doc["content"])]
+            examined = len(candidates)
+            if not self._fact_tokens_current:
+                # Facts with outdated tokens can't be found by the token query; check them directly
+                cursor = long_term.find(
+                    {"thread_id": thread_id, "tokens_version": {"$ne": TOKENS_VERSION}},
+                    {"content": 1, "fact_type": 1}
+                )
+                candidates = await cursor.to_list(length=None)
+                matched.extend(doc for doc in candidates if fact_matches(query, doc["content"]))
+                examined += len(candidates)
+
+            report["examined"] = examined
+            report["matched"] = [{"fact_type": doc["fact_type"], "content": doc["content"]} for doc in matched]
+            if dry_run or not matched:
+                return report
+
+            result = await long_term.delete_many({"_id": {"$in": [doc["_id"] for doc in matched]}})
+            report["deleted"] = result.deleted_count
+            if self.fact_index:
+                self.fact_index.remove(thread_id, lambda content: fact_matches(query, content))
+            await self._invalidate_facts([thread_id])
         except Exception as e:
             print(f"Error deleting fact: {e}")
-            return False
+        return report
 
+    async def _backfill_fact_tokens_in_background(self):
+        try:
+            updated = await self.backfill_fact_tokens()
+            if updated:
+                print(f"✅ Backfilled tokens for {updated} facts")
+        except Exception as e:
+            print(f"Error backfilling fact tokens: {e}")
+
+    async def backfill_fact_tokens(self, batch_size: int = 500) -> int:
+        """Re-tokenize facts saved with outdated (or no) tokens; returns how many were updated.
+
+        Records its completion in ``migrations`` so later starts skip the scan.
+        """
+        _, long_term = await self._get_collections()
+        updated = 0
+        operations = []
+        async for doc in long_term.find({"tokens_version": {"$ne": TOKENS_VERSION}}, {"content": 1}):
+            operations.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"tokens": fact_tokens(doc["content"]), "tokens_version": TOKENS_VERSION}}
+            ))
+            if len(operations) >= batch_size:
+                updated += (await long_term.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await long_term.bulk_write(operations, ordered=False)).modified_count
+
+        await self._db["migrations"].update_one(
+            {"_id": self.FACT_TOKENS_MIGRATION},
+            {"$set": {"version": TOKENS_VERSION, "completed_at": datetime.utcnow()}},
+            upsert=True
+        )
+        self._fact_tokens_current = True
+        return updated
+
+    async def compact_facts(self, compactor: FactCompactor, dry_run: bool = False, batch_size: int = 500) -> dict:
+        """Merge near-duplicate facts, decay importance and mark low-value facts for expiry.
+
+        Facts are streamed thread by thread (via the thread_id index) and each
+        thread is planned in a worker thread, then written with batched
+        bulk_writes. With ``dry_run`` the report only previews the changes.
+        """
+        report = {"dry_run": dry_run, "threads": 0, "scanned": 0, "clusters": 0, "merged": 0,
+                  "removed": 0, "decayed": 0, "expiring": 0}
+        _, long_term = await self._get_collections()
+        now = datetime.utcnow()
+        operations, touched = [], set()
+
+        async def flush():
+            nonlocal operations
+            if operations and not dry_run:
+                result = await long_term.bulk_write(operations, ordered=False)
+                report["removed"] += result.deleted_count
+            operations = []
+
+        async def compact_thread(thread_id: str, docs: list[dict]):
+            plan = await asyncio.to_thread(compactor.plan_thread, docs, now)
+            report["threads"] += 1
+            report["clusters"] += plan.clusters
+            report["merged"] += len(plan.deletes)
+            report["decayed"] += plan.decayed
+            report["expiring"] += plan.expiring
+            # Filtered on the timestamp that was read, so facts re-saved meanwhile are left alone
+            operations.extend(DeleteOne(delete) for delete in plan.deletes)
+            operations.extend(UpdateOne(match, {"$set": update}) for match, update in plan.updates)
+            if plan.deletes or plan.updates:
+                touched.add(thread_id)
+            if len(operations) >= batch_size:
+                await flush()
+
+        thread_id, docs = None, []
+        cursor = long_term.find({}, {"tokens": 0}).sort("thread_id", 1)
+        async for doc in cursor:
+            report["scanned"] += 1
+            if doc["thread_id"] != thread_id and docs:
+                await compact_thread(thread_id, docs)
+                docs = []
+            thread_id = doc["thread_id"]
+            docs.append(doc)
+        if docs:
+            await compact_thread(thread_id, docs)
+        await flush()
+
+        if touched and not dry_run:
+            if self.fact_index:
+                for thread_id in touched:
+                    self.fact_index.drop(thread_id)
+            await self._invalidate_facts(touched)
+        return report
+
+    @timed(MONGO_OPERATION_SECONDS, operation="clear_all_facts")
     async def clear_all_facts(self, thread_id: str) -> int:
         try:
             _, long_term = await self._get_collections()
             result = await long_term.delete_many({"thread_id": thread_id})
+            if self.fact_index:
+                self.fact_index.drop(thread_id)
+            await self._invalidate_facts([thread_id])
             return result.deleted_count
         except Exception as e:
             print(f"Error clearing facts: {e}")
@@ -131,35 +570,44 @@ class MongoMemoryService:
 
     async def list_all_facts(self, thread_id: str) -> list[dict]:
         try:
-            _, long_term = await self._get_collections()
-            cursor = long_term.find({"thread_id": thread_id}).sort("importance", -1)
-            docs = await cursor.to_list(length=None)
-            return docs
+            return await self._fetch_all_facts(thread_id)
         except Exception as e:
             print(f"Error listing facts: {e}")
             return []
 
+    @timed(MONGO_OPERATION_SECONDS, operation="list_all_facts")
+    async def _fetch_all_facts(self, thread_id: str) -> list[dict]:
+        _, long_term = await self._get_collections()
+        cursor = long_term.find({"thread_id": thread_id}, {"tokens": 0}).sort("importance", -1)
+        return await cursor.to_list(length=None)
+
+    async def start(self):
+        try:
+            await self.ensure_indexes()
+        except Exception as e:
+            print(f"Error creating memory indexes: {e}")
+        if self.invalidation_channel:
+            await self.invalidation_channel.start()
+
     async def close(self):
-        if self.client:
-            self.client.close()
-            self._conversations = None
-            self._long_term = None
+        # The connection pool is shared and closed by its owner (the app lifespan)
+        if self._backfill_task is not None and not self._backfill_task.done():
+            self._backfill_task.cancel()
+            try:
+                await self._backfill_task
+            except asyncio.CancelledError:
+                pass
+        if self.invalidation_channel:
+            await self.invalidation_channel.stop()
 
 
 # ============ LLM Intent Recognizer ============
 class IntentRecognizer:
     """Use LLM to intelligently recognize user intent"""
 
-    def __init__(self):
-        anthropic_kwargs = {
-            "api_key": settings.anthropic_api_key,
-            "model": settings.model_name,
-            "temperature": 0.0  # Low temperature for consistent classification
-        }
-        if settings.anthropic_base_url:
-            anthropic_kwargs["base_url"] = settings.anthropic_base_url
-
-        self.llm = ChatAnthropic(**anthropic_kwargs)
+    def __init__(self, llm: Optional[BaseChatModel] = None):
+        # Low temperature for consistent classification
+        self.llm = llm or llm_gateway.chat_model(temperature=0.0)
 
         self.system_prompt = """你是一个意图识别助手。分析用户的输入，判断他们的意图。
 
@@ -194,15 +642,54 @@ class IntentRecognizer:
 
 只返回 JSON，不要其他内容。"""
 
+        # Local classifier answers confident cases without a network call
+        self.fast_classifier = (
+            FastIntentClassifier(threshold=settings.intent_fast_path_threshold)
+            if settings.intent_fast_path_enabled else None
+        )
+
+        # Repeated messages reuse the previous LLM classification
+        self.cache = (
+            IntentCache(max_size=settings.intent_cache_max_size, ttl_seconds=settings.intent_cache_ttl_seconds)
+            if settings.intent_cache_enabled else None
+        )
+
     async def recognize_intent(self, user_message: str) -> dict:
-        """Recognize user intent using LLM"""
+        """Recognize user intent, escalating to the LLM only when the fast path is unsure"""
+        with CHAT_STAGE_SECONDS.time(stage="intent"):
+            result, source = await self._recognize(user_message)
+        INTENT_RESULTS.inc(
+            intent=result.get("intent", "chat"),
+            source=source,
+            confidence=confidence_bucket(result.get("confidence"))
+        )
+        return result
+
+    async def _recognize(self, user_message: str) -> tuple[dict, str]:
+        """Returns (intent result, source): fast_path, cache, llm or fallback."""
+        if self.fast_classifier:
+            fast_result = self.fast_classifier.try_classify(user_message)
+            if fast_result is not None:
+                return fast_result, "fast_path"
+
+        if self.cache:
+            # Drops cached results if the prompt or model changed since they were stored
+            self.cache.bind(self.system_prompt, settings.model_name)
+            cached = self.cache.get(user_message)
+            if cached is not None:
+                return cached, "cache"
+
         try:
             messages = [
-                SystemMessage(content=self.system_prompt),
+                # Static few-shot prompt: cached by the provider after the first call
+                cached_system_message(self.system_prompt),
                 HumanMessage(content=user_message)
             ]
 
-            response = await self.llm.ainvoke(messages)
+            # Memory commands hinge on this call, so it jumps the queue (except in bulk jobs)
+            priority = PRIORITY_BULK if llm_priority.get() == PRIORITY_BULK else PRIORITY_MEMORY
+            with use_priority(priority):
+                response = await self.llm.ainvoke(messages)
             result = response.content
 
             # Parse JSON response
@@ -222,19 +709,29 @@ class IntentRecognizer:
                     "reason": "无法识别的意图，作为普通对话处理"
                 }
 
-            return intent_data
+            if self.cache:
+                self.cache.put(user_message, intent_data)
+
+            return intent_data, "llm"
 
         except Exception as e:
             print(f"LLM intent recognition failed: {e}, using keyword fallback")
-            return self._keyword_fallback(user_message)
+            return self._keyword_fallback(user_message), "fallback"
+
+    def get_stats(self) -> dict:
+        """Fast-path and cache hit rate counters."""
+        return {
+            "fast_path": self.fast_classifier.get_stats() if self.fast_classifier else None,
+            "cache": self.cache.get_stats() if self.cache else None,
+        }
 
     def _keyword_fallback(self, user_message: str) -> dict:
         """Fallback to keyword matching if LLM fails"""
         message_lower = user_message.lower()
 
-        if any(word in message_lower for word in ["忘记", "删除记忆", "不要记住", "别记着"]):
+        if any(word in message_lower for word in DELETE_KEYWORDS):
             query = user_message
-            for word in ["忘记", "删除记忆", "不要记住", "别记着"]:
+            for word in DELETE_KEYWORDS:
                 if word in message_lower:
                     query = user_message.split(word)[1].strip()
                     break
@@ -248,7 +745,7 @@ class IntentRecognizer:
                 }
             }
 
-        if any(word in message_lower for word in ["查看记忆", "记忆列表", "所有记忆", "你知道什么", "你都记得什么"]):
+        if any(word in message_lower for word in VIEW_KEYWORDS):
             return {
                 "intent": "view_memories",
                 "confidence": 0.7,
@@ -258,7 +755,7 @@ class IntentRecognizer:
                 }
             }
 
-        if any(word in message_lower for word in ["清空记忆", "删除所有记忆", "全部忘记", "重置记忆"]):
+        if any(word in message_lower for word in CLEAR_KEYWORDS):
             return {
                 "intent": "clear_memories",
                 "confidence": 0.7,
@@ -279,130 +776,578 @@ class IntentRecognizer:
 
 
 # ============ Agent Service ============
-class AgentService:
-    def __init__(self):
-        # Initialize LLM (Anthropic-compatible for GLM-4.7)
-        anthropic_kwargs = {
-            "api_key": settings.anthropic_api_key,
-            "model": settings.model_name,
-            "temperature": 0.7
-        }
-        if settings.anthropic_base_url:
-            anthropic_kwargs["base_url"] = settings.anthropic_base_url
+MEMORY_INTENTS = ("delete_memory", "view_memories", "clear_memories")
+MEMORY_TOOL_NAMES = MEMORY_INTENTS
 
-        self.llm = ChatAnthropic(**anthropic_kwargs)
+SINGLE_CALL_SYSTEM_PROMPT = """你是一个个人AI助理，可以使用工具管理用户的长期记忆：
+- 用户要求忘记/删除某条记忆时（例如"忘记我喜欢咖啡"、"别记着我喜欢吃辣"），调用 delete_memory，query 为要删除的内容
+- 用户想知道你记得什么时（例如"你都知道什么"），调用 view_memories
+- 用户要求清空、重置所有记忆时，调用 clear_memories
+
+调用记忆工具后，直接把工具返回的结果告诉用户。其他情况正常对话，不要调用记忆工具。"""
+
+class AgentService:
+    def __init__(
+        self,
+        llm: Optional[BaseChatModel] = None,
+        intent_llm: Optional[BaseChatModel] = None,
+        memory: Optional[MongoMemoryService] = None,
+        checkpointer: Optional[BaseCheckpointSaver] = None
+    ):
+        """All arguments default to the production setup; benchmarks pass fakes."""
+        # Initialize LLM (Anthropic-compatible for GLM-4.7), admitted through the shared gateway
+        self.llm = llm or llm_gateway.chat_model(temperature=0.7)
 
         # Store reference to memory service
-        self.mongo_memory = MongoMemoryService(
-            connection_string=settings.mongodb_connection_string
+        self.mongo_memory = memory or MongoMemoryService()
+
+        # Batched, off-the-response-path persistence (started in the app lifespan)
+        self.write_queue = WriteBehindQueue(
+            self.mongo_memory,
+            max_size=settings.write_behind_max_queue,
+            batch_size=settings.write_behind_batch_size,
+            flush_interval=settings.write_behind_flush_interval
         )
 
         # Initialize intent recognizer
-        self.intent_recognizer = IntentRecognizer()
+        self.intent_recognizer = IntentRecognizer(intent_llm)
 
-        # Define tools
-        self.tools = [get_current_time, calculate]
+        # Fact extraction rules (optionally hot-reloaded from a JSON file)
+        self.fact_rules = FactRuleEngine(
+            path=settings.fact_rules_path,
+            reload_interval=settings.fact_rules_reload_interval
+        )
 
-        # Layer 1: Short-term memory (in-memory checkpoint)
-        self.checkpointer = MemorySaver()
+        # Define tools ("single_call" mode lets the react agent manage memory itself)
+        self.agent_mode = settings.agent_mode
+        self.tools = [get_current_time, calculate]
+        if self.agent_mode == "single_call":
+            self.tools += self._build_memory_tools()
+
+        # Layer 1: Short-term memory (thread checkpoints)
+        if checkpointer is not None:
+            self.checkpointer = checkpointer
+        elif settings.checkpointer_backend == "mongo":
+            # Shared across workers and restarts
+            self.checkpointer = MongoCheckpointSaver(self.mongo_memory.get_database)
+        else:
+            self.checkpointer = MemorySaver()
+
+        # Rolling summary of old turns, so prompts stop growing with the conversation
+        self.system_message = cached_system_message(SINGLE_CALL_SYSTEM_PROMPT) if self.agent_mode == "single_call" else None
+        self.context_compactor = ContextCompactor(
+            self.llm,
+            token_budget=settings.context_token_budget,
+            recent_turns=settings.context_recent_turns,
+            summary_max_chars=settings.context_summary_max_chars
+        ) if settings.context_compaction_enabled else None
 
         # Build LangGraph agent
         self.graph = create_react_agent(
             self.llm,
             self.tools,
-            checkpointer=self.checkpointer
+            checkpointer=self.checkpointer,
+            state_schema=CompactedAgentState,
+            state_modifier=self._build_prompt if self.context_compactor else self.system_message
         )
 
-    async def chat(self, message: str, conversation_id: str | None = None) -> tuple[str, str]:
-        """Chat with the agent and return (response, conversation_id)."""
-        config = {"configurable": {"thread_id": conversation_id or "default"}}
-        thread_id = config["configurable"]["thread_id"]
+        # Periodic near-duplicate merging, importance decay and expiry of long-term facts
+        self.fact_compaction = FactCompactionJob(
+            self.mongo_memory,
+            FactCompactor(
+                similarity=settings.fact_compaction_similarity,
+                num_perm=settings.fact_compaction_num_perm,
+                half_life_days=settings.fact_decay_half_life_days,
+                exempt_types=tuple(t.strip() for t in settings.fact_decay_exempt_types.split(",") if t.strip()),
+                expire_importance=settings.fact_expire_importance,
+                expire_grace_days=settings.fact_expire_grace_days
+            ),
+            interval=settings.fact_compaction_interval
+        )
+
+        # Fire-and-forget persistence tasks (see chat_stream)
+        self._background_tasks: set[asyncio.Task] = set()
+
+        # Turns of one thread never overlap; optionally merge messages sent mid-turn
+        self.thread_locks = ThreadLockTable()
+        self.turn_coalescer = TurnCoalescer(self.thread_locks) if settings.chat_coalesce_enabled else None
+
+    async def chat(self, message: str, conversation_id: str | None = None, skip_intent: bool = False) -> tuple[str, str]:
+        """Chat with the agent and return (response, conversation_id).
+
+        ``skip_intent`` treats the message as plain chat without recognizing
+        its intent (for callers that already know it isn't a memory command).
+        """
+        thread_id = conversation_id or "default"
+
+        if self.turn_coalescer:
+            response = await self.turn_coalescer.submit(
+                thread_id, message, lambda merged: self._chat_turn(thread_id, merged, skip_intent)
+            )
+        else:
+            async with self.thread_locks.hold(thread_id):
+                response = await self._chat_turn(thread_id, message, skip_intent)
+        return response, thread_id
 
+    async def _chat_turn(self, thread_id: str, message: str, skip_intent: bool) -> str:
+        """One turn on a thread; callers hold the thread's lock."""
+        with CHAT_TURNS_IN_FLIGHT.track_inprogress(), CHAT_STAGE_SECONDS.time(stage="turn"):
+            return await self._run_turn(thread_id, message, skip_intent)
+
+    async def _run_turn(self, thread_id: str, message: str, skip_intent: bool) -> str:
+        config = {"configurable": {"thread_id": thread_id}}
+
+        if self.agent_mode == "single_call":
+            response, is_chat = await self._run_single_call_turn(thread_id, message, config)
+        elif skip_intent:
+            enhanced_message = await self._build_enhanced_message(thread_id, message)
+            response, is_chat = await self._invoke_graph(enhanced_message, config), True
+        elif settings.chat_pipeline_enabled:
+            response, is_chat = await self._run_pipelined_turn(thread_id, message, config)
+        else:
+            response, is_chat = await self._run_sequential_turn(thread_id, message, config)
+
+        if is_chat:
+            await self._persist_turn(thread_id, message, response)
+        self._schedule_compaction(thread_id)
+
+        return response
+
+    async def chat_batch(
+        self,
+        items: Sequence[dict],
+        concurrency: int = 8,
+        item_timeout: float | None = None
+    ) -> AsyncIterator[dict]:
+        """Run many chat turns, yielding each result as soon as it completes.
+
+        ``items`` are dicts with ``message`` and optionally ``conversation_id``
+        and ``skip_intent``. Items of the same conversation run in order, one
+        at a time, since they share a checkpoint thread; different conversations
+        run concurrently, at most ``concurrency`` at once.
+        """
+        groups: dict[str, list[int]] = {}
+        for index, item in enumerate(items):
+            groups.setdefault(item.get("conversation_id") or "default", []).append(index)
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def run_item(index: int) -> dict:
+            item = items[index]
+            start = time.perf_counter()
+            result = {"index": index, "conversation_id": item.get("conversation_id") or "default"}
+            try:
+                response, _ = await asyncio.wait_for(
+                    self.chat(item["message"], item.get("conversation_id"), skip_intent=item.get("skip_intent", False)),
+                    timeout=item_timeout
+                )
+                result.update(status="ok", message=response)
+            except asyncio.TimeoutError:
+                result.update(status="timeout", detail=f"超时（{item_timeout} 秒）")
+            except Exception as e:
+                print(f"Error in batch item {index}: {e}")
+                result.update(status="error", detail=str(e))
+            result["elapsed"] = time.perf_counter() - start
+            return result
+
+        async def run_group(indexes: list[int]):
+            with use_priority(PRIORITY_BULK):
+                async with semaphore:
+                    for index in indexes:
+                        await results.put(await run_item(index))
+
+        tasks = [asyncio.create_task(run_group(indexes)) for indexes in groups.values()]
+        try:
+            for _ in range(len(items)):
+                yield await results.get()
+        finally:
+            # The consumer went away (e.g. client disconnected): stop the rest
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_sequential_turn(self, thread_id: str, message: str, config: dict) -> tuple[str, bool]:
+        """Intent → facts → graph, one after another. Returns (response, is_chat)."""
         # Step 1: Use LLM to recognize intent
         intent_result = await self.intent_recognizer.recognize_intent(message)
+
+        # Step 2: Handle memory management intents
+        memory_response = await self._handle_memory_intent(thread_id, message, intent_result)
+        if memory_response is not None:
+            return memory_response, False
+
+        # Step 3: Normal conversation with memory enhancement
+        enhanced_message = await self._build_enhanced_message(thread_id, message)
+        return await self._invoke_graph(enhanced_message, config), True
+
+    async def _run_single_call_turn(self, thread_id: str, message: str, config: dict) -> tuple[str, bool]:
+        """Facts → graph; memory commands are tool calls inside the same graph run."""
+        enhanced_message = await self._build_enhanced_message(thread_id, message)
+        with CHAT_STAGE_SECONDS.time(stage="graph"):
+            result = await self._ainvoke_turn(enhanced_message, config)
+
+        messages = result["messages"]
+        turn_start = max(i for i, msg in enumerate(messages) if isinstance(msg, HumanMessage))
+        used_memory_tool = any(
+            isinstance(msg, ToolMessage) and msg.name in MEMORY_TOOL_NAMES
+            for msg in messages[turn_start:]
+        )
+
+        return _content_text(messages[-1].content), not used_memory_tool
+
+    async def _run_pipelined_turn(self, thread_id: str, message: str, config: dict) -> tuple[str, bool]:
+        """Overlap the intent call with the facts fetch (and optionally the graph run).
+
+        With ``chat_speculative_graph`` the react graph starts as soon as the facts
+        are in, while the intent call is still pending. If the intent turns out to
+        be a memory command the speculative run is cancelled and rolled back.
+        Returns (response, is_chat).
+        """
+        intent_task = asyncio.create_task(self.intent_recognizer.recognize_intent(message))
+        enhanced_task = asyncio.create_task(self._build_enhanced_message(thread_id, message))
+        graph_task = None
+        known_message_ids = None
+
+        try:
+            if settings.chat_speculative_graph:
+                enhanced_message = await enhanced_task
+                # Only speculate if the intent is still unknown (e.g. not a fast-path hit)
+                if not intent_task.done():
+                    known_message_ids = await self._thread_message_ids(config)
+                    graph_task = asyncio.create_task(self._invoke_graph(enhanced_message, config))
+
+            intent_result = await intent_task
+            memory_response = await self._handle_memory_intent(thread_id, message, intent_result)
+            if memory_response is not None:
+                if graph_task is not None:
+                    await self._cancel_speculative_run(graph_task, config, known_message_ids)
+                return memory_response, False
+
+            if graph_task is not None:
+                return await graph_task, True
+            return await self._invoke_graph(await enhanced_task, config), True
+        finally:
+            pending = [task for task in (intent_task, enhanced_task, graph_task) if task is not None and not task.done()]
+            for task in pending:
+                task.cancel()
+            # A cancelled graph run discards its partial turn; let it finish while we hold the thread lock
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    @timed(CHAT_STAGE_SECONDS, stage="graph")
+    async def _invoke_graph(self, enhanced_message: str, config: dict) -> str:
+        result = await self._ainvoke_turn(enhanced_message, config)
+
+        response_message = result["messages"][-1]
+        return response_message.content if hasattr(response_message, 'content') else str(response_message)
+
+    async def _ainvoke_turn(self, enhanced_message: str, config: dict) -> dict:
+        """Run the graph on one turn; if cancelled (e.g. a batch item timing out), remove the partial turn."""
+        turn_message = HumanMessage(content=enhanced_message, id=str(uuid.uuid4()))
+        try:
+            return await self.graph.ainvoke({"messages": [turn_message]}, config=config)
+        except asyncio.CancelledError:
+            # Same as the stream path: a tool call without its result would break later turns
+            await asyncio.shield(self._discard_turn(config, turn_message.id))
+            raise
+
+    async def _thread_message_ids(self, config: dict) -> set[str]:
+        state = await self.graph.aget_state(config)
+        return {msg.id for msg in state.values.get("messages", [])}
+
+    async def _discard_turn(self, config: dict, first_message_id: str):
+        """Remove a turn's input message and everything checkpointed after it."""
+        try:
+            messages = (await self.graph.aget_state(config)).values.get("messages", [])
+            ids = [msg.id for msg in messages]
+            if first_message_id in ids:
+                stale = [RemoveMessage(id=msg_id) for msg_id in ids[ids.index(first_message_id):]]
+                await self.graph.aupdate_state(config, {"messages": stale}, as_node="agent")
+        except Exception as e:
+            print(f"Error discarding cancelled turn: {e}")
+
+    async def _cancel_speculative_run(self, graph_task: asyncio.Task, config: dict, known_message_ids: set[str]):
+        """Cancel a speculative graph run and remove whatever it checkpointed."""
+        graph_task.cancel()
+        try:
+            await graph_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Speculative graph run failed: {e}")
+
+        state = await self.graph.aget_state(config)
+        stale = [
+            RemoveMessage(id=msg.id)
+            for msg in state.values.get("messages", [])
+            if msg.id not in known_message_ids
+        ]
+        if stale:
+            await self.graph.aupdate_state(config, {"messages": stale}, as_node="agent")
+
+    async def chat_stream(self, message: str, conversation_id: str | None = None) -> AsyncIterator[dict]:
+        """Chat with the agent, yielding events as the react agent produces them.
+
+        Events are dicts with a ``type`` of ``start``, ``token``, ``tool_start``,
+        ``tool_end`` or ``done``. Fact extraction and persistence run in the
+        background once the final event has been yielded. Streamed turns wait
+        for the thread's lock but are never coalesced.
+        """
+        thread_id = conversation_id or "default"
+
+        yield {"type": "start", "conversation_id": thread_id}
+
+        async with self.thread_locks.hold(thread_id):
+            with CHAT_TURNS_IN_FLIGHT.track_inprogress():
+                # aclosing: when the caller closes this stream, the inner one is closed (and a
+                # partial turn discarded) before the lock is released for the next turn
+                async with aclosing(self._stream_turn(thread_id, message)) as events:
+                    async for event in events:
+                        yield event
+
+    async def _stream_turn(self, thread_id: str, message: str) -> AsyncIterator[dict]:
+        config = {"configurable": {"thread_id": thread_id}}
+
+        if self.agent_mode == "single_call":
+            intent_result = None
+            enhanced_message = await self._build_enhanced_message(thread_id, message)
+        elif settings.chat_pipeline_enabled:
+            intent_result, enhanced_message = await asyncio.gather(
+                self.intent_recognizer.recognize_intent(message),
+                self._build_enhanced_message(thread_id, message)
+            )
+        else:
+            intent_result = await self.intent_recognizer.recognize_intent(message)
+            enhanced_message = None
+
+        memory_response = None
+        if intent_result is not None:
+            memory_response = await self._handle_memory_intent(thread_id, message, intent_result)
+        if memory_response is not None:
+            yield {"type": "token", "content": memory_response}
+            yield {"type": "done", "conversation_id": thread_id, "message": memory_response}
+            return
+
+        if enhanced_message is None:
+            enhanced_message = await self._build_enhanced_message(thread_id, message)
+
+        used_memory_tool = False
+        graph_start = time.perf_counter()
+        # Known id, so a turn abandoned mid-stream can be removed from the checkpoint
+        turn_message = HumanMessage(content=enhanced_message, id=str(uuid.uuid4()))
+        try:
+            async for event in self.graph.astream_events({"messages": [turn_message]}, config=config, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    text = _content_text(event["data"]["chunk"].content)
+                    if text:
+                        yield {"type": "token", "content": text}
+                elif kind == "on_tool_start":
+                    used_memory_tool = used_memory_tool or event["name"] in MEMORY_TOOL_NAMES
+                    yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+                elif kind == "on_tool_end":
+                    output = event["data"].get("output")
+                    yield {"type": "tool_end", "name": event["name"], "output": _content_text(getattr(output, "content", output))}
+        except (asyncio.CancelledError, GeneratorExit):
+            # Cancelled (WebSocket cancel, client gone): a half-finished turn, e.g. a tool
+            # call without its result, would make the provider reject every later turn.
+            # Still under the thread lock, so no other turn sees the partial state
+            await asyncio.shield(self._discard_turn(config, turn_message.id))
+            raise
+
+        CHAT_STAGE_SECONDS.observe(time.perf_counter() - graph_start, stage="graph")
+
+        state = await self.graph.aget_state(config)
+        response = _content_text(state.values["messages"][-1].content)
+
+        yield {"type": "done", "conversation_id": thread_id, "message": response}
+
+        if not used_memory_tool:
+            self._run_in_background(self._persist_turn(thread_id, message, response))
+        self._schedule_compaction(thread_id)
+
+    async def _handle_memory_intent(self, thread_id: str, message: str, intent_result: dict) -> Optional[str]:
+        """Execute a memory management intent, or return None for normal chat."""
         intent = intent_result.get("intent", "chat")
         confidence = intent_result.get("confidence", 0.5)
         extracted_info = intent_result.get("extracted_info", {})
 
-        print(f"[DEBUG] Intent: {intent}, Confidence: {confidence}, Info: {extracted_info}")
-
-        # Step 2: Handle memory management intents
-        if intent == "delete_memory" and confidence > 0.7:
+        if intent in MEMORY_INTENTS and confidence > 0.7:
             query = extracted_info.get("query", message)
+            return await self._execute_memory_command(intent, thread_id, query)
+
+        return None
+
+    @timed(CHAT_STAGE_SECONDS, stage="memory_command")
+    async def _execute_memory_command(self, intent: str, thread_id: str, query: str = "") -> str:
+        """Run a memory management command and return the user-facing result."""
+        if intent == "delete_memory":
             deleted = await self.mongo_memory.delete_fact(thread_id, query)
 
             if deleted:
-                return f"✅ 已删除关于「{query}」的记忆", thread_id
+                return f"✅ 已删除关于「{query}」的记忆"
             else:
-                return f"❌ 没有找到关于「{query}」的记忆", thread_id
+                return f"❌ 没有找到关于「{query}」的记忆"
 
-        if intent == "view_memories" and confidence > 0.7:
+        if intent == "view_memories":
             facts = await self.mongo_memory.list_all_facts(thread_id)
 
             if not facts:
-                return "📝 当前没有任何长期记忆", thread_id
+                return "📝 当前没有任何长期记忆"
 
             result = "📝 我的记忆列表：\n\n"
             for i, fact in enumerate(facts, 1):
                 result += f"{i}. **{fact['fact_type']}**\n"
                 result += f"   {fact['content']}\n\n"
 
-            return result.strip(), thread_id
+            return result.strip()
 
-        if intent == "clear_memories" and confidence > 0.7:
+        if intent == "clear_memories":
             count = await self.mongo_memory.clear_all_facts(thread_id)
-            return f"✅ 已清空 {count} 条记忆", thread_id
+            return f"✅ 已清空 {count} 条记忆"
 
-        # Step 3: Normal conversation with memory enhancement
-        facts = await self.mongo_memory.get_facts(thread_id)
+        raise ValueError(f"Unknown memory command: {intent}")
 
-        enhanced_message = message
-        if facts:
-            context = "\n".join([f"- {fact}" for fact in facts])
-            enhanced_message = f"[用户背景信息]\n{context}\n\n[当前消息]\n{message}"
+    def _build_memory_tools(self) -> list:
+        """Memory commands as tools, so the react agent can handle them itself."""
+        agent = self
 
-        result = await self.graph.ainvoke(
-            {"messages": [HumanMessage(content=enhanced_message)]},
-            config=config
-        )
+        @tool
+        async def delete_memory(query: str, config: RunnableConfig) -> str:
+            """删除关于某个内容的长期记忆。query 为要删除的记忆关键词，例如: 我喜欢咖啡"""
+            return await tool_executor.guard(
+                "delete_memory",
+                agent._execute_memory_command("delete_memory", config["configurable"]["thread_id"], query)
+            )
 
-        response_message = result["messages"][-1]
-        response = response_message.content if hasattr(response_message, 'content') else str(response_message)
+        @tool
+        async def view_memories(config: RunnableConfig) -> str:
+            """查看当前记住的所有长期记忆"""
+            return await tool_executor.guard(
+                "view_memories",
+                agent._execute_memory_command("view_memories", config["configurable"]["thread_id"])
+            )
 
-        await self._extract_and_save_facts(thread_id, message, response)
-        await self.mongo_memory.save_conversation(thread_id, message, response)
+        @tool
+        async def clear_memories(config: RunnableConfig) -> str:
+            """清空所有长期记忆"""
+            return await tool_executor.guard(
+                "clear_memories",
+                agent._execute_memory_command("clear_memories", config["configurable"]["thread_id"])
+            )
 
-        return response, thread_id
+        return [delete_memory, view_memories, clear_memories]
 
-    async def _extract_and_save_facts(self, thread_id: str, user_message: str, assistant_response: str):
-        """Extract and save important facts from conversation"""
-        message_lower = user_message.lower()
+    @timed(CHAT_STAGE_SECONDS, stage="facts")
+    async def _build_enhanced_message(self, thread_id: str, message: str) -> str:
+        """Prefix the user message with known long-term facts."""
+        if settings.fact_retrieval_mode == "relevance":
+            prelude = await self.mongo_memory.get_relevant_fact_context(
+                thread_id, message, settings.fact_context_token_budget
+            )
+        else:
+            prelude = await self.mongo_memory.get_fact_context(thread_id)
+
+        if not prelude:
+            return message
+
+        return f"{prelude}\n\n[当前消息]\n{message}"
+
+    @timed(CHAT_STAGE_SECONDS, stage="persist")
+    async def _persist_turn(self, thread_id: str, user_message: str, assistant_response: str):
+        """Extract facts from a finished turn and store the conversation."""
+        if self.write_queue.running:
+            await self.write_queue.put_facts(self._extract_facts(thread_id, user_message))
+            await self.write_queue.put_conversation(
+                MongoMemoryService.conversation_doc(thread_id, user_message, assistant_response)
+            )
+            return
+
+        await self._extract_and_save_facts(thread_id, user_message, assistant_response)
+        await self.mongo_memory.save_conversation(thread_id, user_message, assistant_response)
+
+    def _build_prompt(self, state: dict, config: RunnableConfig) -> list[BaseMessage]:
+        """state_modifier: summary plus recent turns (and the single_call system prompt)."""
+        return self.context_compactor.build_prompt(state, config["configurable"].get("thread_id"), self.system_message)
+
+    def _schedule_compaction(self, thread_id: str):
+        """Refresh the thread's summary in the background if the last turn went over budget."""
+        compactor = self.context_compactor
+        if compactor is None or thread_id not in compactor.due or thread_id in compactor.in_progress:
+            return
+        compactor.due.discard(thread_id)
+        compactor.in_progress.add(thread_id)
+        self._run_in_background(self._compact_thread(thread_id))
+
+    async def _compact_thread(self, thread_id: str):
+        """Fold the thread's older turns into its rolling summary."""
+        compactor = self.context_compactor
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            state = (await self.graph.aget_state(config)).values
+            plan = compactor.plan(state)
+            if plan is None:
+                return
+            folded, boundary = plan
+            with CHAT_STAGE_SECONDS.time(stage="compaction"):
+                summary = await compactor.summarize(state.get("summary", ""), folded)
+            if not summary:
+                return
+            # The boundary message is older than anything a concurrent turn adds, so
+            # only the write itself needs the thread's lock
+            async with self.thread_locks.hold(thread_id):
+                await self.graph.aupdate_state(
+                    config, {"summary": summary, "summarized_through": boundary}, as_node="agent"
+                )
+            compactor.stats["compactions"] += 1
+            compactor.stats["folded_messages"] += len(folded)
+        except Exception as e:
+            compactor.stats["errors"] += 1
+            print(f"Error compacting thread {thread_id}: {e}")
+        finally:
+            compactor.in_progress.discard(thread_id)
 
-        if "我叫" in user_message or "我是" in user_message:
-            if "我叫" in user_message:
-                name_part = user_message.split("我叫")[1].strip()
-                name = name_part.split()[0] if name_part else ""
-                if name:
-                    await self.mongo_memory.save_fact(thread_id, "name", f"用户叫{name}", importance=0.9)
+    def _run_in_background(self, coro):
+        """Schedule a coroutine, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
-        if "喜欢" in user_message or "不爱" in user_message or "讨厌" in user_message:
-            await self.mongo_memory.save_fact(thread_id, "preference", user_message, importance=0.7)
+    async def _extract_and_save_facts(self, thread_id: str, user_message: str, assistant_response: str):
+        """Extract and save important facts from conversation"""
+        await self.mongo_memory.save_facts_bulk(self._extract_facts(thread_id, user_message))
 
-        if "记住" in user_message:
-            await self.mongo_memory.save_fact(thread_id, "important_fact", user_message.replace("记住", "").strip(), importance=0.8)
+    def _extract_facts(self, thread_id: str, user_message: str) -> list[dict]:
+        """Extract important facts from a user message as fact docs"""
+        return [
+            MongoMemoryService.fact_doc(thread_id, fact.fact_type, fact.content, importance=fact.importance)
+            for fact in self.fact_rules.extract(user_message)
+        ]
 
     async def get_conversation_history(self, conversation_id: str | None = None) -> Sequence[BaseMessage]:
         config = {"configurable": {"thread_id": conversation_id or "default"}}
-        state = self.graph.get_state(config)
+        state = await self.graph.aget_state(config)
         return state.values.get("messages", [])
 
     async def get_long_term_memory(self, conversation_id: str | None = None) -> list[str]:
         thread_id = conversation_id or "default"
         return await self.mongo_memory.get_facts(thread_id)
 
+    async def start(self):
+        await self.mongo_memory.start()
+        if isinstance(self.checkpointer, MongoCheckpointSaver):
+            try:
+                await self.checkpointer.setup()
+            except Exception as e:
+                print(f"Error creating checkpoint indexes: {e}")
+        if settings.write_behind_enabled:
+            await self.write_queue.start()
+        if settings.fact_compaction_enabled:
+            await self.fact_compaction.start()
+
     async def close(self):
+        await self.fact_compaction.stop()
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.write_queue.stop()
         await self.mongo_memory.close()
-
-
-# Global agent instance
-agent_service = AgentService()
@@ -0,0 +1,210 @@
+"""
+WebSocket chat sessions
+One socket carries many concurrent turns (each tagged with a client-chosen id), with
+cancellation, heartbeats and a send window so a slow client pushes back on the agent
+"""
+import asyncio
+import json
+import time
+import uuid
+from contextlib import aclosing
+from typing import Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.core.metrics import WS_SESSIONS
+from app.services.llm_gateway import LLMOverloadedError
+
+
+# Close code for a client that stopped answering heartbeats (4000-4999: application-defined)
+HEARTBEAT_TIMEOUT_CLOSE_CODE = 4000
+
+
+class ChatSession:
+    """Serves one WebSocket connection.
+
+    Client frames (JSON):
+        {"type": "chat", "id": "t1", "message": "...", "conversation_id": "..."}
+        {"type": "cancel", "id": "t1"}
+        {"type": "ping"} / {"type": "pong"}
+
+    Server frames are the ``chat_stream`` events (start / token / tool_start /
+    tool_end / done) tagged with the turn ``id``, plus ``cancelled`` and
+    ``error`` for a turn, ``session`` on connect and ``ping`` / ``pong``.
+    ``conversation_id`` is optional after the first turn: the session keeps
+    using the last one. Turns of the same conversation still run one at a time.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        agent_service,
+        conversation_id: Optional[str] = None,
+        heartbeat_interval: float = 20.0,
+        max_concurrent_turns: int = 4,
+        send_queue_size: int = 256
+    ):
+        self.websocket = websocket
+        self.agent = agent_service
+        self.session_id = uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.heartbeat_interval = heartbeat_interval
+        self.max_concurrent_turns = max_concurrent_turns
+        # Turn events take a slot of the send window, so when the client reads slowly
+        # the turns wait instead of buffering; control frames (pong, errors) bypass it
+        # so the read loop never blocks and cancels always get through
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._window = asyncio.Semaphore(send_queue_size)
+        self._turns: dict[str, asyncio.Task] = {}
+        self._last_seen = time.monotonic()
+        self.stats = {"turns": 0, "cancelled": 0, "frames_sent": 0, "tokens_merged": 0}
+
+    async def run(self):
+        await self.websocket.accept()
+        writer = asyncio.create_task(self._write_loop())
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        WS_SESSIONS.inc()
+        try:
+            self._send_control({
+                "type": "session",
+                "session_id": self.session_id,
+                "conversation_id": self.conversation_id,
+                "heartbeat_interval": self.heartbeat_interval,
+            })
+            if self.conversation_id:
+                self._warm(self.conversation_id)
+            await self._read_loop()
+        finally:
+            WS_SESSIONS.dec()
+            for task in list(self._turns.values()):
+                task.cancel()
+            await asyncio.gather(*self._turns.values(), return_exceptions=True)
+            heartbeat.cancel()
+            writer.cancel()
+            await asyncio.gather(heartbeat, writer, return_exceptions=True)
+
+    # ============ Inbound ============
+    async def _read_loop(self):
+        while True:
+            try:
+                text = await self.websocket.receive_text()
+            except (WebSocketDisconnect, RuntimeError):
+                # RuntimeError: the socket was already closed (e.g. heartbeat timeout)
+                return
+            self._last_seen = time.monotonic()
+            try:
+                frame = json.loads(text)
+                kind = frame.get("type")
+            except (ValueError, AttributeError):
+                self._send_control({"type": "error", "detail": "无效的消息格式"})
+                continue
+
+            if kind == "chat":
+                self._start_turn(frame)
+            elif kind == "cancel":
+                self._cancel_turn(str(frame.get("id", "")))
+            elif kind == "ping":
+                self._send_control({"type": "pong"})
+            elif kind == "pong":
+                pass
+            else:
+                self._send_control({"type": "error", "detail": f"未知的消息类型: {kind}"})
+
+    def _start_turn(self, frame: dict):
+        turn_id = str(frame.get("id") or uuid.uuid4().hex[:8])
+        message = frame.get("message")
+        if not isinstance(message, str) or not message.strip():
+            self._send_control({"type": "error", "id": turn_id, "detail": "消息不能为空"})
+            return
+        if turn_id in self._turns:
+            self._send_control({"type": "error", "id": turn_id, "detail": "该 id 的对话仍在进行中"})
+            return
+        if len(self._turns) >= self.max_concurrent_turns:
+            self._send_control({"type": "error", "id": turn_id, "detail": f"同时进行的对话最多 {self.max_concurrent_turns} 个"})
+            return
+
+        conversation_id = frame.get("conversation_id") or self.conversation_id
+        if conversation_id and conversation_id != self.conversation_id:
+            self.conversation_id = conversation_id
+            self._warm(conversation_id)
+
+        self.stats["turns"] += 1
+        task = asyncio.create_task(self._run_turn(turn_id, message, conversation_id))
+        self._turns[turn_id] = task
+        task.add_done_callback(lambda _: self._turns.pop(turn_id, None))
+
+    def _cancel_turn(self, turn_id: str):
+        task = self._turns.get(turn_id)
+        if task is not None:
+            task.cancel()
+
+    async def _run_turn(self, turn_id: str, message: str, conversation_id: Optional[str]):
+        try:
+            # aclosing: a cancel while waiting on the send window still closes the stream
+            # right away, so the agent discards the partial turn and releases the thread
+            async with aclosing(self.agent.chat_stream(message=message, conversation_id=conversation_id)) as events:
+                async for event in events:
+                    if event["type"] == "start":
+                        self.conversation_id = self.conversation_id or event["conversation_id"]
+                    await self._send({**event, "id": turn_id})
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            self._send_control({"type": "cancelled", "id": turn_id})
+            raise
+        except LLMOverloadedError as e:
+            self._send_control({"type": "error", "id": turn_id, "detail": "模型服务繁忙，请稍后重试", "retry_after": e.retry_after})
+        except Exception as e:
+            self._send_control({"type": "error", "id": turn_id, "detail": str(e)})
+
+    def _warm(self, conversation_id: str):
+        """Prefetch the conversation's facts (fact cache / relevance index) before its first turn."""
+        async def warm():
+            try:
+                await self.agent.mongo_memory.warm_facts(conversation_id)
+            except Exception as e:
+                print(f"Error warming facts for {conversation_id}: {e}")
+        self.agent._run_in_background(warm())
+
+    # ============ Outbound ============
+    async def _send(self, frame: dict):
+        """Queue a turn event, waiting for room in the send window."""
+        await self._window.acquire()
+        self._outbox.put_nowait((frame, True))
+
+    def _send_control(self, frame: dict):
+        self._outbox.put_nowait((frame, False))
+
+    async def _write_loop(self):
+        while True:
+            items = [await self._outbox.get()]
+            while not self._outbox.empty():
+                items.append(self._outbox.get_nowait())
+            for frame in self._merge_tokens([frame for frame, _ in items]):
+                await self.websocket.send_text(json.dumps(frame, ensure_ascii=False, default=str))
+                self.stats["frames_sent"] += 1
+            for _, windowed in items:
+                if windowed:
+                    self._window.release()
+
+    def _merge_tokens(self, frames: list[dict]) -> list[dict]:
+        """Collapse consecutive token frames of one turn (only happens when the client lags)."""
+        merged = []
+        for frame in frames:
+            previous = merged[-1] if merged else None
+            if (
+                frame["type"] == "token" and previous is not None
+                and previous["type"] == "token" and previous.get("id") == frame.get("id")
+            ):
+                merged[-1] = {**previous, "content": previous["content"] + frame["content"]}
+                self.stats["tokens_merged"] += 1
+            else:
+                merged.append(frame)
+        return merged
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if time.monotonic() - self._last_seen > 2 * self.heartbeat_interval:
+                await self.websocket.close(code=HEARTBEAT_TIMEOUT_CLOSE_CODE, reason="heartbeat timeout")
+                return
+            self._send_control({"type": "ping", "ts": time.time()})
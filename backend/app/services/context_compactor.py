@@ -0,0 +1,156 @@
+"""
+Rolling conversation summaries
+Once a thread's history passes a token budget, older turns are folded into a running
+summary (kept in the graph state) and only a recent window is sent verbatim
+"""
+from typing import Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.prebuilt.chat_agent_executor import AgentState
+
+from app.core.metrics import PROMPT_TOKENS
+from app.services.fact_index import estimate_tokens
+from app.services.llm_gateway import cached_system_message, use_priority, PRIORITY_BULK
+
+
+SUMMARY_SYSTEM_PROMPT = """你负责维护一段对话的滚动摘要。根据已有摘要和新的对话内容，输出更新后的完整摘要：
+- 保留用户的身份、偏好、计划、未完成的请求和已经给出的结论
+- 删除寒暄和重复内容，不要编造对话中没有的信息
+- 用第三人称简洁陈述（"用户……"、"助手……"），只输出摘要本身"""
+
+# Marker _build_enhanced_message puts between the fact prelude and the user's text
+CURRENT_MESSAGE_MARKER = "[当前消息]\n"
+
+
+class CompactedAgentState(AgentState):
+    """React agent state plus the rolling summary of everything up to ``summarized_through``."""
+    summary: str
+    summarized_through: str  # Id of the last message folded into the summary
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return content or ""
+
+
+def message_tokens(message: BaseMessage) -> int:
+    tokens = estimate_tokens(_message_text(message))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(str(call.get("args", "")))
+    return tokens + 4  # Role and framing overhead
+
+
+def render_transcript(messages: list[BaseMessage]) -> str:
+    """Plain-text transcript for the summarizer (fact preludes and tool plumbing dropped)."""
+    lines = []
+    for message in messages:
+        text = _message_text(message).strip()
+        if isinstance(message, HumanMessage):
+            text = text.rsplit(CURRENT_MESSAGE_MARKER, 1)[-1].strip()
+            lines.append(f"用户: {text}")
+        elif isinstance(message, AIMessage) and text:
+            lines.append(f"助手: {text}")
+        elif isinstance(message, ToolMessage) and text:
+            lines.append(f"工具 {message.name}: {text[:200]}")
+    return "\n".join(lines)
+
+
+class ContextCompactor:
+    """Builds the compacted prompt for each model call and folds old turns into the summary.
+
+    ``build_prompt`` is cheap and runs on every model call; it only flags the
+    thread when the unsummarized history passes ``token_budget``. The caller
+    then runs ``summarize`` in the background and stores the result in the
+    graph state, so the next turn sends the summary plus the last
+    ``recent_turns`` turns instead of the whole history.
+    """
+
+    def __init__(self, llm: BaseChatModel, token_budget: int = 4000, recent_turns: int = 4, summary_max_chars: int = 800):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summary_max_chars = summary_max_chars
+        self.due: set[str] = set()  # Threads over budget, waiting for a summary refresh
+        self.in_progress: set[str] = set()
+        self.stats = {"compactions": 0, "folded_messages": 0, "errors": 0}
+
+    @staticmethod
+    def _unsummarized_start(messages: list[BaseMessage], summarized_through: Optional[str]) -> int:
+        """Index of the first message not covered by the summary (0 if the boundary is gone)."""
+        if summarized_through:
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].id == summarized_through:
+                    return i + 1
+        return 0
+
+    def build_prompt(self, state: dict, thread_id: Optional[str] = None, system: Optional[SystemMessage] = None) -> list[BaseMessage]:
+        """The messages to send for ``state``: system prompt, summary, then the unsummarized tail."""
+        messages = state["messages"]
+        summary = state.get("summary") or ""
+        start = self._unsummarized_start(messages, state.get("summarized_through")) if summary else 0
+        tail = messages[start:]
+
+        if summary and start:
+            system = self._with_summary(system, summary)
+        prompt = ([system] if system is not None else []) + list(tail)
+
+        system_tokens = message_tokens(system) if system is not None else 0
+        tail_tokens = sum(message_tokens(message) for message in tail)
+        full_tokens = system_tokens + tail_tokens + sum(message_tokens(message) for message in messages[:start])
+        PROMPT_TOKENS.observe(full_tokens, stage="uncompacted")
+        PROMPT_TOKENS.observe(system_tokens + tail_tokens, stage="compacted")
+
+        if thread_id and tail_tokens > self.token_budget:
+            self.due.add(thread_id)
+        return prompt
+
+    @staticmethod
+    def _with_summary(system: Optional[SystemMessage], summary: str) -> SystemMessage:
+        # Appended after the (cached) static prompt so the cacheable prefix stays unchanged
+        text = f"[较早对话的摘要]\n{summary}"
+        if system is None:
+            return SystemMessage(content=text)
+        blocks = system.content if isinstance(system.content, list) else [{"type": "text", "text": system.content}]
+        return SystemMessage(content=[*blocks, {"type": "text", "text": text}])
+
+    def plan(self, state: dict) -> Optional[tuple[list[BaseMessage], str]]:
+        """Messages to fold and the new boundary id, or None if nothing should be folded.
+
+        The verbatim window always starts at a user message, so a tool call is
+        never separated from its result.
+        """
+        messages = state.get("messages", [])
+        start = self._unsummarized_start(messages, state.get("summarized_through")) if state.get("summary") else 0
+        if sum(message_tokens(message) for message in messages[start:]) <= self.token_budget:
+            return None
+
+        turn_starts = [i for i in range(start, len(messages)) if isinstance(messages[i], HumanMessage)]
+        if len(turn_starts) <= self.recent_turns:
+            return None
+        boundary = turn_starts[-self.recent_turns] if self.recent_turns else len(messages)
+        if boundary <= start:
+            return None
+        return messages[start:boundary], messages[boundary - 1].id
+
+    async def summarize(self, previous_summary: str, messages: list[BaseMessage]) -> str:
+        """Fold ``messages`` into ``previous_summary`` with one (low-priority) model call."""
+        request = (
+            f"已有摘要：\n{previous_summary or '（无）'}\n\n"
+            f"新的对话内容：\n{render_transcript(messages)}\n\n"
+            f"请输出更新后的摘要（不超过 {self.summary_max_chars} 字）。"
+        )
+        with use_priority(PRIORITY_BULK):
+            response = await self.llm.ainvoke([cached_system_message(SUMMARY_SYSTEM_PROMPT), HumanMessage(content=request)])
+        return _message_text(response).strip()
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "due": len(self.due),
+            "in_progress": len(self.in_progress),
+            "token_budget": self.token_budget,
+            "recent_turns": self.recent_turns,
+        }
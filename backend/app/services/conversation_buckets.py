@@ -0,0 +1,247 @@
+"""
+Time-bucketed conversation storage
+Turns are appended with $push into one document per thread and time window, so a
+history read fetches one or two documents instead of sorting many small ones; cold
+buckets move to a compressed archive collection
+"""
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+import bson
+from bson import Binary, ObjectId
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from app.services import history_cursor
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp: datetime, window: timedelta) -> datetime:
+    """Start of the window ``timestamp`` falls in (windows are aligned to the epoch)."""
+    return EPOCH + ((timestamp - EPOCH) // window) * window
+
+
+def turn_from_doc(doc: dict) -> dict:
+    """A conversation doc (see MongoMemoryService.conversation_doc) as a bucket entry."""
+    return {
+        "_id": doc.get("_id") or ObjectId(),
+        "user_message": doc["user_message"],
+        "assistant_response": doc["assistant_response"],
+        # BSON datetimes have millisecond precision; truncate now so cursors round-trip
+        "timestamp": doc["timestamp"].replace(microsecond=doc["timestamp"].microsecond // 1000 * 1000),
+    }
+
+
+def compress_turns(turns: list[dict]) -> Binary:
+    return Binary(zlib.compress(bson.encode({"turns": turns}), 6))
+
+
+def decompress_turns(data: bytes) -> list[dict]:
+    return bson.decode(zlib.decompress(data))["turns"]
+
+
+class ConversationBucketStore:
+    """Per-thread, per-window documents holding that window's turns.
+
+    A bucket looks like ``{thread_id, start, first_ts, last_ts, count, turns: [...]}``
+    and holds at most ``max_turns`` turns; a full bucket is followed by another
+    one for the same window. A thread's turns are written in order (turns of
+    one thread never overlap), so the last entry of the newest bucket is the
+    latest turn. Buckets whose last turn is older than the archive horizon are
+    moved to ``archive`` with their turns zlib-compressed; reads fetch archived
+    buckets only when they can contribute to the page.
+
+    Buckets written by the migration tool carry ``migrated: true`` and never
+    receive live turns, so re-running the migration can replace them safely.
+    """
+
+    def __init__(self, buckets, archive, window: timedelta = timedelta(hours=24), max_turns: int = 200):
+        self.buckets = buckets
+        self.archive = archive
+        self.window = window
+        self.max_turns = max_turns
+
+    async def ensure_indexes(self):
+        await self.buckets.create_index([("thread_id", 1), ("last_ts", -1)])
+        await self.buckets.create_index([("thread_id", 1), ("first_ts", 1)])
+        await self.buckets.create_index([("thread_id", 1), ("start", 1), ("count", 1)])
+        await self.buckets.create_index([("last_ts", 1)])
+        await self.archive.create_index([("thread_id", 1), ("last_ts", -1)])
+        await self.archive.create_index([("thread_id", 1), ("first_ts", 1)])
+
+    # ============ Writes ============
+    def append_operations(self, docs: list[dict]) -> list[UpdateOne]:
+        """One upsert per (thread, window) that pushes all of its turns in order."""
+        groups: dict[tuple[str, datetime], list[dict]] = {}
+        for doc in docs:
+            turn = turn_from_doc(doc)
+            groups.setdefault((doc["thread_id"], bucket_start(turn["timestamp"], self.window)), []).append(turn)
+
+        operations = []
+        for (thread_id, start), turns in groups.items():
+            for i in range(0, len(turns), self.max_turns):
+                chunk = turns[i:i + self.max_turns]
+                operations.append(UpdateOne(
+                    # Matches a live bucket of this window with room left; otherwise a new one is created
+                    {"thread_id": thread_id, "start": start, "migrated": {"$ne": True},
+                     "count": {"$lte": self.max_turns - len(chunk)}},
+                    {
+                        "$push": {"turns": {"$each": chunk}},
+                        "$inc": {"count": len(chunk)},
+                        "$min": {"first_ts": chunk[0]["timestamp"]},
+                        "$max": {"last_ts": chunk[-1]["timestamp"]},
+                    },
+                    upsert=True
+                ))
+        return operations
+
+    async def append(self, docs: list[dict]) -> int:
+        if not docs:
+            return 0
+        await self.buckets.bulk_write(self.append_operations(docs), ordered=True)
+        return len(docs)
+
+    # ============ Reads ============
+    async def latest_turn_key(self, thread_id: str):
+        doc = await self.buckets.find_one(
+            {"thread_id": thread_id},
+            {"turns": {"$slice": -1}},
+            sort=[("last_ts", -1)]
+        )
+        if doc is None:
+            doc = await self.archive.find_one({"thread_id": thread_id}, {"last_ts": 1, "last_id": 1}, sort=[("last_ts", -1)])
+            return (doc["last_ts"], doc["last_id"]) if doc else None
+        return history_cursor.turn_key(doc["turns"][-1]) if doc.get("turns") else None
+
+    async def page(self, thread_id: str, limit: int, before=None, since=None) -> dict:
+        """Same contract as MongoMemoryService.get_conversation_page."""
+        descending = since is None
+        if descending:
+            query = {"thread_id": thread_id}
+            if before is not None:
+                query["first_ts"] = {"$lte": before[0]}
+            sort = [("last_ts", -1)]
+        else:
+            query = {"thread_id": thread_id, "last_ts": {"$gte": since[0]}}
+            sort = [("first_ts", 1)]
+
+        def wanted(turn):
+            key = history_cursor.turn_key(turn)
+            if before is not None and not key < before:
+                return False
+            return since is None or key > since
+
+        def beyond_edge(bucket) -> bool:
+            # Buckets come newest-last-turn first (or oldest-first-turn first), so once
+            # one cannot beat the page's edge turn, no later bucket can either
+            if len(turns) <= limit:
+                return False
+            edge = turns[limit]["timestamp"]
+            return bucket["last_ts"] < edge if descending else bucket["first_ts"] > edge
+
+        turns = []
+        for collection in (self.buckets, self.archive):
+            if collection is self.archive and len(turns) > limit:
+                # Usually the hot buckets fill the page; probe the archive's nearest bucket
+                # (index only) before fetching any archived turns. Archived and hot turns
+                # may interleave, e.g. after re-running the migration
+                nearest = await collection.find_one(query, {"first_ts": 1, "last_ts": 1}, sort=sort)
+                if nearest is None or beyond_edge(nearest):
+                    break
+            async for bucket in collection.find(query).sort(sort):
+                if beyond_edge(bucket):
+                    break
+                bucket_turns = bucket["turns"] if "turns" in bucket else decompress_turns(bucket["turns_z"])
+                turns.extend(turn for turn in bucket_turns if wanted(turn))
+                turns.sort(key=history_cursor.turn_key, reverse=descending)
+
+        has_more = len(turns) > limit
+        turns = turns[:limit]
+        if descending:
+            turns.reverse()
+        return {"turns": [{**turn, "thread_id": thread_id} for turn in turns], "has_more": has_more}
+
+    async def history(self, thread_id: str, limit: int) -> list[dict]:
+        return (await self.page(thread_id, limit))["turns"]
+
+    # ============ Archive ============
+    async def archive_cold(self, older_than: timedelta, batch_size: int = 100) -> dict:
+        """Move buckets whose last turn is older than ``older_than`` to the archive collection."""
+        # A bucket of the current window may still receive turns
+        cutoff = datetime.utcnow() - max(older_than, 2 * self.window)
+        report = {"archived": 0, "turns": 0, "bytes_before": 0, "bytes_after": 0}
+        while True:
+            batch = await self.buckets.find({"last_ts": {"$lt": cutoff}}).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                return report
+            operations = []
+            for bucket in batch:
+                turns = bucket.pop("turns")
+                last = max(turns, key=history_cursor.turn_key)
+                archived = {**bucket, "turns_z": compress_turns(turns), "last_id": last["_id"]}
+                operations.append(ReplaceOne({"_id": bucket["_id"]}, archived, upsert=True))
+                report["turns"] += len(turns)
+                report["bytes_before"] += len(bson.encode({**bucket, "turns": turns}))
+                report["bytes_after"] += len(bson.encode(archived))
+            # Copy first, then delete: a crash in between leaves a duplicate the next run overwrites
+            await self.archive.bulk_write(operations, ordered=False)
+            await self.buckets.bulk_write([DeleteMany({"_id": {"$in": [bucket["_id"] for bucket in batch]}})])
+            report["archived"] += len(batch)
+
+    # ============ Migration ============
+    def migration_buckets(self, thread_id: str, docs: list[dict]) -> list[dict]:
+        """Buckets (``migrated: true``) holding a thread's one-document-per-turn history."""
+        turns = sorted((turn_from_doc(doc) for doc in docs), key=history_cursor.turn_key)
+        buckets = []
+        for turn in turns:
+            start = bucket_start(turn["timestamp"], self.window)
+            if not buckets or buckets[-1]["start"] != start or buckets[-1]["count"] >= self.max_turns:
+                buckets.append({"thread_id": thread_id, "start": start, "migrated": True, "count": 0,
+                                "first_ts": turn["timestamp"], "turns": []})
+            bucket = buckets[-1]
+            bucket["turns"].append(turn)
+            bucket["count"] += 1
+            bucket["last_ts"] = turn["timestamp"]
+        return buckets
+
+    async def migrate(self, source, thread_ids: Optional[list[str]] = None) -> dict:
+        """Copy ``source`` (one document per turn) into buckets, thread by thread.
+
+        Idempotent: a thread's earlier migrated buckets are replaced, and turns
+        keep their original _id so existing history cursors stay valid. The
+        source collection is left untouched.
+        """
+        report = {"threads": 0, "turns": 0, "buckets": 0}
+        query = {"thread_id": {"$in": thread_ids}} if thread_ids else {}
+        thread_id, docs = None, []
+
+        async def flush():
+            buckets = self.migration_buckets(thread_id, docs)
+            await self.buckets.delete_many({"thread_id": thread_id, "migrated": True})
+            await self.archive.delete_many({"thread_id": thread_id, "migrated": True})
+            if buckets:
+                await self.buckets.insert_many(buckets, ordered=True)
+            report["threads"] += 1
+            report["turns"] += len(docs)
+            report["buckets"] += len(buckets)
+
+        async for doc in source.find(query).sort([("thread_id", 1), ("timestamp", 1), ("_id", 1)]):
+            if doc["thread_id"] != thread_id and docs:
+                await flush()
+                docs = []
+            thread_id = doc["thread_id"]
+            docs.append(doc)
+        if docs:
+            await flush()
+        return report
+
+    async def count_turns(self, thread_id: Optional[str] = None) -> int:
+        """Turns stored in hot and archived buckets (for verifying a migration)."""
+        query = {"thread_id": thread_id} if thread_id else {}
+        total = 0
+        for collection in (self.buckets, self.archive):
+            async for doc in collection.aggregate([{"$match": query}, {"$group": {"_id": None, "n": {"$sum": "$count"}}}]):
+                total += doc["n"]
+        return total
@@ -0,0 +1,218 @@
+"""
+Per-thread L1 cache for long-term facts
+Caches each thread's top facts and the rendered [用户背景信息] prelude
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+
+def render_fact_prelude(facts: list[str]) -> str:
+    """Render facts as the context block prepended to the user message."""
+    if not facts:
+        return ""
+    context = "\n".join([f"- {fact}" for fact in facts])
+    return f"[用户背景信息]\n{context}"
+
+
+class GenerationTable:
+    """Bounded per-thread write counters for discarding reads that raced with a write.
+
+    Generations come from one global clock. Only the most recently written
+    ``max_entries`` threads keep their own entry; any other thread reports the
+    clock value at the last eviction (the floor). The floor only ever rises
+    past every forgotten value, so a read that started before a write always
+    sees a different generation afterwards. At worst an unrelated eviction
+    makes a result uncacheable once.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._clock = 0
+        self._floor = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, thread_id: str) -> int:
+        return self._entries.get(thread_id, self._floor)
+
+    def bump(self, thread_id: str):
+        self._clock += 1
+        self._entries[thread_id] = self._clock
+        self._entries.move_to_end(thread_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._floor = self._clock
+
+
+@dataclass
+class CachedFacts:
+    facts: list[str]
+    prelude: str
+    size: int
+    expires_at: float
+
+
+class FactCache:
+    """LRU of thread_id -> top facts, bounded by thread count and approximate bytes.
+
+    Writers call ``invalidate`` synchronously after changing a thread's facts.
+    A per-thread generation counter stops a read that raced with a write from
+    repopulating the cache with the pre-write result.
+    """
+
+    def __init__(self, max_threads: int = 1000, max_bytes: int = 8 * 1024 * 1024, ttl_seconds: float = 300):
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, CachedFacts] = OrderedDict()
+        self._generations = GenerationTable(max_entries=max(1024, 4 * max_threads))
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def generation(self, thread_id: str) -> int:
+        return self._generations.get(thread_id)
+
+    def get(self, thread_id: str) -> Optional[CachedFacts]:
+        entry = self._entries.get(thread_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                self._remove(thread_id)
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(thread_id)
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, thread_id: str, facts: list[str], generation: int) -> CachedFacts:
+        prelude = render_fact_prelude(facts)
+        entry = CachedFacts(
+            facts=facts,
+            prelude=prelude,
+            size=sum(len(f.encode("utf-8")) for f in facts) + len(prelude.encode("utf-8")),
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        # A write happened while this result was being read; don't cache it
+        if generation != self.generation(thread_id):
+            return entry
+
+        self._remove(thread_id)
+        self._entries[thread_id] = entry
+        self._bytes += entry.size
+
+        while self._entries and (len(self._entries) > self.max_threads or self._bytes > self.max_bytes):
+            evicted, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            self.stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, thread_ids: Iterable[str]):
+        for thread_id in thread_ids:
+            self._generations.bump(thread_id)
+            self._remove(thread_id)
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        for thread_id in list(self._entries):
+            self.invalidate([thread_id])
+
+    def _remove(self, thread_id: str):
+        old = self._entries.pop(thread_id, None)
+        if old is not None:
+            self._bytes -= old.size
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "threads": len(self._entries),
+            "generations": len(self._generations),
+            "bytes": self._bytes,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+class MongoInvalidationChannel:
+    """Cross-worker invalidation over a capped collection tailed by every worker.
+
+    Works on standalone MongoDB (no replica set / change streams needed).
+    """
+
+    COLLECTION = "fact_cache_invalidations"
+
+    def __init__(self, db_provider, on_invalidate: Callable[[list[str]], None], size_bytes: int = 1024 * 1024):
+        self._db_provider = db_provider
+        self._on_invalidate = on_invalidate
+        self._size_bytes = size_bytes
+        self._collection = None
+        self._listener: Optional[asyncio.Task] = None
+        self.origin = uuid.uuid4().hex
+
+    async def _get_collection(self):
+        if self._collection is None:
+            db = await self._db_provider()
+            try:
+                await db.create_collection(self.COLLECTION, capped=True, size=self._size_bytes)
+            except CollectionInvalid:
+                pass
+            self._collection = db[self.COLLECTION]
+        return self._collection
+
+    async def publish(self, thread_ids: list[str]):
+        try:
+            collection = await self._get_collection()
+            await collection.insert_one({"thread_ids": thread_ids, "origin": self.origin})
+        except Exception as e:
+            print(f"Error publishing fact cache invalidation: {e}")
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        collection = await self._get_collection()
+        # Start after the newest existing message; a capped collection needs one doc to tail
+        last = await collection.find_one(sort=[("$natural", -1)])
+        if last is None:
+            await collection.insert_one({"thread_ids": [], "origin": self.origin})
+            last = await collection.find_one(sort=[("$natural", -1)])
+        last_id = last["_id"]
+
+        while True:
+            try:
+                # ObjectIds from different processes aren't ordered, so resume in natural
+                # (insertion) order by skipping up to the last message seen, not with $gt.
+                # If it was already overwritten, replay everything: extra invalidations are harmless
+                skipping = await collection.find_one({"_id": last_id}, {"_id": 1}) is not None
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        if skipping:
+                            skipping = doc["_id"] != last_id
+                            continue
+                        last_id = doc["_id"]
+                        if doc.get("origin") != self.origin and doc.get("thread_ids"):
+                            self._on_invalidate(doc["thread_ids"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Fact cache invalidation listener error: {e}")
+            await asyncio.sleep(1)
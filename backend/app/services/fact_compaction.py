@@ -0,0 +1,259 @@
+"""
+Background fact compaction
+Clusters near-duplicate facts per thread (MinHash + LSH over character shingles),
+merges each cluster into one fact, decays importance over time and marks low-value
+facts for expiry by the long_term_memory TTL index
+"""
+import asyncio
+import os
+import socket
+import time
+import unicodedata
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from pymongo.errors import DuplicateKeyError
+
+
+# Largest prime below 2**32: (a * x + b) % P stays inside uint64 for 32-bit a, b, x
+_PRIME = np.uint64(4294967291)
+
+# A fact repeated across a cluster is evidence that it matters
+REINFORCEMENT_PER_DUPLICATE = 0.05
+
+
+def shingles(text: str, k: int = 2) -> set[str]:
+    """Character k-grams of ``text`` with case, whitespace and punctuation folded away."""
+    text = "".join(ch for ch in text.lower() if not (ch.isspace() or unicodedata.category(ch).startswith("P")))
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def lsh_rows(num_perm: int, threshold: float) -> int:
+    """Rows per LSH band: the largest divisor of ``num_perm`` whose band threshold
+    (1/bands)^(1/rows) is still at or below ``threshold``, so true pairs are rarely missed."""
+    best = 1
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows == 0 and (rows / num_perm) ** (1 / rows) <= threshold:
+            best = rows
+    return best
+
+
+class MinHasher:
+    """MinHash signatures over shingle sets, with banded LSH to find candidate pairs."""
+
+    def __init__(self, num_perm: int = 64, threshold: float = 0.6, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.threshold = threshold
+        self.rows = lsh_rows(num_perm, threshold)
+        self._a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.uint64
+        ) % _PRIME
+        if hashes.size == 0:
+            return np.full(self.num_perm, int(_PRIME), dtype=np.uint64)
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of the two shingle sets."""
+        return float(np.mean(a == b))
+
+    def clusters(self, texts: list[str]) -> list[list[int]]:
+        """Groups of indexes whose texts are near-duplicates (singletons included)."""
+        signatures = [self.signature(text) for text in texts]
+        parent = list(range(len(texts)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for start in range(0, self.num_perm, self.rows):
+            buckets: dict[bytes, int] = {}
+            for i, sig in enumerate(signatures):
+                key = sig[start:start + self.rows].tobytes()
+                j = buckets.setdefault(key, i)
+                if j != i and find(i) != find(j) and self.similarity(signatures[i], signatures[j]) >= self.threshold:
+                    parent[find(i)] = find(j)
+
+        groups: dict[int, list[int]] = {}
+        for i in range(len(texts)):
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
+
+
+def snapshot_filter(doc: dict) -> dict:
+    """Matches ``doc`` only while it is unchanged since it was read: saving a fact again
+    resets its timestamp, so the plan's write for it is skipped instead of clobbering it."""
+    return {"_id": doc["_id"], "timestamp": doc.get("timestamp")}
+
+
+@dataclass
+class ThreadPlan:
+    """Writes for one thread as (filter, $set) updates and delete filters (see snapshot_filter)."""
+    updates: list = field(default_factory=list)
+    deletes: list = field(default_factory=list)
+    clusters: int = 0
+    decayed: int = 0
+    expiring: int = 0
+
+
+class FactCompactor:
+    """Plans the compaction of one thread's facts (pure; the caller does the I/O).
+
+    Facts of the same type are clustered by MinHash similarity; each cluster
+    keeps its most recent wording, the highest importance plus a small boost
+    per duplicate, and the summed mention count. Importance then decays with
+    a half-life measured from the last mention (or the last decay), except for
+    ``exempt_types``; facts that fall below ``expire_importance`` get an
+    ``expires_at`` ``expire_grace_days`` out, and the TTL index removes them
+    unless they are mentioned again first (saving a fact clears ``expires_at``).
+    """
+
+    def __init__(
+        self,
+        similarity: float = 0.6,
+        num_perm: int = 64,
+        half_life_days: float = 30,
+        exempt_types: tuple[str, ...] = ("name", "important_fact"),
+        expire_importance: float = 0.1,
+        expire_grace_days: float = 7
+    ):
+        self.hasher = MinHasher(num_perm=num_perm, threshold=similarity)
+        self.half_life = timedelta(days=half_life_days)
+        self.exempt_types = set(exempt_types)
+        self.expire_importance = expire_importance
+        self.expire_grace = timedelta(days=expire_grace_days)
+
+    def decayed_importance(self, doc: dict, now: datetime) -> float:
+        importance = doc.get("importance", 0.5)
+        if doc.get("fact_type") in self.exempt_types or not self.half_life:
+            return importance
+        since = max(doc.get("timestamp") or now, doc.get("decayed_at") or datetime.min)
+        elapsed = max((now - since).total_seconds(), 0.0)
+        return importance * 0.5 ** (elapsed / self.half_life.total_seconds())
+
+    def plan_thread(self, docs: list[dict], now: datetime) -> ThreadPlan:
+        plan = ThreadPlan()
+        by_type: dict[str, list[dict]] = {}
+        for doc in docs:
+            by_type.setdefault(doc.get("fact_type", ""), []).append(doc)
+
+        for group in by_type.values():
+            for cluster in self.hasher.clusters([doc["content"] for doc in group]):
+                members = [group[i] for i in cluster]
+                keep = max(members, key=lambda doc: doc.get("timestamp") or datetime.min)
+                importance = max(self.decayed_importance(doc, now) for doc in members)
+                update = {}
+
+                if len(members) > 1:
+                    plan.clusters += 1
+                    plan.deletes.extend(snapshot_filter(doc) for doc in members if doc is not keep)
+                    importance = min(1.0, importance + REINFORCEMENT_PER_DUPLICATE * (len(members) - 1))
+                    update["mentions"] = sum(doc.get("mentions", 1) for doc in members)
+
+                if abs(importance - keep.get("importance", 0.5)) >= 0.005 or update:
+                    update["importance"] = round(importance, 4)
+                    update["decayed_at"] = now
+                    plan.decayed += importance < keep.get("importance", 0.5)
+
+                if importance < self.expire_importance and keep.get("fact_type") not in self.exempt_types:
+                    if keep.get("expires_at") is None:
+                        update["expires_at"] = now + self.expire_grace
+                        plan.expiring += 1
+                elif keep.get("expires_at") is not None:
+                    # Reinforced back above the threshold (the TTL index ignores null)
+                    update["expires_at"] = None
+
+                if update:
+                    plan.updates.append((snapshot_filter(keep), update))
+        return plan
+
+
+class FactCompactionJob:
+    """Runs ``MongoMemoryService.compact_facts`` every ``interval`` seconds.
+
+    With several workers, a lease document in ``job_leases`` lets only one of
+    them run the scheduled compaction per interval. Manual runs skip the lease;
+    overlapping runs are harmless since every write is idempotent.
+    """
+
+    LEASE_ID = "fact_compaction"
+
+    def __init__(self, memory, compactor: FactCompactor, interval: float = 3600):
+        self.memory = memory
+        self.compactor = compactor
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_report: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "skipped_lease": 0, "errors": 0}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Error compacting facts: {e}")
+
+    async def _acquire_lease(self) -> bool:
+        db = await self.memory.get_database()
+        now = datetime.utcnow()
+        try:
+            await db["job_leases"].update_one(
+                {"_id": self.LEASE_ID, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.interval * 0.9)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Lease held by another worker: the filter missed and the upsert hit the existing _id
+            return False
+
+    async def run_once(self, dry_run: bool = False, use_lease: bool = True) -> Optional[dict]:
+        """Compact now; returns the report, or None if another worker holds the lease."""
+        async with self._lock:
+            if use_lease and not dry_run and not await self._acquire_lease():
+                self.stats["skipped_lease"] += 1
+                return None
+            start = time.perf_counter()
+            report = await self.memory.compact_facts(self.compactor, dry_run=dry_run)
+            report["duration_s"] = round(time.perf_counter() - start, 4)
+            if not dry_run:
+                self.stats["runs"] += 1
+                self.last_report = report
+            return report
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "interval": self.interval,
+            "running": self._task is not None and not self._task.done(),
+            "last_report": self.last_report,
+        }
@@ -0,0 +1,164 @@
+"""
+Local relevance index for long-term facts
+Hashed character n-gram vectors + NumPy cosine top-k, no external embedding service
+"""
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from app.services.fact_cache import GenerationTable
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per ~4 other characters."""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class HashingVectorizer:
+    """Maps text to a vector of signed, hashed character n-gram counts."""
+
+    def __init__(self, dim: int = 4096, ngram_range: tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = "".join(text.lower().split())
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                # Top bit picks the sign so collisions tend to cancel out
+                vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+
+class FactIndex:
+    """Vectors for one thread's facts, updated incrementally."""
+
+    def __init__(self, vectorizer: HashingVectorizer):
+        self.vectorizer = vectorizer
+        self._keys: list[tuple[str, str]] = []
+        self._importance: list[float] = []
+        self._rows: list[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._idf: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, fact_type: str, content: str, importance: float):
+        key = (fact_type, content)
+        if key in self._keys:
+            self._importance[self._keys.index(key)] = importance
+            return
+        self._keys.append(key)
+        self._importance.append(importance)
+        self._rows.append(self.vectorizer.transform(content))
+        self._matrix = None
+
+    def remove(self, predicate) -> int:
+        """Remove facts whose content matches ``predicate``; return how many."""
+        keep = [i for i, (_, content) in enumerate(self._keys) if not predicate(content)]
+        removed = len(self._keys) - len(keep)
+        if removed:
+            self._keys = [self._keys[i] for i in keep]
+            self._importance = [self._importance[i] for i in keep]
+            self._rows = [self._rows[i] for i in keep]
+            self._matrix = None
+        return removed
+
+    def query(self, text: str, relevance_weight: float = 0.8) -> list[tuple[str, float]]:
+        """All facts ranked by a blend of cosine similarity and importance."""
+        if not self._keys:
+            return []
+        if self._matrix is None:
+            self._build_matrix()
+
+        similarity = self._matrix @ _normalize(self.vectorizer.transform(text) * self._idf)
+        scores = relevance_weight * similarity + (1 - relevance_weight) * np.asarray(self._importance, dtype=np.float32)
+        order = np.argsort(-scores, kind="stable")
+        return [(self._keys[i][1], float(scores[i])) for i in order]
+
+    def _build_matrix(self):
+        # IDF over this thread's facts, so n-grams every fact shares ("我喜欢") count for little
+        counts = np.vstack(self._rows)
+        df = np.count_nonzero(counts, axis=0)
+        self._idf = (np.log((1 + len(self._rows)) / (1 + df)) + 1).astype(np.float32)
+        weighted = counts * self._idf
+        norms = np.linalg.norm(weighted, axis=1, keepdims=True)
+        self._matrix = weighted / np.where(norms == 0, 1, norms)
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FactIndexStore:
+    """LRU of per-thread indexes, each rebuilt after ``ttl_seconds``.
+
+    Writes to a thread whose index is not loaded bump its generation, so a
+    load that was in flight during the write is discarded instead of cached.
+    The TTL bounds how long writes this worker did not see (other workers,
+    TTL deletes) stay invisible, as in FactCache.
+    """
+
+    def __init__(self, dim: int = 4096, max_threads: int = 200, ttl_seconds: float = 300):
+        self.vectorizer = HashingVectorizer(dim=dim)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        # thread_id -> (index, monotonic expiry)
+        self._indexes: OrderedDict[str, tuple[FactIndex, float]] = OrderedDict()
+        self._generations = GenerationTable(max_entries=max(1024, 4 * max_threads))
+
+    def get(self, thread_id: str) -> Optional[FactIndex]:
+        entry = self._indexes.get(thread_id)
+        if entry is None:
+            return None
+        index, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._indexes[thread_id]
+            return None
+        self._indexes.move_to_end(thread_id)
+        return index
+
+    def generation(self, thread_id: str) -> int:
+        return self._generations.get(thread_id)
+
+    def build(self, thread_id: str, facts: list[dict], generation: int) -> FactIndex:
+        index = FactIndex(self.vectorizer)
+        for fact in facts:
+            index.add(fact["fact_type"], fact["content"], fact.get("importance", 0.5))
+
+        if generation == self.generation(thread_id):
+            self._indexes[thread_id] = (index, time.monotonic() + self.ttl_seconds)
+            self._indexes.move_to_end(thread_id)
+            while len(self._indexes) > self.max_threads:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add(self, thread_id: str, fact_type: str, content: str, importance: float):
+        index = self.get(thread_id)
+        if index is not None:
+            index.add(fact_type, content, importance)
+        else:
+            self._bump(thread_id)
+
+    def remove(self, thread_id: str, predicate):
+        index = self.get(thread_id)
+        if index is not None:
+            index.remove(predicate)
+        else:
+            self._bump(thread_id)
+
+    def drop(self, thread_id: str):
+        self._indexes.pop(thread_id, None)
+        self._bump(thread_id)
+
+    def _bump(self, thread_id: str):
+        self._generations.bump(thread_id)
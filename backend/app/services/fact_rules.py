@@ -0,0 +1,246 @@
+"""
+Declarative fact extraction rules
+The rule table is compiled into one Aho-Corasick automaton, so every rule is
+matched in a single pass over the message; rules can be reloaded from a JSON file
+"""
+import json
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Iterator, NamedTuple, Optional
+
+
+# How a matched rule turns the message into fact content
+EXTRACT_MODES = {
+    "message",          # The whole message
+    "after_trigger",    # The first whitespace-separated word after the first trigger
+    "without_triggers", # The message with every trigger of the rule removed
+}
+
+
+@dataclass(frozen=True)
+class FactRule:
+    fact_type: str
+    triggers: tuple[str, ...]
+    importance: float = 0.5
+    extract: str = "message"
+    template: str = "{value}"  # Fact content; {value} is the extracted text
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FactRule":
+        triggers = tuple(t for t in data.get("triggers", []) if t)
+        if not data.get("fact_type") or not triggers:
+            raise ValueError(f"Fact rule needs a fact_type and at least one trigger: {data}")
+        extract = data.get("extract", "message")
+        if extract not in EXTRACT_MODES:
+            raise ValueError(f"Unknown extract mode {extract!r}, expected one of {sorted(EXTRACT_MODES)}")
+        template = data.get("template", "{value}")
+        template.format(value="")  # Fail on load, not on the first matching message
+        return cls(
+            fact_type=data["fact_type"],
+            triggers=triggers,
+            importance=float(data.get("importance", 0.5)),
+            extract=extract,
+            template=template,
+        )
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "triggers": list(self.triggers)}
+
+
+# Built-in rules, used when FACT_RULES_PATH is not set
+DEFAULT_RULES = [
+    FactRule("name", ("我叫",), importance=0.9, extract="after_trigger", template="用户叫{value}"),
+    FactRule("preference", ("喜欢", "不爱", "讨厌"), importance=0.7, extract="message"),
+    FactRule("important_fact", ("记住",), importance=0.8, extract="without_triggers"),
+]
+
+
+class ExtractedFact(NamedTuple):
+    fact_type: str
+    content: str
+    importance: float
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: reports every (possibly overlapping) occurrence in one scan."""
+
+    def __init__(self, patterns: list[str]):
+        self.patterns = patterns
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple[int, ...]] = [()]
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = next_state
+            self._out[state] += (index,)
+
+        # Breadth-first: a state's failure link points to a shallower state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] += self._out[self._fail[child]]
+
+        # Fold failure links into the transition tables (except the root's, which
+        # every state falls back to), so scanning is one dict lookup per character
+        self._delta: list[dict[str, int]] = [dict(self._goto[0])]
+        for state in range(1, len(self._goto)):
+            table, fallback = {}, state
+            while fallback:
+                for char, target in self._goto[fallback].items():
+                    table.setdefault(char, target)
+                fallback = self._fail[fallback]
+            self._delta.append(table)
+
+    def finditer(self, text: str) -> Iterator[tuple[int, int]]:
+        """Yield (start, pattern index) for every occurrence, in order of end position."""
+        delta, root, out, patterns = self._delta, self._delta[0], self._out, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            state = delta[state].get(char) or root.get(char, 0)
+            if out[state]:
+                for index in out[state]:
+                    yield position + 1 - len(patterns[index]), index
+
+
+class _CompiledRules:
+    """An immutable rule table plus its automaton; swapped as a whole on reload."""
+
+    def __init__(self, rules: list[FactRule]):
+        self.rules = rules
+        triggers: dict[str, list[int]] = {}
+        for rule_index, rule in enumerate(rules):
+            for trigger in rule.triggers:
+                triggers.setdefault(trigger, []).append(rule_index)
+        self.patterns = list(triggers)
+        self.pattern_rules = [triggers[pattern] for pattern in self.patterns]
+        self.automaton = AhoCorasick(self.patterns)
+
+
+class FactRuleEngine:
+    """Extracts facts from a message with a declarative, hot-reloadable rule table.
+
+    With a rules file, its modification time is checked at most every
+    ``reload_interval`` seconds and the table is recompiled when it changes.
+    A file that fails to load is reported and the previous rules stay active.
+    """
+
+    def __init__(self, rules: Optional[list[FactRule]] = None, path: str = "", reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.stats = {"messages": 0, "matched": 0, "facts": 0, "reloads": 0, "reload_errors": 0}
+        self.last_error: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._compiled = _CompiledRules(list(rules if rules is not None else DEFAULT_RULES))
+        if path:
+            self.reload()
+
+    @property
+    def rules(self) -> list[FactRule]:
+        return self._compiled.rules
+
+    def load(self, rules: list[FactRule]):
+        """Replace the rule table (compiled before the swap, so readers never see half a table)."""
+        self._compiled = _CompiledRules(list(rules))
+
+    def reload(self) -> bool:
+        """Load the rules file now; returns False (keeping the old rules) if it can't be loaded."""
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            rules = [FactRule.from_dict(item) for item in data]
+            self.load(rules)
+        except Exception as e:
+            self.stats["reload_errors"] += 1
+            self.last_error = str(e)
+            print(f"Error loading fact rules from {self.path}: {e}")
+            return False
+        self._mtime = mtime
+        self.last_error = None
+        self.stats["reloads"] += 1
+        print(f"✅ Loaded {len(rules)} fact rules from {self.path}")
+        return True
+
+    def maybe_reload(self):
+        """Reload the rules file if it changed (checked at most every reload_interval seconds)."""
+        if not self.path or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            # Remember the version even if it fails to load, so a broken file is reported once
+            self._mtime = mtime
+            self.reload()
+
+    def extract(self, message: str) -> list[ExtractedFact]:
+        """All facts in ``message``, at most one per rule."""
+        self.maybe_reload()
+        compiled = self._compiled
+        self.stats["messages"] += 1
+
+        # One scan collects every trigger occurrence, grouped by rule
+        spans: dict[int, list[tuple[int, int]]] = {}
+        for start, pattern_index in compiled.automaton.finditer(message):
+            end = start + len(compiled.patterns[pattern_index])
+            for rule_index in compiled.pattern_rules[pattern_index]:
+                spans.setdefault(rule_index, []).append((start, end))
+        if not spans:
+            return []
+
+        facts = []
+        for rule_index in sorted(spans):
+            rule = compiled.rules[rule_index]
+            value = self._extract_value(rule, message, sorted(spans[rule_index]))
+            if value:
+                facts.append(ExtractedFact(rule.fact_type, rule.template.format(value=value), rule.importance))
+
+        self.stats["matched"] += 1
+        self.stats["facts"] += len(facts)
+        return facts
+
+    @staticmethod
+    def _extract_value(rule: FactRule, message: str, spans: list[tuple[int, int]]) -> str:
+        if rule.extract == "after_trigger":
+            words = message[spans[0][1]:].split()
+            return words[0] if words else ""
+        if rule.extract == "without_triggers":
+            parts, position = [], 0
+            for start, end in spans:
+                if start > position:
+                    parts.append(message[position:start])
+                position = max(position, end)
+            parts.append(message[position:])
+            return "".join(parts).strip()
+        return message
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "path": self.path or None,
+            "last_error": self.last_error,
+            "triggers": len(self._compiled.patterns),
+            "rules": [rule.to_dict() for rule in self.rules],
+        }
@@ -0,0 +1,59 @@
+"""
+Token-based fact matching
+Normalized token arrays let fact lookups use a multikey index instead of regex scans
+"""
+import re
+import unicodedata
+
+
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD = re.compile(r"[^\W_]+")
+
+# Bumped whenever fact_tokens changes; facts stored with an older version are re-tokenized
+TOKENS_VERSION = 2
+# Latin words are indexed by their prefixes up to this length (longer query words are truncated)
+MAX_PREFIX_LENGTH = 16
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def fact_tokens(text: str) -> list[str]:
+    """Index tokens for a fact: CJK character bigrams plus prefixes of lowercase words.
+
+    Every ``query_tokens`` of a CJK substring of the fact is a fact token, so
+    ``{"tokens": {"$all": query_tokens(query)}}`` finds all candidates; Latin
+    words are matched from the start of a word ("coff" finds "coffee").
+    """
+    text = normalize_text(text)
+    tokens = []
+
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        # Single characters too, so a one-character query can still be matched
+        tokens.extend(run)
+
+    for word in _WORD.findall(_CJK_RUN.sub(" ", text)):
+        tokens.extend(word[:i] for i in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1))
+
+    return sorted(set(tokens))
+
+
+def query_tokens(query: str) -> list[str]:
+    """Tokens a matching fact must contain (bigrams only, unless the query is one character)."""
+    text = normalize_text(query)
+    tokens = []
+
+    for run in _CJK_RUN.findall(text):
+        tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+
+    tokens.extend(word[:MAX_PREFIX_LENGTH] for word in _WORD.findall(_CJK_RUN.sub(" ", text)))
+
+    return sorted(set(tokens))
+
+
+def fact_matches(query: str, content: str) -> bool:
+    """Literal, case-insensitive substring match (what the old regex did, minus the regex)."""
+    query = normalize_text(query).strip()
+    return bool(query) and query in normalize_text(content)
@@ -0,0 +1,162 @@
+"""
+Local fast-path intent classifier
+Answers confident cases in-process so only ambiguous messages reach the LLM
+"""
+import re
+from typing import Optional
+
+
+# ============ Vocabulary ============
+# Shared with IntentRecognizer._keyword_fallback
+DELETE_KEYWORDS = ["忘记", "删除记忆", "不要记住", "别记着"]
+VIEW_KEYWORDS = ["查看记忆", "记忆列表", "所有记忆", "你知道什么", "你都记得什么"]
+CLEAR_KEYWORDS = ["清空记忆", "删除所有记忆", "全部忘记", "重置记忆"]
+# Characters that suggest a memory command worded without any trigger phrase ("把那条记录删掉")
+MEMORY_TERMS = ["记", "忆", "忘", "删"]
+
+# (text, intent, query) — mirrors the few-shot examples in the intent prompt
+FEW_SHOT_EXAMPLES = [
+    ("忘记我喜欢咖啡", "delete_memory", "我喜欢咖啡"),
+    ("你都知道什么", "view_memories", ""),
+    ("别记着我喜欢吃辣", "delete_memory", "喜欢吃辣"),
+    ("你好，今天天气怎么样", "chat", ""),
+]
+
+# Everyday messages used to prune cues that also show up in normal chat
+CHAT_EXAMPLES = [
+    "你好", "早上好", "谢谢你", "今天天气怎么样", "你知道怎么做蛋糕吗",
+    "什么是机器学习", "你都会做什么", "帮我写一首诗", "我喜欢猫", "现在几点了",
+    "帮我算一下 2 + 2", "我叫小明", "记得提醒我喝水", "明天有什么安排",
+    "给我讲个笑话", "这个问题怎么解决", "所有的方法都试过了", "你是谁",
+]
+
+_PUNCTUATION = " \t\n，。！？、,.!?;；:：\"'“”‘’"
+
+
+def _bigrams(text: str) -> set[str]:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FastIntentClassifier:
+    """Keyword automaton + character-bigram cues, trained from the intent vocabulary.
+
+    A memory command phrase in command position scores by how much of the
+    command it covers (a bare "忘记…" beats "麻烦你忘记…"). Otherwise the
+    message is chat, scored down for every bigram cue and memory term it
+    contains, so commands worded without a trigger phrase are escalated to
+    the LLM; the threshold trades hit rate against that recall.
+    """
+
+    # Command phrases may be preceded by a politeness prefix
+    COMMAND_PREFIXES = {"", "请", "你", "帮我", "请你", "麻烦", "麻烦你", "请帮我"}
+    # View/clear commands may be followed by a short tail like "吧" / "呢？"
+    MAX_COMMAND_TAIL = 4
+    # Confidence of a command phrase covering all / none of the command text
+    COMMAND_CONFIDENCE = (0.85, 0.98)
+    # Confidence of a message without any memory evidence, and what each piece of evidence costs
+    CHAT_CONFIDENCE = 0.97
+    CUE_PENALTY = 0.3
+    TERM_PENALTY = 0.15
+
+    def __init__(self, threshold: float = 0.9):
+        self.threshold = threshold
+        self.stats = {"total": 0, "fast_path": 0, "escalated": 0}
+        self._phrases: dict[str, str] = {}
+        self._pattern: Optional[re.Pattern] = None
+        self._cues: set[str] = set()
+        self.fit()
+
+    def fit(self):
+        """Compile the phrase automaton and cue set from the vocabulary and examples."""
+        phrases = {}
+        for intent, keywords in (
+            ("delete_memory", DELETE_KEYWORDS),
+            ("view_memories", VIEW_KEYWORDS),
+            ("clear_memories", CLEAR_KEYWORDS),
+        ):
+            for keyword in keywords:
+                phrases[keyword] = intent
+
+        # A few-shot example minus its extracted query is a trigger phrase
+        for text, intent, query in FEW_SHOT_EXAMPLES:
+            if intent == "chat":
+                continue
+            trigger = text.replace(query, "").strip(_PUNCTUATION) if query else text
+            if trigger:
+                phrases.setdefault(trigger, intent)
+
+        # Longest phrase first so e.g. "全部忘记" wins over "忘记"
+        ordered = sorted(phrases, key=len, reverse=True)
+        self._phrases = phrases
+        self._pattern = re.compile("|".join(re.escape(p) for p in ordered))
+
+        chat_bigrams = set()
+        for text in CHAT_EXAMPLES + [t for t, intent, _ in FEW_SHOT_EXAMPLES if intent == "chat"]:
+            chat_bigrams |= _bigrams(text.lower())
+        cues = set()
+        for phrase in phrases:
+            cues |= _bigrams(phrase)
+        self._cues = cues - chat_bigrams
+
+    def classify(self, user_message: str) -> dict:
+        """Classify a message locally; the result carries a confidence score."""
+        text = user_message.strip().lower()
+        match = self._pattern.search(text)
+
+        if match:
+            phrase = match.group(0)
+            intent = self._phrases[phrase]
+            prefix = text[:match.start()].strip(_PUNCTUATION)
+            tail = text[match.end():].strip(_PUNCTUATION)
+            if intent == "delete_memory":
+                # A delete command needs something to delete
+                is_command = prefix in self.COMMAND_PREFIXES and bool(tail)
+            else:
+                is_command = prefix in self.COMMAND_PREFIXES and len(tail) <= self.MAX_COMMAND_TAIL
+            if is_command:
+                query = user_message.strip()[match.end():].strip(_PUNCTUATION) if intent == "delete_memory" else ""
+                # The delete query isn't part of the command; a view/clear tail is
+                command = len(prefix) + len(phrase) + (0 if intent == "delete_memory" else len(tail))
+                low, high = self.COMMAND_CONFIDENCE
+                confidence = low + (high - low) * len(phrase) / command
+                return self._result(intent, round(confidence, 3), query, f"本地快速分类：命中「{phrase}」")
+            return self._result(intent, 0.5, "", f"本地快速分类：「{phrase}」不在命令位置")
+
+        cues = _bigrams(text) & self._cues
+        terms = [term for term in MEMORY_TERMS if term in text]
+        confidence = self.CHAT_CONFIDENCE - self.CUE_PENALTY * len(cues) - self.TERM_PENALTY * len(terms)
+        if cues or terms:
+            return self._result("chat", round(max(confidence, 0.5), 3), "",
+                                f"本地快速分类：包含记忆相关词「{'、'.join(sorted(cues) + terms)}」")
+        return self._result("chat", confidence, "", "本地快速分类：无记忆相关词")
+
+    def try_classify(self, user_message: str) -> Optional[dict]:
+        """Return a local classification if it clears the threshold, else None."""
+        self.stats["total"] += 1
+        result = self.classify(user_message)
+
+        if result["confidence"] >= self.threshold:
+            self.stats["fast_path"] += 1
+            return result
+
+        self.stats["escalated"] += 1
+        return None
+
+    def get_stats(self) -> dict:
+        total = self.stats["total"]
+        return {
+            **self.stats,
+            "threshold": self.threshold,
+            "hit_rate": self.stats["fast_path"] / total if total else 0.0,
+        }
+
+    @staticmethod
+    def _result(intent: str, confidence: float, query: str, reason: str) -> dict:
+        return {
+            "intent": intent,
+            "confidence": confidence,
+            "extracted_info": {
+                "query": query,
+                "reason": reason
+            }
+        }
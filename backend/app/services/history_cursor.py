@@ -0,0 +1,43 @@
+"""
+Opaque cursors for paging through a thread's conversation turns
+A cursor is a turn's (timestamp, _id) sort key, base64-encoded
+"""
+import base64
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def turn_key(doc: dict) -> tuple[datetime, ObjectId]:
+    return doc["timestamp"], doc["_id"]
+
+
+def encode_cursor(key: tuple[datetime, ObjectId]) -> str:
+    timestamp, object_id = key
+    millis = int(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    return base64.urlsafe_b64encode(f"{millis}.{object_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, ObjectId]:
+    """Raises ValueError for anything that isn't a cursor we issued."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        millis, object_id = raw.split(".", 1)
+        # Stored timestamps are naive UTC with millisecond precision (BSON datetime)
+        timestamp = datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc).replace(tzinfo=None)
+        return timestamp, ObjectId(object_id)
+    except (ValueError, UnicodeDecodeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def after(key: tuple[datetime, ObjectId]) -> dict:
+    """Mongo filter for turns sorting after ``key``."""
+    timestamp, object_id = key
+    return {"$or": [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "_id": {"$gt": object_id}}]}
+
+
+def before(key: tuple[datetime, ObjectId]) -> dict:
+    """Mongo filter for turns sorting before ``key``."""
+    timestamp, object_id = key
+    return {"$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": object_id}}]}
@@ -0,0 +1,83 @@
+"""
+TTL/LRU cache for intent classification results
+Keyed on normalized message text, scoped to the prompt + model that produced it
+"""
+import copy
+import hashlib
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_message(text: str) -> str:
+    """Fold width, case, whitespace and punctuation so trivial variants share a key."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(
+        ch for ch in text
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+
+class IntentCache:
+    """Bounded LRU cache with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._fingerprint: Optional[str] = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def bind(self, system_prompt: str, model_name: str):
+        """Scope the cache to a prompt/model pair, clearing it if either changed."""
+        fingerprint = hashlib.sha256(f"{model_name}\0{system_prompt}".encode("utf-8")).hexdigest()
+        if fingerprint != self._fingerprint:
+            if self._fingerprint is not None:
+                self.invalidate()
+            self._fingerprint = fingerprint
+
+    def get(self, message: str) -> Optional[dict]:
+        key = normalize_message(message)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return copy.deepcopy(value)
+
+    def put(self, message: str, value: dict):
+        key = normalize_message(message)
+        if not key:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self):
+        self._entries.clear()
+        self.stats["invalidations"] += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
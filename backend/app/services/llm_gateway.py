@@ -0,0 +1,388 @@
+"""
+Shared LLM gateway
+Every model call goes through one admission controller: global and per-model
+concurrency limits, a priority queue with bounded wait, and 429-aware retries
+"""
+import asyncio
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Optional
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.messages.ai import add_usage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from app.core.config import settings
+from app.core.metrics import LLM_CALL_SECONDS, LLM_CALL_TOKENS
+
+
+# Lower value = admitted first
+PRIORITY_MEMORY = 0  # Intent recognition and memory commands (short, user is waiting on them)
+PRIORITY_INTERACTIVE = 1  # Normal chat turns
+PRIORITY_BULK = 2  # Batch / offline replays
+
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+# Status codes worth retrying after a pause: rate limited, provider overloaded
+RETRYABLE_STATUS = (429, 529)
+
+
+@contextmanager
+def use_priority(priority: int):
+    """Run the LLM calls made inside this block at ``priority``."""
+    token = llm_priority.set(priority)
+    try:
+        yield
+    finally:
+        llm_priority.reset(token)
+
+
+class LLMOverloadedError(Exception):
+    """The call waited too long for a slot, or stayed rate limited after all retries."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def _rejects_cache_control(error: Exception) -> bool:
+    """The endpoint refused the request because of cache_control markers."""
+    return getattr(error, "status_code", None) == 400 and "cache_control" in str(error).lower()
+
+
+def cached_system_message(text: str) -> SystemMessage:
+    """System message marked for provider-side prompt caching (plain when caching is off).
+
+    Only use this for static text: the cached prefix is everything up to and
+    including the marked block, so any per-request content must come after it.
+    """
+    if settings.prompt_cache_mode == "off":
+        return SystemMessage(content=text)
+    return SystemMessage(content=[{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}])
+
+
+def strip_cache_control(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """Copies of ``messages`` without cache_control markers, for endpoints that reject them."""
+    stripped = []
+    for message in messages:
+        if isinstance(message.content, list) and any(isinstance(block, dict) and "cache_control" in block for block in message.content):
+            blocks = [
+                {k: v for k, v in block.items() if k != "cache_control"} if isinstance(block, dict) else block
+                for block in message.content
+            ]
+            # A lone text block goes back to a plain string, exactly as before caching
+            if len(blocks) == 1 and isinstance(blocks[0], dict) and blocks[0].get("type") == "text":
+                content = blocks[0]["text"]
+            else:
+                content = blocks
+            message = message.model_copy(update={"content": content})
+        stripped.append(message)
+    return stripped
+
+
+def usage_tokens(message) -> dict:
+    """Input, output and prompt-cache read/write token counts of one model response."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    # Older langchain-anthropic only exposes the cache counters in the raw usage
+    raw = (getattr(message, "response_metadata", None) or {}).get("usage") or {}
+    return {
+        "input": usage.get("input_tokens"),
+        "output": usage.get("output_tokens"),
+        "cache_read": details.get("cache_read", raw.get("cache_read_input_tokens")),
+        "cache_write": details.get("cache_creation", raw.get("cache_creation_input_tokens")),
+    }
+
+
+class AdmissionController:
+    """Grants call slots in priority order under global and per-model limits.
+
+    A rate-limited model is put on cooldown, so queued calls for it wait
+    instead of adding to the flood of 429s.
+    """
+
+    def __init__(self, max_concurrency: int, per_model_concurrency: int, max_wait: float):
+        self.max_concurrency = max_concurrency
+        self.per_model_concurrency = per_model_concurrency
+        self.max_wait = max_wait
+        self._active = 0
+        self._active_by_model: dict[str, int] = {}
+        self._cooldown_until: dict[str, float] = {}
+        # Entries are [priority, seq, model, future]; a sorted list is also a valid heap
+        self._waiters: list[list] = []
+        self._seq = itertools.count()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "rate_limited": 0, "retries": 0}
+        self._wait_total = 0.0
+
+    def _can_admit(self, model: str) -> bool:
+        return (
+            self._active < self.max_concurrency
+            and self._active_by_model.get(model, 0) < self.per_model_concurrency
+            and self._cooldown_until.get(model, 0) <= time.monotonic()
+        )
+
+    def _admit(self, model: str):
+        self._active += 1
+        self._active_by_model[model] = self._active_by_model.get(model, 0) + 1
+        self.stats["admitted"] += 1
+
+    async def acquire(self, model: str, priority: int):
+        if not self._waiters and self._can_admit(model):
+            self._admit(model)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append([priority, next(self._seq), model, future])
+        self._waiters.sort()
+        self.stats["queued"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Admitted just as we gave up: hand the slot back
+                self.release(model)
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.stats["rejected"] += 1
+            raise LLMOverloadedError(f"LLM queue wait exceeded {self.max_wait}s", retry_after=self.max_wait)
+        finally:
+            self._wait_total += time.monotonic() - start
+
+    def release(self, model: str):
+        self._active -= 1
+        self._active_by_model[model] -= 1
+        self._dispatch()
+
+    def cool_down(self, model: str, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._cooldown_until.get(model, 0):
+            self._cooldown_until[model] = until
+            asyncio.get_running_loop().call_later(seconds, self._dispatch)
+        self.stats["rate_limited"] += 1
+
+    def _dispatch(self):
+        remaining = []
+        for entry in self._waiters:
+            future = entry[3]
+            if future.done():
+                continue
+            if self._can_admit(entry[2]):
+                self._admit(entry[2])
+                future.set_result(None)
+            else:
+                remaining.append(entry)
+        self._waiters = remaining
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "active": self._active,
+            "active_by_model": dict(self._active_by_model),
+            "waiting": sum(1 for entry in self._waiters if not entry[3].done()),
+            "queue_wait_avg_ms": self._wait_total / self.stats["queued"] * 1000 if self.stats["queued"] else 0.0,
+        }
+
+
+class GatedChatModel(BaseChatModel):
+    """Wraps a chat model so every call is admitted and retried by the gateway."""
+
+    inner: BaseChatModel
+    gateway: Any = Field(exclude=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gated-{self.inner._llm_type}"
+
+    @property
+    def model_key(self) -> str:
+        return getattr(self.inner, "model", None) or self.inner._llm_type
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the wrapped model format the tools, then pass them through as call kwargs
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Sync calls are not used by the app; they bypass admission control
+        return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _prepare(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        return messages if self.gateway.prompt_cache_supported else strip_cache_control(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        for attempt in self.gateway.attempts():
+            async with self.gateway.slot(self.model_key):
+                try:
+                    with LLM_CALL_SECONDS.time(model=self.model_key):
+                        result = await self._call_inner(messages, stop, run_manager, **kwargs)
+                    message = result.generations[0].message if result.generations else None
+                    self.gateway.record_usage(self.model_key, usage_tokens(message))
+                    return result
+                except Exception as e:
+                    delay = self.gateway.on_error(self.model_key, e, attempt)
+            await asyncio.sleep(delay)
+
+    async def _call_inner(self, messages, stop, run_manager, **kwargs) -> ChatResult:
+        try:
+            return await self.inner._agenerate(self._prepare(messages), stop=stop, run_manager=run_manager, **kwargs)
+        except Exception as e:
+            if not self.gateway.disable_prompt_cache_on(e):
+                raise
+            return await self.inner._agenerate(self._prepare(messages), stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        for attempt in self.gateway.attempts():
+            started = False
+            async with self.gateway.slot(self.model_key):
+                try:
+                    start = time.perf_counter()
+                    usage = None
+                    async for chunk in self.inner._astream(self._prepare(messages), stop=stop, run_manager=run_manager, **kwargs):
+                        started = True
+                        # Streamed usage arrives split across chunks (input at start, output at end)
+                        chunk_usage = getattr(chunk.message, "usage_metadata", None)
+                        if chunk_usage:
+                            usage = add_usage(usage, chunk_usage)
+                        yield chunk
+                    LLM_CALL_SECONDS.observe(time.perf_counter() - start, model=self.model_key)
+                    self.gateway.record_usage(self.model_key, usage_tokens(AIMessage(content="", usage_metadata=usage)))
+                    return
+                except Exception as e:
+                    # Once tokens have been sent the call can't be replayed
+                    if started:
+                        raise
+                    if self.gateway.disable_prompt_cache_on(e):
+                        continue
+                    delay = self.gateway.on_error(self.model_key, e, attempt)
+            await asyncio.sleep(delay)
+
+
+class _Slot:
+    def __init__(self, admission: AdmissionController, model: str):
+        self.admission = admission
+        self.model = model
+
+    async def __aenter__(self):
+        await self.admission.acquire(self.model, llm_priority.get())
+
+    async def __aexit__(self, *exc):
+        self.admission.release(self.model)
+
+
+class LLMGateway:
+    """Builds the app's chat models and routes all their calls through one admission controller."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        per_model_concurrency: int = 16,
+        max_wait: float = 30,
+        max_retries: int = 3,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 20.0
+    ):
+        self.admission = AdmissionController(max_concurrency, per_model_concurrency, max_wait)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        # "auto" starts optimistic and turns caching off the first time the endpoint rejects it
+        self.prompt_cache_supported = settings.prompt_cache_mode != "off"
+        self.tokens = {"input": 0, "output": 0, "cache_read": 0, "cache_write": 0}
+
+    def chat_model(self, **overrides) -> GatedChatModel:
+        """A gated ChatAnthropic configured from settings.
+
+        All models share client parameters, so langchain-anthropic hands them the
+        same pooled HTTP client. SDK retries are off; the gateway owns retrying.
+        """
+        anthropic_kwargs = {
+            "api_key": settings.anthropic_api_key,
+            "model": settings.model_name,
+            "max_retries": 0,
+            "default_request_timeout": settings.llm_request_timeout,
+            **overrides
+        }
+        if settings.anthropic_base_url:
+            anthropic_kwargs["base_url"] = settings.anthropic_base_url
+        return self.wrap(ChatAnthropic(**anthropic_kwargs))
+
+    def wrap(self, model: BaseChatModel) -> GatedChatModel:
+        return GatedChatModel(inner=model, gateway=self)
+
+    def slot(self, model: str) -> _Slot:
+        return _Slot(self.admission, model)
+
+    def attempts(self):
+        return range(self.max_retries + 1)
+
+    def on_error(self, model: str, error: Exception, attempt: int) -> float:
+        """Decide whether a failed call is retried; returns the delay or raises."""
+        if not _is_retryable(error):
+            raise error
+        retry_after = _retry_after(error)
+        backoff = min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt)
+        # Equal jitter: spread retries out so they don't arrive in lockstep
+        delay = retry_after if retry_after is not None else backoff / 2 + random.uniform(0, backoff / 2)
+        self.admission.cool_down(model, delay)
+        if attempt >= self.max_retries:
+            raise LLMOverloadedError(f"LLM still rate limited after {self.max_retries} retries", retry_after=delay) from error
+        self.admission.stats["retries"] += 1
+        return delay
+
+    def disable_prompt_cache_on(self, error: Exception) -> bool:
+        """Fall back to uncached prompts if ``error`` is a cache_control rejection (auto mode)."""
+        if settings.prompt_cache_mode != "auto" or not self.prompt_cache_supported or not _rejects_cache_control(error):
+            return False
+        print(f"Prompt caching not supported by the LLM endpoint, disabling it: {error}")
+        self.prompt_cache_supported = False
+        return True
+
+    def record_usage(self, model: str, tokens: dict):
+        for direction, count in tokens.items():
+            if count is not None:
+                self.tokens[direction] += count
+                LLM_CALL_TOKENS.observe(count, model=model, direction=direction)
+
+    def get_stats(self) -> dict:
+        cached = self.tokens["cache_read"]
+        return {
+            **self.admission.get_stats(),
+            "prompt_cache": {
+                "enabled": self.prompt_cache_supported,
+                **self.tokens,
+                # Share of input tokens served from the provider's prompt cache
+                "cache_read_ratio": cached / self.tokens["input"] if self.tokens["input"] else 0.0,
+            },
+        }
+
+
+# Global gateway shared by every service
+llm_gateway = LLMGateway(
+    max_concurrency=settings.llm_max_concurrency,
+    per_model_concurrency=settings.llm_per_model_concurrency,
+    max_wait=settings.llm_queue_max_wait,
+    max_retries=settings.llm_max_retries,
+    retry_base_delay=settings.llm_retry_base_delay
+)
@@ -0,0 +1,374 @@
+"""
+MongoDB-backed LangGraph checkpointer
+Lets every API worker share short-term (thread) memory through the agent_memory database
+"""
+import asyncio
+import hashlib
+import random
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Fractional part of the string form of versions stored as plain integers by earlier releases
+LEGACY_VERSION_SUFFIX = "." + f"{0.0:016}"
+
+
+def normalize_version(version):
+    """String form of a channel version (LangGraph compares versions, so they must not mix types)."""
+    return f"{version:032}{LEGACY_VERSION_SUFFIX}" if isinstance(version, int) else version
+
+
+class MongoCheckpointSaver(BaseCheckpointSaver):
+    """Async checkpoint saver storing LangGraph state in four collections.
+
+    - ``checkpoints``: one small document per checkpoint (no channel values)
+    - ``checkpoint_blobs``: one document per (channel, version), written only
+      for channels that changed in a step
+    - ``checkpoint_messages``: message-list channels are stored as an ordered
+      list of content hashes; each message is written once per thread, so a
+      step only sends the messages that are new instead of the whole history
+    - ``checkpoint_writes``: pending writes of in-flight tasks
+
+    Channel versions carry a random fractional part (as in ``MemorySaver``), so
+    two workers or a retried step writing the same thread never produce the
+    same (channel, version) with different contents.
+
+    Only the async API is implemented; use ``graph.aget_state`` / ``ainvoke``.
+    """
+
+    MESSAGE_CHANNELS = ("messages",)
+
+    def __init__(self, db_provider, serde=None, known_threads: int = 1000):
+        """
+        Args:
+            db_provider: async callable returning the Motor database to use
+            known_threads: how many threads' stored message hashes to remember
+        """
+        super().__init__(serde=serde)
+        self._db_provider = db_provider
+        self._db = None
+        self._init_lock = asyncio.Lock()
+        # thread key -> hashes of messages already stored (per-worker, best effort)
+        self._known_messages: OrderedDict[tuple[str, str], set[str]] = OrderedDict()
+        self._known_threads = known_threads
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    async def setup(self):
+        """Create indexes eagerly (otherwise done on first use)."""
+        await self._collections()
+
+    async def _collections(self):
+        if self._db is None:
+            async with self._init_lock:
+                if self._db is None:
+                    db = await self._db_provider()
+                    await self._create_indexes(db)
+                    self._db = db
+        db = self._db
+        return db["checkpoints"], db["checkpoint_blobs"], db["checkpoint_messages"], db["checkpoint_writes"]
+
+    @staticmethod
+    async def _create_indexes(db):
+        await db["checkpoints"].create_index(
+            [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING), ("checkpoint_id", DESCENDING)],
+            unique=True
+        )
+        await db["checkpoint_blobs"].create_index(
+            [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING), ("channel", ASCENDING), ("version", ASCENDING)],
+            unique=True
+        )
+        await db["checkpoint_messages"].create_index(
+            [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING), ("digest", ASCENDING)],
+            unique=True
+        )
+        await db["checkpoint_writes"].create_index(
+            [("thread_id", ASCENDING), ("checkpoint_ns", ASCENDING), ("checkpoint_id", ASCENDING),
+             ("task_id", ASCENDING), ("idx", ASCENDING)],
+            unique=True
+        )
+
+    # ============ Read ============
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        checkpoints, _, _, _ = await self._collections()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        if checkpoint_id := get_checkpoint_id(config):
+            query["checkpoint_id"] = checkpoint_id
+        doc = await checkpoints.find_one(query, sort=[("checkpoint_id", DESCENDING)])
+
+        if doc is None:
+            return None
+        return await self._load_tuple(doc)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoints, _, _, _ = await self._collections()
+
+        query = {}
+        if config:
+            query["thread_id"] = config["configurable"]["thread_id"]
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                query["checkpoint_ns"] = checkpoint_ns
+            if checkpoint_id := get_checkpoint_id(config):
+                query["checkpoint_id"] = checkpoint_id
+        if before and (before_id := get_checkpoint_id(before)):
+            query["checkpoint_id"] = {"$lt": before_id}
+
+        cursor = checkpoints.find(query).sort("checkpoint_id", DESCENDING)
+        remaining = limit
+        async for doc in cursor:
+            metadata = self.serde.loads_typed((doc["metadata_type"], doc["metadata"]))
+            if filter and not all(metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                remaining -= 1
+            yield await self._load_tuple(doc, metadata)
+
+    async def _load_tuple(self, doc: dict, metadata: Optional[dict] = None) -> CheckpointTuple:
+        thread_id = doc["thread_id"]
+        checkpoint_ns = doc["checkpoint_ns"]
+        checkpoint_id = doc["checkpoint_id"]
+
+        checkpoint = self.serde.loads_typed((doc["type"], doc["checkpoint"]))
+        checkpoint["channel_versions"] = {k: normalize_version(v) for k, v in checkpoint["channel_versions"].items()}
+        checkpoint["versions_seen"] = {
+            node: {k: normalize_version(v) for k, v in seen.items()}
+            for node, seen in checkpoint["versions_seen"].items()
+        }
+        channel_values = await self._load_channel_values(thread_id, checkpoint_ns, checkpoint["channel_versions"])
+        if metadata is None:
+            metadata = self.serde.loads_typed((doc["metadata_type"], doc["metadata"]))
+
+        _, _, _, writes = await self._collections()
+        pending_writes = [
+            (w["task_id"], w["channel"], self.serde.loads_typed((w["type"], w["blob"])))
+            async for w in writes.find(
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+            ).sort([("task_id", ASCENDING), ("idx", ASCENDING)])
+        ]
+
+        parent_id = doc.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config=self._config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=metadata,
+            parent_config=self._config(thread_id, checkpoint_ns, parent_id) if parent_id else None,
+            pending_writes=pending_writes,
+        )
+
+    async def _load_channel_values(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict:
+        if not versions:
+            return {}
+        _, blobs, messages, _ = await self._collections()
+
+        def stored_version(v):
+            # Blobs written by earlier releases are keyed by the plain integer
+            if isinstance(v, str) and v.endswith(LEGACY_VERSION_SUFFIX):
+                return {"$in": [v, int(v.split(".")[0])]}
+            return v
+
+        docs = await blobs.find({
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "$or": [{"channel": k, "version": stored_version(v)} for k, v in versions.items()],
+        }).to_list(length=None)
+
+        digests = {d for doc in docs if doc["type"] == "message_digests" for d in doc["digests"]}
+        stored = {}
+        if digests:
+            async for m in messages.find(
+                {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "digest": {"$in": list(digests)}}
+            ):
+                stored[m["digest"]] = self.serde.loads_typed((m["type"], m["blob"]))
+            self._remember(thread_id, checkpoint_ns, stored.keys())
+
+        values = {}
+        for doc in docs:
+            if doc["type"] == "empty":
+                continue
+            if doc["type"] == "message_digests":
+                values[doc["channel"]] = [stored[d] for d in doc["digests"] if d in stored]
+            else:
+                values[doc["channel"]] = self.serde.loads_typed((doc["type"], doc["blob"]))
+        return values
+
+    # ============ Write ============
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        checkpoints, blobs, _, _ = await self._collections()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+
+        # Only channels that changed in this step get a new blob
+        blob_ops = []
+        for channel, version in new_versions.items():
+            doc = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "channel": channel, "version": version}
+            if channel not in values:
+                doc["type"] = "empty"
+            elif channel in self.MESSAGE_CHANNELS and isinstance(values[channel], list):
+                doc["type"] = "message_digests"
+                doc["digests"] = await self._store_messages(thread_id, checkpoint_ns, values[channel])
+            else:
+                doc["type"], doc["blob"] = self.serde.dumps_typed(values[channel])
+            blob_ops.append(UpdateOne(
+                {k: doc[k] for k in ("thread_id", "checkpoint_ns", "channel", "version")},
+                {"$setOnInsert": doc},
+                upsert=True
+            ))
+        if blob_ops:
+            await blobs.bulk_write(blob_ops, ordered=False)
+
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+        await checkpoints.update_one(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]},
+            {"$set": {
+                "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+                "type": checkpoint_type,
+                "checkpoint": checkpoint_blob,
+                "metadata_type": metadata_type,
+                "metadata": metadata_blob,
+            }},
+            upsert=True
+        )
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        _, _, _, writes_coll = await self._collections()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        operations = []
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            key = {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+                "task_id": task_id,
+                "idx": write_idx,
+            }
+            value_type, blob = self.serde.dumps_typed(value)
+            doc = {**key, "channel": channel, "type": value_type, "blob": blob, "task_path": task_path}
+            # Regular writes are never overwritten; special (error/interrupt) writes are
+            update = {"$set": doc} if write_idx < 0 else {"$setOnInsert": doc}
+            operations.append(UpdateOne(key, update, upsert=True))
+
+        if operations:
+            await writes_coll.bulk_write(operations, ordered=False)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        for collection in await self._collections():
+            await collection.delete_many({"thread_id": thread_id})
+        for key in [k for k in self._known_messages if k[0] == thread_id]:
+            del self._known_messages[key]
+
+    async def _store_messages(self, thread_id: str, checkpoint_ns: str, messages: list) -> list[str]:
+        """Write messages not yet stored for this thread; return the ordered digests."""
+        _, _, messages_coll, _ = await self._collections()
+
+        serialized = []
+        for message in messages:
+            value_type, blob = self.serde.dumps_typed(message)
+            digest = hashlib.sha1(value_type.encode("utf-8") + b"\0" + blob).hexdigest()
+            serialized.append((digest, value_type, blob))
+        digests = [d for d, _, _ in serialized]
+
+        key = (thread_id, checkpoint_ns)
+        known = self._known_messages.get(key)
+        if known is None:
+            # First time this worker sees the thread: ask Mongo what is already stored
+            known = {
+                doc["digest"] async for doc in messages_coll.find(
+                    {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "digest": {"$in": digests}},
+                    {"digest": 1}
+                )
+            }
+
+        new_docs, seen = [], set(known)
+        for digest, value_type, blob in serialized:
+            if digest not in seen:
+                seen.add(digest)
+                new_docs.append({
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "digest": digest,
+                    "type": value_type,
+                    "blob": blob,
+                })
+        if new_docs:
+            try:
+                await messages_coll.insert_many(new_docs, ordered=False)
+            except BulkWriteError as e:
+                # Another worker stored the same message first
+                if any(err.get("code") != DUPLICATE_KEY_ERROR for err in e.details.get("writeErrors", [])):
+                    raise
+
+        self._remember(thread_id, checkpoint_ns, seen)
+        return digests
+
+    def _remember(self, thread_id: str, checkpoint_ns: str, digests):
+        key = (thread_id, checkpoint_ns)
+        known = self._known_messages.setdefault(key, set())
+        known.update(digests)
+        self._known_messages.move_to_end(key)
+        while len(self._known_messages) > self._known_threads:
+            self._known_messages.popitem(last=False)
+
+    @staticmethod
+    def _config(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }
+        }
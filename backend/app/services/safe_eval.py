@@ -0,0 +1,155 @@
+"""
+Safe arithmetic evaluator for the calculate tool
+Whitelisted AST nodes only, with operand size limits so no input can run unbounded
+"""
+import ast
+import math
+import operator
+from functools import lru_cache
+
+
+MAX_EXPRESSION_LENGTH = 500
+MAX_INT_BITS = 4096  # About 1233 decimal digits
+MAX_EXPONENT = 10000
+MAX_FACTORIAL = 1000
+MAX_ROUND_DIGITS = 100
+
+
+class EvaluationError(ValueError):
+    """The expression is malformed, unsupported or exceeds the operand limits."""
+
+
+def _check_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise EvaluationError(f"不支持的值: {value!r}")
+    if isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise EvaluationError("数值过大")
+    return value
+
+
+def _pow(base, exponent):
+    if isinstance(exponent, int) and isinstance(base, int):
+        if abs(exponent) > MAX_EXPONENT or base.bit_length() * abs(exponent) > MAX_INT_BITS:
+            raise EvaluationError("指数过大")
+    return base ** exponent
+
+
+def _mul(left, right):
+    if isinstance(left, int) and isinstance(right, int) and left.bit_length() + right.bit_length() > MAX_INT_BITS:
+        raise EvaluationError("数值过大")
+    return left * right
+
+
+def _round(value, ndigits=None):
+    # round(1, -10**7) builds 10**10**7 while holding the GIL
+    if ndigits is not None and (not isinstance(ndigits, int) or abs(ndigits) > MAX_ROUND_DIGITS):
+        raise EvaluationError(f"round 的位数只支持绝对值不超过 {MAX_ROUND_DIGITS} 的整数")
+    return round(value, ndigits)
+
+
+def _factorial(value):
+    if not isinstance(value, int) or value > MAX_FACTORIAL:
+        raise EvaluationError(f"阶乘只支持不超过 {MAX_FACTORIAL} 的整数")
+    return math.factorial(value)
+
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _pow,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+FUNCTIONS = {
+    "abs": abs,
+    "round": _round,
+    "min": min,
+    "max": max,
+    "sqrt": math.sqrt,
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "factorial": _factorial,
+}
+
+CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+
+def _validate(node: ast.AST):
+    """Reject anything outside the arithmetic subset before it is ever evaluated."""
+    if isinstance(node, ast.Expression):
+        _validate(node.body)
+    elif isinstance(node, ast.Constant):
+        _check_number(node.value)
+    elif isinstance(node, ast.BinOp):
+        if type(node.op) not in _BINARY_OPERATORS:
+            raise EvaluationError(f"不支持的运算: {type(node.op).__name__}")
+        _validate(node.left)
+        _validate(node.right)
+    elif isinstance(node, ast.UnaryOp):
+        if type(node.op) not in _UNARY_OPERATORS:
+            raise EvaluationError(f"不支持的运算: {type(node.op).__name__}")
+        _validate(node.operand)
+    elif isinstance(node, ast.Name):
+        if node.id not in CONSTANTS:
+            raise EvaluationError(f"未知的名称: {node.id}")
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise EvaluationError(f"不支持的函数调用: {ast.unparse(node.func)}")
+        for arg in node.args:
+            _validate(arg)
+    else:
+        raise EvaluationError(f"不支持的表达式: {type(node).__name__}")
+
+
+@lru_cache(maxsize=1024)
+def parse_expression(expression: str) -> ast.Expression:
+    """Parse and validate an expression (cached, so repeated expressions skip both)."""
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise EvaluationError(f"表达式过长（最多 {MAX_EXPRESSION_LENGTH} 个字符）")
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise EvaluationError(f"表达式语法错误: {e.msg}") from None
+    _validate(tree)
+    return tree
+
+
+def _evaluate(node: ast.AST):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.BinOp):
+        return _check_number(_BINARY_OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right)))
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY_OPERATORS[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.Name):
+        return CONSTANTS[node.id]
+    # ast.Call (the only other node _validate lets through)
+    return _check_number(FUNCTIONS[node.func.id](*[_evaluate(arg) for arg in node.args]))
+
+
+def evaluate(expression: str):
+    """Evaluate an arithmetic expression; raises EvaluationError for anything else."""
+    try:
+        return _evaluate(parse_expression(expression).body)
+    except EvaluationError:
+        raise
+    except (ArithmeticError, ValueError, TypeError) as e:
+        raise EvaluationError(str(e)) from None
@@ -0,0 +1,98 @@
+"""
+Per-thread turn serialization
+Turns of one conversation run one at a time so checkpoint writes never interleave
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+
+@dataclass
+class _LockEntry:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0  # Holders plus waiters; the entry is evicted when this drops to 0
+
+
+class ThreadLockTable:
+    """One asyncio.Lock per active thread, dropped as soon as nobody holds or waits on it."""
+
+    def __init__(self):
+        self._entries: dict[str, _LockEntry] = {}
+        self.stats = {"acquired": 0, "contended": 0}
+
+    @asynccontextmanager
+    async def hold(self, thread_id: str):
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            entry = self._entries[thread_id] = _LockEntry()
+        entry.users += 1
+        if entry.lock.locked():
+            self.stats["contended"] += 1
+        try:
+            async with entry.lock:
+                self.stats["acquired"] += 1
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._entries[thread_id]
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "threads": len(self._entries)}
+
+
+@dataclass
+class _PendingTurn:
+    future: asyncio.Future
+    messages: list[str] = field(default_factory=list)
+
+
+class TurnCoalescer:
+    """Merges messages that arrive while a thread is busy into a single next turn.
+
+    Every caller whose message was merged gets the reply of that combined turn.
+    The turn runs in its own task, so a disconnecting caller doesn't cancel it
+    for the others.
+    """
+
+    def __init__(self, locks: ThreadLockTable, separator: str = "\n"):
+        self.locks = locks
+        self.separator = separator
+        self._pending: dict[str, _PendingTurn] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = {"turns": 0, "coalesced": 0}
+
+    async def submit(self, thread_id: str, message: str, run: Callable[[str], Awaitable]):
+        pending = self._pending.get(thread_id)
+        if pending is None:
+            pending = self._pending[thread_id] = _PendingTurn(asyncio.get_running_loop().create_future())
+            task = asyncio.create_task(self._run(thread_id, pending, run))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.stats["coalesced"] += 1
+        pending.messages.append(message)
+        return await asyncio.shield(pending.future)
+
+    async def _run(self, thread_id: str, pending: _PendingTurn, run: Callable[[str], Awaitable]):
+        try:
+            async with self.locks.hold(thread_id):
+                # The batch is closed once the turn starts; later messages form the next one
+                if self._pending.get(thread_id) is pending:
+                    del self._pending[thread_id]
+                self.stats["turns"] += 1
+                result = await run(self.separator.join(pending.messages))
+        except asyncio.CancelledError:
+            pending.future.cancel()
+            raise
+        except Exception as e:
+            pending.future.set_exception(e)
+        else:
+            pending.future.set_result(result)
+        finally:
+            if self._pending.get(thread_id) is pending:
+                del self._pending[thread_id]
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._pending)}
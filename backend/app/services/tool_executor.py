@@ -0,0 +1,151 @@
+"""
+Off-event-loop tool execution
+Tool work runs in a thread or process pool with per-call time limits (and CPU limits
+in process mode), so one slow tool call cannot stall other requests
+"""
+import asyncio
+import math
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: no RLIMIT_CPU, time limits only
+    resource = None
+
+from app.core.config import settings
+from app.core.metrics import TOOL_CALL_SECONDS
+
+
+class ToolTimeoutError(TimeoutError):
+    """A tool call exceeded its time limit."""
+
+
+class ToolCPULimitError(RuntimeError):
+    """A tool call's worker process was killed (CPU limit exceeded or crashed)."""
+
+
+def _run_with_cpu_limit(cpu_seconds: Optional[float], func: Callable, *args):
+    """Process-pool entry point: cap this call's CPU time with RLIMIT_CPU.
+
+    The limit is cumulative per process, so it is set to the CPU already used
+    plus this call's budget; going over delivers SIGXCPU, which kills the worker.
+    """
+    if resource is not None and cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime + cpu_seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    return func(*args)
+
+
+class ToolExecutor:
+    """Runs tool functions off the event loop and reports per-call latency.
+
+    ``mode="thread"`` is cheap but can't stop a call that overruns: the caller
+    gets a ToolTimeoutError while the thread finishes in the background, so
+    CPU-heavy tools must bound their own work (see safe_eval). ``mode="process"``
+    enforces a CPU limit per call and kills the pool's workers on timeout;
+    functions and arguments must then be picklable (module-level functions).
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = 4, default_timeout: float = 10.0, default_cpu_seconds: float = 5.0):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown tool executor mode {mode!r}, expected 'thread' or 'process'")
+        self.mode = mode
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.default_cpu_seconds = default_cpu_seconds
+        self._pool: Optional[Executor] = None
+        self.stats = {"calls": 0, "active": 0, "errors": 0, "timeouts": 0, "cpu_limited": 0, "pool_restarts": 0}
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            if self.mode == "process":
+                # spawn: forking a process that runs an event loop and threads is unsafe
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="tool")
+        return self._pool
+
+    def _restart_pool(self, pool: Executor):
+        """Kill a process pool's workers (stopping runaway calls); the next call starts a fresh pool."""
+        if self._pool is not pool:
+            return
+        self._pool = None
+        self.stats["pool_restarts"] += 1
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, name: str, func: Callable, *args, timeout: Optional[float] = None, cpu_seconds: Optional[float] = None):
+        """Run ``func(*args)`` in the pool; raises ToolTimeoutError / ToolCPULimitError on limits."""
+        timeout = self.default_timeout if timeout is None else timeout
+        cpu_seconds = self.default_cpu_seconds if cpu_seconds is None else cpu_seconds
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        if self.mode == "process":
+            future = loop.run_in_executor(pool, _run_with_cpu_limit, cpu_seconds, func, *args)
+        else:
+            future = loop.run_in_executor(pool, func, *args)
+        try:
+            return await self._track(name, future, timeout)
+        except ToolTimeoutError:
+            if self.mode == "process":
+                self._restart_pool(pool)
+            raise
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            raise ToolCPULimitError(f"工具 {name} 的工作进程被终止（超出 {cpu_seconds:g} 秒 CPU 时间限制或异常退出）") from None
+
+    async def guard(self, name: str, coro: Awaitable, timeout: Optional[float] = None):
+        """Apply the time limit and latency reporting to an async (I/O-bound) tool on the event loop."""
+        return await self._track(name, coro, self.default_timeout if timeout is None else timeout)
+
+    async def _track(self, name: str, awaitable: Awaitable, timeout: float):
+        outcome = "ok"
+        start = time.perf_counter()
+        self.stats["calls"] += 1
+        self.stats["active"] += 1
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.stats["timeouts"] += 1
+            raise ToolTimeoutError(f"工具 {name} 超时（{timeout:g} 秒）") from None
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except BrokenProcessPool:
+            outcome = "cpu_limit"
+            self.stats["cpu_limited"] += 1
+            raise
+        except Exception:
+            outcome = "error"
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["active"] -= 1
+            TOOL_CALL_SECONDS.observe(time.perf_counter() - start, tool=name, outcome=outcome)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "mode": self.mode, "max_workers": self.max_workers}
+
+
+# Global tool executor (shut down in the app lifespan)
+tool_executor = ToolExecutor(
+    mode=settings.tool_executor_mode,
+    max_workers=settings.tool_max_workers,
+    default_timeout=settings.tool_timeout_seconds,
+    default_cpu_seconds=settings.tool_cpu_seconds
+)
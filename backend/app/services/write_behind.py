@@ -0,0 +1,99 @@
+"""
+Write-behind persistence queue
+Buffers conversation and fact writes and flushes them to MongoDB in batches
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class WriteBehindQueue:
+    """Bounded queue flushed with insert_many / bulk_write on size or time thresholds.
+
+    ``put_*`` waits when the queue is full, so producers are slowed down instead
+    of buffering without limit. ``stop`` drains everything that was queued.
+    """
+
+    def __init__(self, memory, max_size: int = 1000, batch_size: int = 100, flush_interval: float = 0.5):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "flushes": 0, "conversations_written": 0, "facts_written": 0, "backpressure_waits": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        if not self.running:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the worker."""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    async def put_conversation(self, doc: dict):
+        await self._put(("conversation", doc))
+
+    async def put_facts(self, docs: list[dict]):
+        for doc in docs:
+            await self._put(("fact", doc))
+
+    async def _put(self, item: tuple[str, dict]):
+        if self._queue.full():
+            self.stats["backpressure_waits"] += 1
+        await self._queue.put(item)
+        self.stats["enqueued"] += 1
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # Drain anything enqueued after the stop sentinel
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            await self._flush(remaining)
+
+    async def _flush(self, batch: list[tuple[str, dict]]):
+        conversations = [doc for kind, doc in batch if kind == "conversation"]
+        facts = [doc for kind, doc in batch if kind == "fact"]
+
+        try:
+            self.stats["facts_written"] += await self.memory.save_facts_bulk(facts)
+            self.stats["conversations_written"] += await self.memory.save_conversations_bulk(conversations)
+            self.stats["flushes"] += 1
+        except Exception as e:
+            print(f"Error flushing write-behind batch: {e}")
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "queued": self._queue.qsize(), "running": self.running}
@@ -0,0 +1,157 @@
+"""
+Deterministic stand-ins for the benchmark harness
+A fake chat model with configurable latency / token rate, and an in-memory memory service
+"""
+import asyncio
+import json
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.services.agent import MongoMemoryService
+from app.services.fact_index import estimate_tokens
+from app.services.fact_search import fact_matches
+
+
+class FakeChatModel(BaseChatModel):
+    """Replies with a fixed text after ``latency`` seconds, emitting ``tokens_per_second``.
+
+    Usage metadata is estimated from the prompt and reply, so token metrics
+    behave like a real provider's.
+    """
+
+    reply: str = "好的，我明白了。这是一个用于基准测试的固定回复，长度大约相当于一条普通的助手消息。"
+    latency: float = 0.05  # Time to first token
+    tokens_per_second: float = 0  # 0 = whole reply at once
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools, **kwargs):
+        # Never calls tools; binding is a no-op
+        return self
+
+    def _tokens(self) -> list[str]:
+        # One "token" per character keeps the rate easy to reason about
+        return list(self.reply)
+
+    def _usage(self, messages) -> dict:
+        input_tokens = sum(estimate_tokens(str(message.content)) for message in messages)
+        output_tokens = len(self._tokens())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("FakeChatModel is async-only")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        if self.tokens_per_second:
+            await asyncio.sleep(len(self._tokens()) / self.tokens_per_second)
+        message = AIMessage(content=self.reply, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        tokens = self._tokens()
+        for i, token in enumerate(tokens):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            # Usage rides on the last chunk, like providers that report it at the end
+            usage = self._usage(messages) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fake_intent_model(latency: float = 0.02) -> FakeChatModel:
+    """Intent classifier that always answers "chat" (memory commands hit the fast path)."""
+    reply = json.dumps({"intent": "chat", "confidence": 0.95, "extracted_info": {"query": "", "reason": "基准测试"}}, ensure_ascii=False)
+    return FakeChatModel(reply=reply, latency=latency)
+
+
+class InMemoryMemoryService(MongoMemoryService):
+    """MongoMemoryService with dict storage instead of MongoDB.
+
+    Only the storage methods are replaced; caching and the relevance index
+    still run, so the hot path matches production minus the network.
+    ``op_latency`` simulates a database round trip per operation.
+    """
+
+    def __init__(self, op_latency: float = 0.0):
+        super().__init__()
+        self.op_latency = op_latency
+        self.conversations: dict[str, list[dict]] = {}
+        self.facts: dict[str, dict[tuple[str, str], dict]] = {}
+
+    async def _round_trip(self):
+        await asyncio.sleep(self.op_latency)
+
+    async def ensure_indexes(self):
+        pass
+
+    async def save_conversation(self, thread_id: str, user_message: str, assistant_response: str):
+        await self.save_conversations_bulk([self.conversation_doc(thread_id, user_message, assistant_response)])
+
+    async def save_conversations_bulk(self, docs: list[dict]) -> int:
+        await self._round_trip()
+        for doc in docs:
+            self.conversations.setdefault(doc["thread_id"], []).append(doc)
+        return len(docs)
+
+    async def get_conversation_history(self, thread_id: str, limit: int = 20) -> list[dict]:
+        await self._round_trip()
+        return self.conversations.get(thread_id, [])[-limit:]
+
+    async def save_fact(self, thread_id: str, fact_type: str, content: str, importance: float = 0.5):
+        await self.save_facts_bulk([self.fact_doc(thread_id, fact_type, content, importance)])
+
+    async def save_facts_bulk(self, docs: list[dict]) -> int:
+        if not docs:
+            return 0
+        await self._round_trip()
+        for doc in docs:
+            self.facts.setdefault(doc["thread_id"], {})[(doc["fact_type"], doc["content"])] = doc
+            if self.fact_index:
+                self.fact_index.add(doc["thread_id"], doc["fact_type"], doc["content"], doc["importance"])
+        await self._invalidate_facts({doc["thread_id"] for doc in docs})
+        return len(docs)
+
+    async def _fetch_top_facts(self, thread_id: str, limit: int) -> list[str]:
+        await self._round_trip()
+        docs = sorted(self.facts.get(thread_id, {}).values(), key=lambda doc: -doc["importance"])
+        return [doc["content"] for doc in docs[:limit]]
+
+    async def delete_facts(self, thread_id: str, query: str, dry_run: bool = False) -> dict:
+        await self._round_trip()
+        facts = self.facts.get(thread_id, {})
+        matched = [key for key, doc in facts.items() if fact_matches(query, doc["content"])]
+        if not dry_run:
+            for key in matched:
+                del facts[key]
+            if matched:
+                if self.fact_index:
+                    self.fact_index.remove(thread_id, lambda content: fact_matches(query, content))
+                await self._invalidate_facts([thread_id])
+        return {
+            "query": query,
+            "dry_run": dry_run,
+            "examined": len(facts),
+            "deleted": 0 if dry_run else len(matched),
+            "matched": [{"fact_type": fact_type, "content": content} for fact_type, content in matched],
+        }
+
+    async def clear_all_facts(self, thread_id: str) -> int:
+        await self._round_trip()
+        count = len(self.facts.pop(thread_id, {}))
+        if self.fact_index:
+            self.fact_index.drop(thread_id)
+        await self._invalidate_facts([thread_id])
+        return count
+
+    async def _fetch_all_facts(self, thread_id: str) -> list[dict]:
+        await self._round_trip()
+        return sorted(self.facts.get(thread_id, {}).values(), key=lambda doc: -doc["importance"])
+
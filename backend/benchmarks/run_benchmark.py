@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the chat hot path
+用假模型和内存存储压测 FastAPI 应用（不需要 LLM API Key 和 MongoDB）
+
+Usage:
+    python benchmarks/run_benchmark.py [--threads 50] [--messages 8] [--concurrency 16]
+                                       [--llm-latency 0.05] [--tokens-per-second 0] [--stream]
+                                       [--trace-memory] [--output results.json] [--baseline baseline.json]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+# Never talk to real services from a benchmark
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+import httpx
+from langgraph.checkpoint.memory import MemorySaver
+
+from app.core.config import settings
+from app.core.metrics import CHAT_STAGE_SECONDS
+from app.services.llm_gateway import llm_gateway
+from benchmarks.fakes import FakeChatModel, InMemoryMemoryService, fake_intent_model
+
+
+# One conversation: small talk, facts worth extracting, a memory command
+PROMPTS = [
+    "你好",
+    "我叫{name}",
+    "我喜欢喝咖啡",
+    "今天天气怎么样",
+    "帮我想一个周末计划",
+    "我讨厌下雨天",
+    "你都知道什么",
+    "给我讲个笑话",
+]
+
+# Stages whose p95 must exceed this (seconds) before a baseline comparison counts them
+MIN_COMPARABLE_SECONDS = 0.001
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def _peak_rss_bytes() -> int:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class StageRecorder:
+    """Keeps every per-stage observation (the metrics histograms only keep buckets)."""
+
+    def __init__(self, histogram):
+        self.samples: dict[str, list[float]] = {}
+        self._histogram = histogram
+        self._observe = histogram.observe
+
+    def __enter__(self):
+        def observe(value, **labels):
+            self.samples.setdefault(labels.get("stage", ""), []).append(value)
+            self._observe(value, **labels)
+        self._histogram.observe = observe
+        return self
+
+    def __exit__(self, *exc):
+        del self._histogram.observe
+
+
+def install_agent_service(service):
+    """Serve ``service`` from the FastAPI app instead of building the production one."""
+    import app.main as main
+    from app.core.runtime import runtime
+    runtime.install(service)
+    return main.app
+
+
+async def run_benchmark(args) -> dict:
+    # In-process only: no Mongo checkpointer or cross-worker invalidation
+    settings.checkpointer_backend = "memory"
+    settings.fact_cache_invalidation = "none"
+    settings.write_behind_enabled = not args.no_write_behind
+
+    from app.services.agent import AgentService
+
+    # tracemalloc is exact but slows Python down severalfold, so it is opt-in;
+    # otherwise memory growth is the change in peak RSS
+    gc.collect()
+    if args.trace_memory:
+        tracemalloc.start()
+        baseline_bytes = tracemalloc.get_traced_memory()[0]
+    else:
+        baseline_bytes = _peak_rss_bytes()
+
+    memory = InMemoryMemoryService(op_latency=args.db_latency)
+    service = AgentService(
+        llm=llm_gateway.wrap(FakeChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second)),
+        intent_llm=llm_gateway.wrap(fake_intent_model(latency=args.intent_latency)),
+        memory=memory,
+        checkpointer=MemorySaver()
+    )
+    app = install_agent_service(service)
+    await service.start()
+
+    threads = [f"bench-{i}" for i in range(args.threads)]
+    pending: asyncio.Queue = asyncio.Queue()
+    for thread_id in threads:
+        pending.put_nowait(thread_id)
+
+    latencies: list[float] = []
+    errors = 0
+    endpoint = "/api/v1/chat/stream" if args.stream else "/api/v1/chat"
+
+    async def run_conversation(client: httpx.AsyncClient, thread_id: str):
+        nonlocal errors
+        for i in range(args.messages):
+            message = PROMPTS[i % len(PROMPTS)].format(name=thread_id)
+            start = time.perf_counter()
+            response = await client.post(endpoint, json={"message": message, "conversation_id": thread_id})
+            if args.stream:
+                await response.aread()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or (args.stream and b'"type": "error"' in response.content):
+                errors += 1
+
+    async def worker(client: httpx.AsyncClient):
+        # Each worker replays whole conversations, so one thread never has two turns in flight
+        while True:
+            try:
+                thread_id = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await run_conversation(client, thread_id)
+
+    transport = httpx.ASGITransport(app=app)
+    with StageRecorder(CHAT_STAGE_SECONDS) as stages:
+        started = time.perf_counter()
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+        duration = time.perf_counter() - started
+        # Drain background persistence so memory numbers include stored facts
+        await service.close()
+
+    gc.collect()
+    if args.trace_memory:
+        used_bytes = tracemalloc.get_traced_memory()[0] - baseline_bytes
+        tracemalloc.stop()
+    else:
+        used_bytes = _peak_rss_bytes() - baseline_bytes
+
+    requests = len(latencies)
+    return {
+        "config": {
+            "threads": args.threads,
+            "messages_per_thread": args.messages,
+            "concurrency": args.concurrency,
+            "endpoint": endpoint,
+            "llm_latency_s": args.llm_latency,
+            "intent_latency_s": args.intent_latency,
+            "tokens_per_second": args.tokens_per_second,
+            "db_latency_s": args.db_latency,
+            "write_behind": settings.write_behind_enabled,
+            "agent_mode": settings.agent_mode,
+            "fact_retrieval_mode": settings.fact_retrieval_mode,
+        },
+        "requests": requests,
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": requests / duration if duration else 0.0,
+        "latency_s": {
+            "request": summarize(latencies),
+            "stages": {stage: summarize(values) for stage, values in sorted(stages.samples.items())},
+        },
+        "memory": {
+            "method": "tracemalloc" if args.trace_memory else "peak_rss",
+            "bytes": used_bytes,
+            "bytes_per_thread": used_bytes / args.threads if args.threads else 0.0,
+            "facts_per_thread": sum(len(facts) for facts in memory.facts.values()) / args.threads if args.threads else 0.0,
+            "conversations_per_thread": sum(len(docs) for docs in memory.conversations.values()) / args.threads if args.threads else 0.0,
+        },
+    }
+
+
+def compare_to_baseline(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions beyond ``tolerance`` (a fraction) relative to a previous result."""
+    regressions = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_rps']:.1f} rps < baseline {baseline['throughput_rps']:.1f} rps")
+
+    current = {"request": result["latency_s"]["request"], **result["latency_s"]["stages"]}
+    previous = {"request": baseline["latency_s"]["request"], **baseline["latency_s"]["stages"]}
+    for name, stats in current.items():
+        before = previous.get(name)
+        if before is None or before["p95"] < MIN_COMPARABLE_SECONDS:
+            continue
+        if stats["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {stats['p95'] * 1000:.1f} ms > baseline {before['p95'] * 1000:.1f} ms")
+
+    same_method = result["memory"]["method"] == baseline["memory"].get("method")
+    if same_method and result["memory"]["bytes_per_thread"] > baseline["memory"]["bytes_per_thread"] * (1 + tolerance):
+        regressions.append(
+            f"memory {result['memory']['bytes_per_thread']:.0f} B/thread > baseline {baseline['memory']['bytes_per_thread']:.0f} B/thread"
+        )
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"{result['requests']} requests, {result['errors']} errors in {result['duration_s']:.2f}s "
+          f"→ {result['throughput_rps']:.1f} req/s")
+    print(f"{'stage':<16} {'count':>7} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    rows = {"request": result["latency_s"]["request"], **result["latency_s"]["stages"]}
+    for name, stats in rows.items():
+        print(f"{name:<16} {stats['count']:>7} {stats['p50'] * 1000:>9.2f} {stats['p95'] * 1000:>9.2f} {stats['p99'] * 1000:>9.2f}")
+    memory = result["memory"]
+    print(f"memory: {memory['bytes_per_thread'] / 1024:.1f} KiB/thread, "
+          f"{memory['facts_per_thread']:.1f} facts/thread, {memory['conversations_per_thread']:.1f} conversations/thread")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat hot path with a fake LLM and in-memory storage")
+    parser.add_argument("--threads", type=int, default=50, help="Number of conversations")
+    parser.add_argument("--messages", type=int, default=8, help="Messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=16, help="Conversations in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake chat model time to first token (s)")
+    parser.add_argument("--intent-latency", type=float, default=0.02, help="Fake intent model latency (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Fake output token rate (0 = instant)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Simulated storage round trip (s)")
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoint instead of /chat")
+    parser.add_argument("--no-write-behind", action="store_true", help="Persist synchronously instead of batching")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure memory with tracemalloc (exact, but slow)")
+    parser.add_argument("--output", help="Write the JSON result to this file")
+    parser.add_argument("--baseline", help="Previous JSON result; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs baseline (fraction)")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+    args = parser.parse_args()
+
+    result = await run_benchmark(args)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+    if args.baseline:
+        regressions = compare_to_baseline(result, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"❌ {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+"""
+Shared fixtures: an AgentService wired to the benchmark fakes (no LLM API key or MongoDB needed)
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("ANTHROPIC_API_KEY", "test")
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from app.services.agent import AgentService
+from benchmarks.fakes import FakeChatModel, InMemoryMemoryService, fake_intent_model
+
+
+@pytest.fixture
+def make_agent():
+    def make(llm=None) -> AgentService:
+        return AgentService(
+            llm=llm or FakeChatModel(latency=0.01),
+            intent_llm=fake_intent_model(latency=0),
+            memory=InMemoryMemoryService(),
+            checkpointer=MemorySaver()
+        )
+    return make
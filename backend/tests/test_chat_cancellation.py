@@ -0,0 +1,49 @@
+"""
+A turn abandoned mid-reply must leave no trace in the thread's checkpoint
+"""
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.fakes import FakeChatModel
+
+
+def _transcript(messages) -> list[tuple[str, str]]:
+    return [(message.type, message.content if isinstance(message, HumanMessage) else "") for message in messages]
+
+
+def test_closed_stream_is_discarded_before_the_next_turn(make_agent):
+    agent = make_agent(FakeChatModel(latency=0.01, tokens_per_second=200))
+
+    async def scenario():
+        await agent.chat("你好", "t")
+        stream = agent.chat_stream("讲个笑话", "t")
+        async for event in stream:
+            if event["type"] == "token":
+                break
+        # Queued behind the streamed turn on the thread lock
+        queued = asyncio.create_task(agent.chat("第二条消息", "t"))
+        await asyncio.sleep(0.01)
+        await stream.aclose()
+        await queued
+        return await agent.get_conversation_history("t")
+
+    messages = asyncio.run(scenario())
+    assert _transcript(messages) == [("human", "你好"), ("ai", ""), ("human", "第二条消息"), ("ai", "")]
+    assert isinstance(messages[-1], AIMessage)
+
+
+def test_timed_out_batch_item_is_discarded(make_agent):
+    agent = make_agent(FakeChatModel(latency=0.3))
+
+    async def scenario():
+        await agent.chat("你好", "t")
+        results = [result async for result in agent.chat_batch([{"message": "慢消息", "conversation_id": "t"}],
+                                                               item_timeout=0.1)]
+        agent.llm.latency = 0.01
+        await agent.chat("第二条消息", "t")
+        return results, await agent.get_conversation_history("t")
+
+    results, messages = asyncio.run(scenario())
+    assert [result["status"] for result in results] == ["timeout"]
+    assert _transcript(messages) == [("human", "你好"), ("ai", ""), ("human", "第二条消息"), ("ai", "")]
@@ -0,0 +1,49 @@
+"""
+Relevance indexes expire like cached facts and are never built from a failed read
+"""
+import asyncio
+
+from app.services import fact_index
+from app.services.fact_index import FactIndexStore
+
+from benchmarks.fakes import InMemoryMemoryService
+
+
+def test_index_is_rebuilt_after_its_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fact_index.time, "monotonic", lambda: now[0])
+    store = FactIndexStore(dim=64, ttl_seconds=300)
+    store.build("t", [{"fact_type": "preference", "content": "喜欢咖啡"}], store.generation("t"))
+
+    now[0] += 299
+    assert store.get("t") is not None
+    now[0] += 2
+    assert store.get("t") is None
+
+
+class FlakyMemoryService(InMemoryMemoryService):
+    def __init__(self):
+        super().__init__()
+        self.fact_index = FactIndexStore(dim=64)
+        self.failures = 1
+
+    async def _fetch_all_facts(self, thread_id: str) -> list[dict]:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("primary stepped down")
+        return await super()._fetch_all_facts(thread_id)
+
+
+def test_failed_read_is_not_cached():
+    async def scenario():
+        memory = FlakyMemoryService()
+        memory.facts["t"] = {("preference", "喜欢咖啡"): {
+            "thread_id": "t", "fact_type": "preference", "content": "喜欢咖啡", "importance": 0.5,
+        }}
+        first = await memory.get_relevant_fact_context("t", "咖啡", token_budget=400)
+        second = await memory.get_relevant_fact_context("t", "咖啡", token_budget=400)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == ""
+    assert "喜欢咖啡" in second
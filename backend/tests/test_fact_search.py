@@ -0,0 +1,62 @@
+"""
+Fact deletes resolve through the token index, including partial words and facts saved before it
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.agent import MongoMemoryService
+from app.services.fact_search import TOKENS_VERSION, fact_matches, fact_tokens, query_tokens
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def test_partial_words_are_covered_by_fact_tokens():
+    tokens = set(fact_tokens("I love Coffee, 我喜欢喝茶"))
+    for query in ("coff", "love coffee", "喝茶", "茶", "Coffee, 我"):
+        assert fact_matches(query, "I love Coffee, 我喜欢喝茶")
+        assert set(query_tokens(query)) <= tokens, query
+
+
+def test_long_words_are_indexed_by_a_bounded_prefix():
+    word = "supercalifragilisticexpialidocious"
+    assert max(map(len, fact_tokens(word))) < len(word)
+    assert set(query_tokens(word)) <= set(fact_tokens(word))
+
+
+def make_memory(db) -> MongoMemoryService:
+    return MongoMemoryService(pool=SimpleNamespace(get_database=lambda: db))
+
+
+def test_delete_facts_uses_the_index_once_facts_are_backfilled():
+    asyncio.run(_delete_facts_before_and_after_backfill())
+
+
+async def _delete_facts_before_and_after_backfill():
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    # Saved by an earlier release: no tokens, or whole-word tokens only
+    await db["long_term_memory"].insert_many([
+        {"thread_id": "t", "fact_type": "preference", "content": "I love coffee", "importance": 0.5},
+        {"thread_id": "t", "fact_type": "preference", "content": "I drink tea", "tokens": ["drink", "i", "tea"],
+         "importance": 0.5},
+    ])
+
+    memory = make_memory(db)
+    await memory.ensure_indexes(backfill=False)
+    report = await memory.delete_facts("t", "coff", dry_run=True)
+    assert [fact["content"] for fact in report["matched"]] == ["I love coffee"]
+    assert report["examined"] == 2  # both outdated facts were scanned
+
+    assert await memory.backfill_fact_tokens() == 2
+    assert await db["long_term_memory"].count_documents({"tokens_version": TOKENS_VERSION}) == 2
+    report = await memory.delete_facts("t", "dri")
+    assert report["deleted"] == 1 and report["examined"] == 1
+
+    # A later start finds the marker and skips the scan
+    restarted = make_memory(db)
+    await restarted.ensure_indexes()
+    assert restarted._backfill_task is None
+    assert (await restarted.delete_facts("t", "love c", dry_run=True))["examined"] == 1
+    await memory.close()
+    await restarted.close()
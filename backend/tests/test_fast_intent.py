@@ -0,0 +1,30 @@
+"""
+Fast-path confidences follow the strength of the match, so the threshold decides what escalates
+"""
+from app.services.fast_intent import FastIntentClassifier
+
+
+def test_memory_command_without_a_trigger_phrase_is_escalated():
+    classifier = FastIntentClassifier(threshold=0.9)
+    for message in ("把那条记录删掉", "不用再记着我住北京了"):
+        result = classifier.classify(message)
+        assert result["intent"] == "chat" and result["confidence"] < 0.9, message
+        assert classifier.try_classify(message) is None
+
+
+def test_confidence_grows_with_command_coverage():
+    classifier = FastIntentClassifier()
+    bare = classifier.classify("忘记我喜欢咖啡")
+    polite = classifier.classify("麻烦你忘记我喜欢咖啡")
+    assert bare["intent"] == polite["intent"] == "delete_memory"
+    assert bare["extracted_info"]["query"] == polite["extracted_info"]["query"] == "我喜欢咖啡"
+    assert bare["confidence"] > polite["confidence"]
+
+
+def test_threshold_trades_hit_rate_for_recall():
+    lenient, strict = FastIntentClassifier(threshold=0.8), FastIntentClassifier(threshold=0.95)
+    assert lenient.try_classify("记得提醒我喝水") is not None
+    assert strict.try_classify("麻烦你忘记我喜欢咖啡") is None
+    for classifier in (lenient, strict):
+        assert classifier.try_classify("今天天气怎么样")["intent"] == "chat"
+        assert classifier.try_classify("清空记忆")["intent"] == "clear_memories"
@@ -0,0 +1,66 @@
+"""
+Checkpoints written concurrently for one thread must not share channel blobs
+"""
+import asyncio
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app.services.mongo_checkpointer import MongoCheckpointSaver
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+def make_savers(count: int) -> list[MongoCheckpointSaver]:
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+
+    async def db_provider():
+        return db
+
+    return [MongoCheckpointSaver(db_provider) for _ in range(count)]
+
+
+def checkpoint_with(saver, value, current=None):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_versions"]["summary"] = saver.get_next_version(current, None)
+    checkpoint["channel_values"]["summary"] = value
+    return checkpoint
+
+
+def test_two_savers_writing_the_same_thread_keep_their_own_values():
+    asyncio.run(_two_savers_writing_the_same_thread())
+
+
+async def _two_savers_writing_the_same_thread():
+    first, second = make_savers(2)
+    config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+
+    # Both workers continue the thread from the same parent state
+    a = checkpoint_with(first, "from worker a")
+    b = checkpoint_with(second, "from worker b")
+    config_a = await first.aput(config, a, {}, dict(a["channel_versions"]))
+    config_b = await second.aput(config, b, {}, dict(b["channel_versions"]))
+
+    assert a["channel_versions"]["summary"] != b["channel_versions"]["summary"]
+    assert (await second.aget_tuple(config_a)).checkpoint["channel_values"] == {"summary": "from worker a"}
+    assert (await first.aget_tuple(config_b)).checkpoint["channel_values"] == {"summary": "from worker b"}
+
+
+def test_integer_versions_from_earlier_releases_still_load():
+    asyncio.run(_integer_versions_still_load())
+
+
+async def _integer_versions_still_load():
+    (saver,) = make_savers(1)
+    config = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_versions"]["summary"] = 3
+    checkpoint["versions_seen"]["agent"] = {"summary": 2}
+    checkpoint["channel_values"]["summary"] = "legacy"
+    saved = await saver.aput(config, checkpoint, {}, {"summary": 3})
+
+    loaded = (await saver.aget_tuple(saved)).checkpoint
+    assert loaded["channel_values"] == {"summary": "legacy"}
+    version = loaded["channel_versions"]["summary"]
+    assert version > loaded["versions_seen"]["agent"]["summary"]
+    assert saver.get_next_version(version, None) > version
@@ -17,10 +17,132 @@ export const chatAPI = {
     return response.data
   },
 
-  async getHistory(conversationId) {
-    const response = await api.get(`/api/v1/conversations/${conversationId}/history`)
+  // Stream a reply via Server-Sent Events; onEvent receives each parsed event.
+  // Uses fetch instead of axios so long answers are not cut off by the timeout.
+  async stream(message, conversationId = null, onEvent = () => {}) {
+    const response = await fetch(`${api.defaults.baseURL}/api/v1/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message, conversation_id: conversationId })
+    })
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const chunk = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+        if (!chunk.startsWith('data: ')) continue
+
+        const event = JSON.parse(chunk.slice(6))
+        if (event.type === 'error') throw new Error(event.detail)
+        if (event.type === 'done') result = event
+        onEvent(event)
+      }
+    }
+    return result
+  },
+
+  // params: { limit, before, since } (cursors come from a previous page)
+  async getHistory(conversationId, params = {}) {
+    const response = await api.get(`/api/v1/conversations/${conversationId}/history`, { params })
     return response.data
   }
 }
 
+// One persistent WebSocket per page: turns are multiplexed by id, can be cancelled,
+// and skip the per-request setup of /chat/stream. Connects lazily and reconnects on
+// the next send after the socket drops.
+export class ChatSocket {
+  constructor() {
+    this.ws = null
+    this.opening = null
+    this.turns = new Map()
+    this.nextId = 1
+  }
+
+  url() {
+    const base = api.defaults.baseURL || window.location.origin
+    return base.replace(/^http/, 'ws') + '/api/v1/chat/ws'
+  }
+
+  connect() {
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) return Promise.resolve()
+    if (this.opening) return this.opening
+
+    this.opening = new Promise((resolve, reject) => {
+      const ws = new WebSocket(this.url())
+      ws.onopen = () => {
+        this.ws = ws
+        this.opening = null
+        resolve()
+      }
+      ws.onerror = () => {
+        this.opening = null
+        reject(new Error('WebSocket 连接失败'))
+      }
+      ws.onclose = () => {
+        this.ws = null
+        for (const turn of this.turns.values()) turn.reject(new Error('连接已断开'))
+        this.turns.clear()
+      }
+      ws.onmessage = (message) => this.dispatch(JSON.parse(message.data))
+    })
+    return this.opening
+  }
+
+  dispatch(event) {
+    if (event.type === 'ping') {
+      this.ws.send(JSON.stringify({ type: 'pong' }))
+      return
+    }
+    const turn = this.turns.get(event.id)
+    if (!turn) return
+
+    if (event.type === 'error') {
+      this.turns.delete(event.id)
+      turn.reject(new Error(event.detail))
+    } else if (event.type === 'cancelled') {
+      this.turns.delete(event.id)
+      turn.resolve(null)
+    } else {
+      turn.onEvent(event)
+      if (event.type === 'done') {
+        this.turns.delete(event.id)
+        turn.resolve(event)
+      }
+    }
+  }
+
+  // Same contract as chatAPI.stream: resolves with the done event (null if cancelled).
+  // The turn id is passed to onStart so the caller can cancel it.
+  async send(message, conversationId = null, onEvent = () => {}, onStart = () => {}) {
+    await this.connect()
+    const id = String(this.nextId++)
+    const result = new Promise((resolve, reject) => {
+      this.turns.set(id, { onEvent, resolve, reject })
+    })
+    this.ws.send(JSON.stringify({ type: 'chat', id, message, conversation_id: conversationId }))
+    onStart(id)
+    return result
+  }
+
+  cancel(id) {
+    if (this.ws && this.turns.has(id)) {
+      this.ws.send(JSON.stringify({ type: 'cancel', id }))
+    }
+  }
+}
+
 export default api
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Backfill fact tokens
+为旧的长期记忆补充（或按新的分词方式重建）tokens 字段，使删除记忆可以走 (thread_id, tokens) 索引
+服务启动时若 migrations 中没有完成标记，会在后台自动执行一次同样的补充；此脚本用于不启动服务时手动执行
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[1] / "backend" / ".env")
+
+from app.core.database import mongo_pool
+from app.services.agent import MongoMemoryService
+
+
+async def main():
+    memory = MongoMemoryService()
+    try:
+        await memory.ensure_indexes(backfill=False)
+        updated = await memory.backfill_fact_tokens()
+        print(f"✅ 已为 {updated} 条记忆补充 tokens")
+    finally:
+        await memory.close()
+        await mongo_pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare the two-call and single-call agent modes
+对比两种 Agent 模式的延迟和 token 消耗（含 Prompt 缓存读写；需要真实的 LLM API Key 和 MongoDB）
+
+Usage:
+    python scripts/compare_agent_modes.py [--rounds 3] [--json]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[1] / "backend" / ".env")
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from app.core.config import settings
+from app.services.agent import AgentService
+from app.services.llm_gateway import usage_tokens
+
+
+# A typical mix: mostly chat, a few memory commands
+PROMPTS = [
+    "你好",
+    "我喜欢喝咖啡",
+    "帮我算一下 12 * 34",
+    "现在几点了",
+    "你都知道什么",
+    "忘记我喜欢喝咖啡",
+    "给我讲个笑话",
+    "清空记忆",
+]
+
+
+class UsageCounter(AsyncCallbackHandler):
+    """Counts LLM calls and tokens across every model call of a turn."""
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+
+    async def on_llm_end(self, response, **kwargs):
+        self.calls += 1
+        for generations in response.generations:
+            for generation in generations:
+                tokens = usage_tokens(getattr(generation, "message", None))
+                self.input_tokens += tokens["input"] or 0
+                self.output_tokens += tokens["output"] or 0
+                self.cache_read_tokens += tokens["cache_read"] or 0
+                self.cache_write_tokens += tokens["cache_write"] or 0
+
+
+async def run_mode(mode: str, rounds: int) -> dict:
+    settings.agent_mode = mode
+    agent = AgentService()
+    counter = UsageCounter()
+    agent.llm.callbacks = [counter]
+    agent.intent_recognizer.llm.callbacks = [counter]
+    if agent.intent_recognizer.cache:
+        agent.intent_recognizer.cache.max_size = 0  # Measure real calls, not cache hits
+
+    latencies = []
+    try:
+        for _ in range(rounds):
+            conversation_id = f"compare-{mode}-{uuid.uuid4().hex[:8]}"
+            for prompt in PROMPTS:
+                start = time.perf_counter()
+                await agent.chat(prompt, conversation_id)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        await agent.close()
+
+    messages = len(latencies)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "messages": messages,
+        "latency_mean_s": statistics.mean(latencies),
+        "latency_p50_s": latencies[messages // 2],
+        "latency_p95_s": latencies[min(messages - 1, int(messages * 0.95))],
+        "llm_calls_per_message": counter.calls / messages,
+        "input_tokens_per_message": counter.input_tokens / messages,
+        "output_tokens_per_message": counter.output_tokens / messages,
+        "cache_read_tokens_per_message": counter.cache_read_tokens / messages,
+        "cache_write_tokens_per_message": counter.cache_write_tokens / messages,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare two_call and single_call agent modes")
+    parser.add_argument("--rounds", type=int, default=3, help="How many times to replay the prompt set")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable JSON")
+    args = parser.parse_args()
+
+    results = [await run_mode(mode, args.rounds) for mode in ("two_call", "single_call")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<12} {'mean(s)':>8} {'p50(s)':>8} {'p95(s)':>8} {'calls/msg':>10} {'in tok/msg':>11} {'out tok/msg':>12} {'cache r/w per msg':>18}")
+    for r in results:
+        print(
+            f"{r['mode']:<12} {r['latency_mean_s']:>8.2f} {r['latency_p50_s']:>8.2f} {r['latency_p95_s']:>8.2f} "
+            f"{r['llm_calls_per_message']:>10.2f} {r['input_tokens_per_message']:>11.0f} {r['output_tokens_per_message']:>12.0f} "
+            f"{r['cache_read_tokens_per_message']:>8.0f}/{r['cache_write_tokens_per_message']:<9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,27 +4,26 @@ Daily Planning Script for Personal Agent
 每晚自动规划第二天的开发任务
 """
 import sys
-sys.path.append('/Users/fufu/clawd/personal-agent/backend')
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
 
 from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
-from app.core.config import settings
+from typing import Optional
+from app.core.database import MongoPoolManager, mongo_pool
 
 
 class PlanningService:
     """任务规划服务"""
 
-    def __init__(self):
-        self.connection_string = settings.mongodb_connection_string
-        self.client = None
+    def __init__(self, pool: Optional[MongoPoolManager] = None):
+        self.pool = pool or mongo_pool
         self._db = None
         self._plans = None
 
     async def _get_collections(self):
-        """初始化 MongoDB 连接"""
+        """初始化 MongoDB 集合（连接池由 mongo_pool 统一管理）"""
         if self._plans is None:
-            self.client = AsyncIOMotorClient(self.connection_string)
-            self._db = self.client["agent_planning"]
+            self._db = self.pool.get_database("agent_planning")
             self._plans = self._db["development_plans"]
 
             await self._plans.create_index([("date", -1)])
@@ -104,10 +103,8 @@ class PlanningService:
             return []
 
     async def close(self):
-        """关闭连接"""
-        if self.client:
-            self.client.close()
-            self._plans = None
+        """释放集合引用（共享连接池由其所有者关闭）"""
+        self._plans = None
 
 
 async def generate_daily_plan() -> str:
@@ -232,6 +229,7 @@ async def main():
 
         # 关闭连接
         await planning.close()
+        await mongo_pool.close()
 
     except Exception as e:
         print(f"❌ 计划生成失败: {e}")
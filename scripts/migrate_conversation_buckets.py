@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Migrate conversations to time-bucketed storage
+把每轮一条文档的 conversations 集合迁移到按会话和时间窗口分桶的 conversation_buckets，
+校验迁移结果，并把冷数据桶压缩转存到 conversation_archive
+
+Usage:
+    python scripts/migrate_conversation_buckets.py migrate [--thread ID ...]
+    python scripts/migrate_conversation_buckets.py verify
+    python scripts/migrate_conversation_buckets.py archive [--older-than-days 30]
+
+迁移可以重复执行（已迁移的桶会被替换，不影响新写入的桶）。建议步骤：
+先执行 migrate，设置 CONVERSATION_STORAGE=buckets 并重启，再执行一次 migrate 补齐切换前写入的对话。
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "backend"))
+
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).resolve().parents[1] / "backend" / ".env")
+
+from app.core.config import settings
+from app.core.database import mongo_pool
+from app.services.conversation_buckets import ConversationBucketStore
+
+
+async def main(args):
+    db = mongo_pool.get_database()
+    store = ConversationBucketStore(
+        db["conversation_buckets"],
+        db["conversation_archive"],
+        window=timedelta(hours=settings.conversation_bucket_hours),
+        max_turns=settings.conversation_bucket_max_turns
+    )
+    try:
+        await store.ensure_indexes()
+        start = time.perf_counter()
+
+        if args.command == "migrate":
+            report = await store.migrate(db["conversations"], thread_ids=args.thread)
+            print(f"✅ 已迁移 {report['threads']} 个会话、{report['turns']} 轮对话，"
+                  f"生成 {report['buckets']} 个桶（{time.perf_counter() - start:.1f}s）")
+
+        elif args.command == "verify":
+            source = await db["conversations"].count_documents({})
+            bucketed = await store.count_turns()
+            print(f"conversations: {source} 轮，buckets + archive: {bucketed} 轮")
+            if bucketed < source:
+                print("❌ 分桶存储中的对话少于原集合，请重新执行 migrate")
+                sys.exit(1)
+            print("✅ 校验通过（切换后新写入的对话只存在于分桶存储中）")
+
+        elif args.command == "archive":
+            report = await store.archive_cold(timedelta(days=args.older_than_days))
+            ratio = report["bytes_after"] / report["bytes_before"] if report["bytes_before"] else 0
+            print(f"✅ 已归档 {report['archived']} 个桶、{report['turns']} 轮对话，"
+                  f"压缩后为原来的 {ratio:.0%}（{time.perf_counter() - start:.1f}s）")
+    finally:
+        await mongo_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate conversations to time-bucketed storage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Copy conversations into buckets (re-runnable)")
+    migrate.add_argument("--thread", action="append", help="Only migrate this thread (repeatable)")
+    subparsers.add_parser("verify", help="Compare turn counts between the two layouts")
+    archive = subparsers.add_parser("archive", help="Move cold buckets to the compressed archive")
+    archive.add_argument("--older-than-days", type=float, default=settings.conversation_archive_after_days)
+    asyncio.run(main(parser.parse_args()))